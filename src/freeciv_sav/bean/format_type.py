@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import pandas as pd
+import numpy as np
 from freeciv_sav.bean.parse_type import ParseTypeBean
 
 class FormatTypeBean(object):
@@ -65,7 +65,45 @@ class FormatTypeBean(object):
         return _dic
 
     @staticmethod
-    def line_from_dataframe(df: pd.DataFrame, key: str):
+    def line_from_map_array(array: np.ndarray, prefix: str, suffix: str = ""):
+        """
+        Encode a 2-d array of SavParser.get_map_array into sav rows: {prefix####: line}.
+        uint8 arrays are written as characters, integer arrays as comma-separated
+        values with `-` for negatives.
+
+        suffix: appended to every row, like the trailing "," of the worked rows.
+        """
+        _dic = dict()
+        if array.dtype == np.uint8:
+            data = np.ascontiguousarray(array).tobytes().decode("ascii")
+            xsize = array.shape[1]
+            for y in range(array.shape[0]):
+                key = f"{prefix}{y:04d}"
+                _dic[key] = key + '="' + data[y*xsize:(y+1)*xsize] + suffix + '"'
+        else:
+            for y, row in enumerate(array.tolist()):
+                key = f"{prefix}{y:04d}"
+                _dic[key] = key + '="' + ",".join("-" if v < 0 else str(v) for v in row) + suffix + '"'
+        return _dic
+
+    @staticmethod
+    def strings_from_bits(bits: np.ndarray):
+        """Encode a 2-d boolean array into "0/1" strings, one per row."""
+        bits = np.atleast_2d(bits)
+        data = np.where(bits, ord("1"), ord("0")).astype(np.uint8).tobytes().decode("ascii")
+        width = bits.shape[1]
+        return [data[i*width:(i+1)*width] for i in range(bits.shape[0])]
+
+    @staticmethod
+    def string_from_mask(mask: int, length: int):
+        """Encode an int bitmask into a "0/1" string of length, bit i as the i-th character."""
+        return format(mask, f"0{length}b")[::-1]
+
+    @staticmethod
+    def line_from_dataframe(df, key: str):
+        """
+        Data structure: SavTable or pandas.DataFrame
+        """
         columns = df.columns
         first_row = "{"+",".join(['"'+col+'"' for col in df.columns])
         immediate_rows = list()
@@ -84,4 +122,5 @@ class FormatTypeBean(object):
         return uid
 
 if __name__ == "__main__":
+    import pandas as pd
     print(FormatTypeBean.line_from_dataframe(pd.DataFrame({"id": [1, 2], "x": [1, 2], "y": [3, 4]})))
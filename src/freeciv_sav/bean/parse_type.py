@@ -86,6 +86,20 @@ class ParseTypeBean(object):
             return '""'
         return value
     
+    @staticmethod
+    def bits_from_strings(values):
+        """
+        Decode "0/1" strings of the same length, like the `done` vectors of research,
+        into a boolean array of shape (len(values), length).
+        """
+        data = "".join(values).encode("ascii")
+        return (np.frombuffer(data, dtype=np.uint8) == ord("1")).reshape(len(values), -1)
+
+    @staticmethod
+    def mask_from_bits(value: str):
+        """Decode a "0/1" string into an int whose bit i is the i-th character."""
+        return int(value[::-1], 2)
+
     @staticmethod
     def set_event(value):
         if_flag = False
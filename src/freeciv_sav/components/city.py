@@ -13,16 +13,28 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import math
 import numpy as np
 import random
+from freeciv_sav.parser.table import SavTable
+from freeciv_sav.components.topology import Topology, CITY_RADIUS_SQ, DEFAULT_TOPOLOGY
+from freeciv_sav.components.transform import MapTransform
 
-CITY_SCOPE_DEPTH = 2
+# half width of the city work area
+CITY_SCOPE_DEPTH = math.isqrt(CITY_RADIUS_SQ)
 EMPTY_SIGNAL = "-"
 
 class CityTool(object):
 
-    def __init__(self, player_city_data, global_owner_data=None, global_eowner_data=None, global_source_data=None, global_worked_data=None):
-        self._player_city_data = player_city_data
+    def __init__(self, player_city_data, global_owner_data=None, global_eowner_data=None, global_source_data=None, global_worked_data=None,
+                 topology:str=None):
+        """
+        player_city_data: {player_id: {"c": SavTable or pandas.DataFrame}}
+        topology: wrap rules of the map, like Topology.from_sav, DEFAULT_TOPOLOGY by default.
+        """
+        self.topology = DEFAULT_TOPOLOGY if topology is None else topology
+        self._player_city_data = {player_id: {key: SavTable.adapt(table) for key, table in tables.items()}
+                                  for player_id, tables in player_city_data.items()}
         self._global_owner_data = {"map": [], "key": []}
         self._global_source_data = {"map": [], "key": []}
         self._global_eowner_data = {"map": [], "key": []}
@@ -57,28 +69,21 @@ class CityTool(object):
         return output
 
     def rotation_location(self, rotation_angle):
-        center_x = int(self.xsize/2) - 1
-        center_y = int(self.ysize/2) - 1
-        for index, player_id in enumerate(self._player_city_data):
+        """Rotate the cities and their tiles by a multiple of pi/2, like MapTool.gen_rotation_shift_map."""
+        self.transform_location(MapTransform(self.xsize, self.ysize, MapTransform.get_quarter_turns(rotation_angle)))
+        return
+
+    def transform_location(self, map_transform):
+        """Move the cities and the owner, eowner, source and worked layers by the MapTransform of their map."""
+        for player_id in self._player_city_data:
             if "c" in self._player_city_data[player_id]:
                 c_df = self._player_city_data[player_id]["c"]
-                city_uid_list = list()
-                x_list = list()
-                y_list = list()
-                for city_i, city_raw in self._player_city_data[player_id]["c"].iterrows():
-                    x = city_raw['x']
-                    y = city_raw['y']
-                    _x = round(float(x-center_x) * np.cos(rotation_angle) - float(y-center_y) * np.sin(rotation_angle) + center_x) % self.xsize
-                    _y = round(float(x-center_x) * np.sin(rotation_angle) + float(y-center_y) * np.cos(rotation_angle) + center_y)
-                    c_df.loc[city_i, "x"] = _x
-                    c_df.loc[city_i, "y"] = _y
-                    city_uid = c_df.loc[city_i, "id"]
-                    player_uid = c_df.loc[city_i, "original"]
-                    city_uid_list.append(str(city_uid))
-                    x_list.append(_x)
-                    y_list.append(_y)
-                self.set_titles_from_cities(str(player_uid), city_uid_list, x_list, y_list)
+                xs, ys = map_transform.move(c_df["x"], c_df["y"])
+                c_df["x"], c_df["y"] = xs.tolist(), ys.tolist()
                 self._player_city_data[player_id]["c"] = c_df
+        for _data in [self._global_owner_data, self._global_source_data, self._global_eowner_data, self._global_worked_data]:
+            if len(_data["map"][0]) > 0:
+                map_transform.apply_rows(_data["map"])
         return
 
     def set_location_with_cluster(self, clusters, 
@@ -94,11 +99,11 @@ class CityTool(object):
                 city_i = 0
                 while city_i < self._player_city_data[player_id]["c"].shape[0]:
                     _clu = cluster.pop()
-                    c_df.loc[city_i, "x"] = _clu[0]
-                    c_df.loc[city_i, "y"] = _clu[1]
+                    c_df.at[city_i, "x"] = _clu[0]
+                    c_df.at[city_i, "y"] = _clu[1]
                     self._player_city_data[player_id]["c"] = c_df
-                    player_uid = c_df.loc[city_i, "original"]
-                    city_uid = c_df.loc[city_i, "id"]
+                    player_uid = c_df.at[city_i, "original"]
+                    city_uid = c_df.at[city_i, "id"]
                     self.set_titles(str(player_uid), str(city_uid), _clu[0], _clu[1])
                     city_i += 1
         return 
@@ -111,14 +116,14 @@ class CityTool(object):
             if "c" in self._player_city_data[player_id]:
                 c_df = self._player_city_data[player_id]["c"]
                 for city_i, _ in self._player_city_data[player_id]["c"].iterrows():
-                    city_uid = str(c_df.loc[city_i, "id"])
+                    city_uid = str(c_df.at[city_i, "id"])
                     if city_uid in worked_cnt:
-                        c_df.loc[city_i, "size"] = worked_cnt[city_uid] - 1
+                        c_df.at[city_i, "size"] = worked_cnt[city_uid] - 1
                 self._player_city_data[player_id]["c"] = c_df
         return 
     
     def set_titles(self, player_uid, city_uid, x, y):
-        scope_yx_list = self.cal_city_scope_with_loop(x, y, self.xsize, self.ysize)
+        scope_yx_list = self.cal_city_scope_with_loop(x, y, self.xsize, self.ysize, self.topology)
         source_uid = None
         worked_cnt = 0
         print(player_uid, city_uid, self._global_worked_data["map"])
@@ -201,7 +206,7 @@ class CityTool(object):
         for index, city_uid in enumerate(city_uid_list):
             print(city_uid)
             x, y = xlist[index], ylist[index]
-            scope_yx_list = self.cal_city_scope_with_half_loop(x, y, self.xsize, self.ysize)
+            scope_yx_list = self.cal_city_scope_with_half_loop(x, y, self.xsize, self.ysize, self.topology)
             for i in range(len(self._global_eowner_data["map"])):
                 for j in range(len(self._global_eowner_data["map"][0])):
                     ## source mask
@@ -233,44 +238,20 @@ class CityTool(object):
     
     @staticmethod
     def cal_city_scope(x, y):
-        row_len = CITY_SCOPE_DEPTH * 2 + 1
-        vision_list = [(-CITY_SCOPE_DEPTH+j, -CITY_SCOPE_DEPTH+i) for j in range(row_len) for i in range(row_len) 
-                       if abs(-CITY_SCOPE_DEPTH+j)+abs(-CITY_SCOPE_DEPTH+i) != 2*CITY_SCOPE_DEPTH]
-        location_list = []
-        for i, vision in enumerate(vision_list):
-            location_list.append([y+vision[0], x+vision[1]])
-        return location_list
+        """Work area of a city at x, y as a list of [y, x], not wrapped."""
+        return (Topology.get_offsets(CITY_RADIUS_SQ) + [y, x]).tolist()
     
     @staticmethod
-    def cal_city_scope_with_half_loop(x, y, xsize, ysize):
-        row_len = CITY_SCOPE_DEPTH * 2 + 1
-        vision_list = [(-CITY_SCOPE_DEPTH+j, -CITY_SCOPE_DEPTH+i) for j in range(row_len) for i in range(row_len) 
-                       if abs(-CITY_SCOPE_DEPTH+j)+abs(-CITY_SCOPE_DEPTH+i) != 2*CITY_SCOPE_DEPTH]
-        location_list = []
-        for i, vision in enumerate(vision_list):
-            if xsize is not None and ysize is not None:
-                _y = (y+vision[0])
-                _x = (x+vision[1]) % xsize
-            else:
-                _y, _x = y+vision[0], x+vision[1]
-            if _y >= 0 and _y < ysize:
-                location_list.append([_y, _x])
-        return location_list
+    def cal_city_scope_with_half_loop(x, y, xsize, ysize, topology:str=None):
+        """Work area of a city at x, y, wrapped by the topology of the map, along x only by default."""
+        return Topology.get(xsize, ysize, topology).get_locations(x, y, CITY_RADIUS_SQ)
 
     @staticmethod
-    def cal_city_scope_with_loop(x, y, xsize, ysize):
-        row_len = CITY_SCOPE_DEPTH * 2 + 1
-        vision_list = [(-CITY_SCOPE_DEPTH+j, -CITY_SCOPE_DEPTH+i) for j in range(row_len) for i in range(row_len) 
-                       if abs(-CITY_SCOPE_DEPTH+j)+abs(-CITY_SCOPE_DEPTH+i) != 2*CITY_SCOPE_DEPTH]
-        location_list = []
-        for i, vision in enumerate(vision_list):
-            if xsize is not None and ysize is not None:
-                _y = (y+vision[0]) % ysize
-                _x = (x+vision[1]) % xsize
-            else:
-                _y, _x = y+vision[0], x+vision[1]
-            location_list.append([_y, _x])
-        return location_list
+    def cal_city_scope_with_loop(x, y, xsize, ysize, topology:str=None):
+        """Work area of a city at x, y, wrapped by the topology of the map if the sizes are given."""
+        if xsize is None or ysize is None:
+            return CityTool.cal_city_scope(x, y)
+        return Topology.get(xsize, ysize, topology).get_locations(x, y, CITY_RADIUS_SQ)
 
     def get_location(self):
         output = dict()
@@ -279,7 +260,7 @@ class CityTool(object):
                 c_df = self._player_city_data[player_id]["c"]
                 output[player_id] = dict()
                 for i in range(c_df.shape[0]):
-                    output[player_id].update({c_df.iloc[i]["id"]: {"location": [c_df.iloc[i]["x"], c_df.iloc[i]["y"]]}})
+                    output[player_id].update({c_df.at[i, "id"]: {"location": [c_df.at[i, "x"], c_df.at[i, "y"]]}})
         return output
 
     def get_citizens_cnt(self):
@@ -289,5 +270,5 @@ class CityTool(object):
             if "c" in self._player_city_data[player_id]:
                 c_df = self._player_city_data[player_id]["c"]
                 for i, _ in c_df.iterrows():
-                    output[player_id] += c_df.iloc[i]["size"]
+                    output[player_id] += c_df.at[i, "size"]
         return output
@@ -13,16 +13,19 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import random
 import copy
-import pandas as pd
 import numpy as np
 from collections import OrderedDict
 from freeciv_sav.utils.dic_tools import exchange_key, dict_sum, exchange_key_value, dict_sum_by_list, dict_minus_by_list
 from freeciv_sav.components.city import CityTool, CITY_SCOPE_DEPTH
+from freeciv_sav.components.topology import Topology, DEFAULT_TOPOLOGY, CITY_RADIUS_SQ
+from freeciv_sav.components.transform import MapTransform
 from freeciv_sav.bean.property import PropertyBean
 from freeciv_sav.components.unit import UnitTool
 from freeciv_sav.components.terrain import TerrainTool
+from freeciv_sav.components.resource import ResourceTool, EXTRA_DIGITS, EXTRA_LAYER_MASK
 
 # terrain signal
 UNSEEN_SIGNAL = "u"
@@ -33,6 +36,23 @@ FPT_ZERO_SIGNAL_LIST = ["i", " ", ":", "a"]
 OCEAN_TERRAIN_LIST = [" ", ":"]
 PLAYER_TERRAIN_SIGNAL = "map_t"
 
+# yields of a tile
+FPT_KEYS = ["food", "shield", "trade"]
+# yield grids kept by a MapTool, for the maps queried last
+YIELD_GRID_CACHE_SIZE = 4
+# actions of a batched walk to bring a city center back in the score bound
+WALK_MAX_ACTIONS = 100
+# rounds of gen_random_walk_maps walking again the maps left out of the score bound
+WALK_MAX_RETRIES = 3
+# connectivity layers kept by a MapTool, for the maps labeled last
+CONNECTIVITY_CACHE_SIZE = 8
+# placements of the unit clusters tried before giving up
+CLUSTER_MAX_TRIES = 10
+# players of a layer of the known map, k00 for players 0-3, k01 for 4-7..., a hex digit of their bits per tile
+KNOWN_LAYER_PLAYERS = 4
+KNOWN_LAYER_PATTERN = r"k(\d\d)_"
+KNOWN_DIGITS = "0123456789abcdef"
+
 # format of map
 FORMAT_MAP_LINE_KEY = "line"
 FORMAT_MAP_LINE_PATTERN = "{key}="+"\"{line}\""
@@ -48,7 +68,472 @@ UNCHANGE_PROBA = 0.4
 LAND_TO_OCEAN_PROBA = 0.2
 OCEAN_TO_LAND_PROBA = 0.2
 
-__all__ = ["MapTool"]
+__all__ = ["MapTool", "YieldGrid", "CityScoreIndex", "WalkBatch"]
+
+
+class YieldGrid(object):
+    """
+    Food, shield and trade of every tile of a terrain map and its packed extras,
+    kept in step with the tile edits by `update`.
+    :attribute terrain_map: list<list<str>>, built (y,x), the terrain map of the grid.
+    :attribute extras: numpy.ndarray<uint64>, built (y,x), the packed extras of the grid, see ResourceTool.pack_extras.
+    :attribute terrain_fpt, resource_fpt, fpt: numpy.ndarray, (ysize, xsize, 3), the food/shield/trade
+        of the terrains, of the resources and of both.
+    :attribute resources: list<list<list<str>>>, built (y,x), the resources of the tiles in the order of the layers.
+    :attribute zero_signal: numpy.ndarray<bool>, (ysize, xsize), the tiles of FPT_ZERO_SIGNAL_LIST.
+    :attribute coords: Topology, the wrap rules of the map.
+    """
+
+    def __init__(self, terrain_map, extras, terrain_fpt_conf, resource_fpt_conf, topology:str=None):
+        self.terrain_map = terrain_map
+        self.extras = extras
+        self.terrain_fpt_conf = terrain_fpt_conf
+        self.resource_fpt_conf = resource_fpt_conf
+        # weight -> [score, terrain_score, resource_score]
+        self._scores = dict()
+        # (offsets, topk, weight, keep_ocean) -> CityScoreIndex
+        self._city_indexes = dict()
+
+        self.terrain_fpt, _, _ = YieldGrid._lookup(terrain_map, terrain_fpt_conf)
+        self.resource_fpt = np.zeros_like(self.terrain_fpt)
+        self.resources = [[list() for _ in row] for row in terrain_map]
+        for eid, digits in ResourceTool.get_extra_digits(extras).items():
+            keys = [eid+"_"+digit for digit in EXTRA_DIGITS]
+            self.resource_fpt += np.array([YieldGrid._get_fpt(resource_fpt_conf, key) for key in keys], dtype=np.float64)[digits]
+            for y, x in zip(*np.nonzero(digits)):
+                self.resources[y][x].append(keys[digits[y, x]])
+        self.fpt = self.terrain_fpt + self.resource_fpt
+        self.zero_signal = np.isin(np.array(terrain_map), FPT_ZERO_SIGNAL_LIST)
+        self.coords = Topology.get(len(terrain_map[0]), len(terrain_map), topology)
+
+    @staticmethod
+    def _get_fpt(conf, key):
+        if key in conf:
+            return [float(conf[key][fpt_key]) for fpt_key in FPT_KEYS]
+        return [0.0] * len(FPT_KEYS)
+
+    @staticmethod
+    def _lookup(layer, conf):
+        """
+        Yields of the values of a 2-d layer in conf, zeros for the others,
+        with the distinct values and the (ysize, xsize) indexes of the tiles in them.
+        """
+        keys, inverse = np.unique(np.array(layer), return_inverse=True)
+        keys, inverse = keys.tolist(), inverse.reshape(len(layer), len(layer[0]))
+        table = np.array([YieldGrid._get_fpt(conf, key) for key in keys], dtype=np.float64).reshape(-1, len(FPT_KEYS))
+        return table[inverse], keys, inverse
+
+    @staticmethod
+    def _get_weight_key(weight:dict=None):
+        return None if weight is None else tuple(float(weight[key]) for key in FPT_KEYS)
+
+    @staticmethod
+    def get_score(fpt, weight:dict=None, ndigits:int=3):
+        """Weighted sums of the yields in fpt, like round(dict_sum(property, weight), ndigits)."""
+        if weight is None:
+            score = fpt[..., 0] + fpt[..., 1] + fpt[..., 2]
+        else:
+            score = fpt[..., 0] * float(weight["food"]) + fpt[..., 1] * float(weight["shield"]) + fpt[..., 2] * float(weight["trade"])
+        # the scores take a few distinct values, rounded like python
+        values, inverse = np.unique(score, return_inverse=True)
+        values = np.array([round(round(value, 6), ndigits) for value in values.tolist()], dtype=np.float64)
+        return values[inverse].reshape(np.shape(score))
+
+    def get_scores(self, weight:dict=None):
+        """Weighted scores (total, terrain, resource) of all tiles, as (ysize, xsize) arrays."""
+        if (scores := self._scores.get(key := YieldGrid._get_weight_key(weight))) is None:
+            scores = [YieldGrid.get_score(fpt, weight) for fpt in (self.fpt, self.terrain_fpt, self.resource_fpt)]
+            self._scores[key] = scores
+        return scores
+
+    def get_city_index(self, offsets:list, topk:int, weight:dict=None, keep_ocean:bool=False):
+        """CityScoreIndex of the tiles as city centers with the scope offsets, kept up to date by `update`."""
+        key = (tuple(tuple(offset) for offset in offsets), topk, YieldGrid._get_weight_key(weight), bool(keep_ocean))
+        if (city_index := self._city_indexes.get(key)) is None:
+            city_index = CityScoreIndex(self, offsets, topk, weight, keep_ocean)
+            self._city_indexes[key] = city_index
+        return city_index
+
+    def update(self, y:int, x:int):
+        """Read again the tile (y,x) of the terrain map and packed extras."""
+        resources = ResourceTool.get_extra_values(self.extras[y, x])
+        resource_fpt = [0.0] * len(FPT_KEYS)
+        for resource in resources:
+            resource_fpt = [value + _value for value, _value in zip(resource_fpt, YieldGrid._get_fpt(self.resource_fpt_conf, resource))]
+        self.resources[y][x] = resources
+        self.terrain_fpt[y, x] = YieldGrid._get_fpt(self.terrain_fpt_conf, self.terrain_map[y][x])
+        self.resource_fpt[y, x] = resource_fpt
+        self.fpt[y, x] = self.terrain_fpt[y, x] + self.resource_fpt[y, x]
+        self.zero_signal[y, x] = self.terrain_map[y][x] in FPT_ZERO_SIGNAL_LIST
+        for key, scores in self._scores.items():
+            for score, fpt in zip(scores, (self.fpt, self.terrain_fpt, self.resource_fpt)):
+                fpt = fpt[y, x].tolist()
+                value = fpt[0] + fpt[1] + fpt[2] if key is None else fpt[0] * key[0] + fpt[1] * key[1] + fpt[2] * key[2]
+                score[y, x] = round(round(value, 6), 3)
+        for city_index in self._city_indexes.values():
+            city_index.update(y, x)
+        return
+
+
+class CityScoreIndex(object):
+    """
+    Score of every tile of a YieldGrid as a city center: the summed properties of the best topk
+    tiles of its scope, weighted like dict_sum of calulate_map_properties_by_order.
+    An edited tile marks the centers whose scope holds it, scored again in a batch when read.
+    :attribute scores: numpy.ndarray, (ysize, xsize), the scores of the centers.
+    """
+
+    def __init__(self, grid:YieldGrid, offsets:list, topk:int, weight:dict=None, keep_ocean:bool=False):
+        """
+        offsets: list<[dy, dx]>, the scope around a center, wrapped by the topology of the grid.
+        keep_ocean: take the tiles of FPT_ZERO_SIGNAL_LIST last, like _reorder_terrains.
+        """
+        self.grid = grid
+        self.offsets = np.array(offsets, dtype=np.int64).reshape(-1, 2)
+        self.topk = min(topk, len(self.offsets))
+        self.weight = weight
+        self.keep_ocean = keep_ocean
+        ysize, xsize = grid.fpt.shape[:2]
+        self._scores = self._score(np.arange(ysize)[:, None], np.arange(xsize)[None, :])
+        self._dirty = np.zeros((ysize, xsize), dtype=bool)
+        self._has_dirty = False
+
+    def _score(self, ys, xs):
+        """Scores of the centers (ys, xs), broadcast together."""
+        rows, cols, valid = self.grid.coords.wrap(np.asarray(ys)[..., None] + self.offsets[:, 0],
+                                                  np.asarray(xs)[..., None] + self.offsets[:, 1])
+        # the tiles dropped by the topology are read at 0, 0 and never taken
+        rows, cols = np.where(valid, rows, 0), np.where(valid, cols, 0)
+        # only the scores of the tiles are ordered, the ties give the same weighted sum
+        key = self.grid.get_scores(self.weight)[0][rows, cols]
+        if self.keep_ocean:
+            key = np.where(self.grid.zero_signal[rows, cols], key - 2 * np.abs(key).max(initial=0) - 1, key)
+        key = np.where(valid, key, -np.inf)
+        best = np.argpartition(-key, self.topk-1, axis=-1)[..., :self.topk]
+        fpt = np.take_along_axis(self.grid.fpt[rows, cols] * valid[..., None], best[..., None], axis=-2).sum(axis=-2)
+        return YieldGrid.get_score(fpt, self.weight, ndigits=6)
+
+    @property
+    def scores(self):
+        if self._has_dirty:
+            ys, xs = np.nonzero(self._dirty)
+            self._scores[ys, xs] = self._score(ys, xs)
+            self._dirty[ys, xs] = False
+            self._has_dirty = False
+        return self._scores
+
+    def update(self, y:int, x:int):
+        """Mark the centers whose scope holds the tile (y,x)."""
+        ys, xs, valid = self.grid.coords.wrap(y - self.offsets[:, 0], x - self.offsets[:, 1])
+        self._dirty[ys[valid], xs[valid]] = True
+        self._has_dirty = True
+        return
+
+    def get_score(self, x:int, y:int):
+        """Score of the center (x,y), wrapped by the topology of the grid."""
+        _y, _x, valid = self.grid.coords.wrap(y, x)
+        if not valid:
+            raise IndexError(f"center ({x}, {y}) is out of the map")
+        return self.scores[_y, _x].item()
+
+    def get_centers(self, lower:float, upper:float):
+        """Centers [x, y] scored within [lower, upper], by x then y."""
+        inside = (self.scores >= lower) & (self.scores <= upper)
+        return [[x, y] for x, y in np.argwhere(inside.T).tolist()]
+
+
+class WalkBatch(object):
+    """
+    Random walk of gen_random_walk_map over a batch of maps at once. Every map walks on its own,
+    the draws and the edits of a walk step are vectorized over the maps.
+    :attribute terrains: list<str>, the terrains, coded by their index.
+    :attribute eids: list<str>, the extras layers of the map, whose digits are set and cleared in the packed extras.
+    :attribute terrain: numpy.ndarray<int>, (batch, ysize, xsize), the terrain codes of the maps.
+    :attribute extras: numpy.ndarray<uint64>, (batch, ysize, xsize), the packed extras of the maps.
+    :attribute fpt: numpy.ndarray, (batch, ysize, xsize, 3), the food/shield/trade of the tiles.
+    :attribute tile_score: numpy.ndarray, (batch, ysize, xsize), the weighted scores of the tiles.
+    """
+
+    def __init__(self, map_tool, batch:int, topk:int=6, weight:dict=None, keep_ocean:bool=True, rng=None):
+        self.map_tool = map_tool
+        self.batch = batch
+        self.topk = topk
+        self.weight = weight
+        self.keep_ocean = keep_ocean
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.ysize, self.xsize = map_tool.ysize, map_tool.xsize
+        self.steps = np.array(map_tool.valid_steps, dtype=np.int64)
+        self.around = np.array(map_tool.total_steps, dtype=np.int64)
+        self._compile_terrains()
+        self._compile_extras()
+
+        terrain = np.array([[self._terrain_codes[t] for t in row] for row in map_tool._global_map], dtype=np.int16)
+        self.terrain = np.repeat(terrain[None], batch, axis=0)
+        self.extras = np.repeat(map_tool._extras[None], batch, axis=0)
+        self.fpt = np.zeros((batch, self.ysize, self.xsize, len(FPT_KEYS)), dtype=np.float64)
+        self.tile_score = np.zeros((batch, self.ysize, self.xsize), dtype=np.float64)
+        self._refresh(*np.nonzero(np.ones(self.terrain.shape, dtype=bool)))
+
+    def _compile_terrains(self):
+        map_tool = self.map_tool
+        terrain_product, self.terrain_keys = map_tool._cal_terrain_scores(self.keep_ocean, self.weight)
+        self.terrains = list(dict.fromkeys(list(map_tool.terrain_fpt_conf) + [t for row in map_tool._global_map for t in row] +
+                                           TerrainTool.get_land() + OCEAN_TERRAIN_LIST + [LAKE_SIGNAL]))
+        self._terrain_codes = {terrain: code for code, terrain in enumerate(self.terrains)}
+        self.terrain_fpt = np.array([YieldGrid._get_fpt(map_tool.terrain_fpt_conf, t) for t in self.terrains], dtype=np.float64)
+        self.zero_signal = np.isin(self.terrains, FPT_ZERO_SIGNAL_LIST)
+        self.negsignal = np.isin(self.terrains, LOCATION_NEGSIGNAL_LIST)
+        self.ocean = np.isin(self.terrains, OCEAN_TERRAIN_LIST)
+        self.lake = self._terrain_codes[LAKE_SIGNAL]
+        self.land = np.array([self._terrain_codes[t] for t in TerrainTool.get_land()], dtype=np.int16)
+        self.ocean_code = self._terrain_codes[" "]
+        # the terrains of every score level, the lake last so that it can be left out
+        self.level = np.full(len(self.terrains), -1, dtype=np.int64)
+        levels = [sorted(terrain_product[key], key=lambda t: t == LAKE_SIGNAL) for key in self.terrain_keys]
+        self.level_terrains = np.zeros((len(levels), max(len(level) for level in levels)), dtype=np.int16)
+        self.level_sizes = np.array([len(level) for level in levels], dtype=np.int64)
+        self.level_lake = np.array([LAKE_SIGNAL in level for level in levels], dtype=bool)
+        for k, level in enumerate(levels):
+            for i, terrain in enumerate(level):
+                self.level_terrains[k, i] = self._terrain_codes[terrain]
+                self.level[self._terrain_codes[terrain]] = k
+
+    def _compile_extras(self):
+        map_tool = self.map_tool
+        self.eids = list(map_tool._extra_keys)
+        # (layers, 1), the shifts and masks of the digits of the layers in the packed extras
+        self._shifts = np.array([ResourceTool.get_extra_shift(eid) for eid in self.eids], dtype=np.uint64).reshape(-1, 1)
+        self._masks = np.uint64(EXTRA_LAYER_MASK) << self._shifts
+        self.extras_fpt = np.zeros((len(self.eids), len(EXTRA_DIGITS), len(FPT_KEYS)), dtype=np.float64)
+        for l, eid in enumerate(self.eids):
+            for digit in range(1, len(EXTRA_DIGITS)):
+                self.extras_fpt[l, digit] = YieldGrid._get_fpt(map_tool.resource_fpt_conf, eid+"_"+EXTRA_DIGITS[digit])
+        # digits kept by a new terrain, all of them for the terrains out of terrain_resource_conf
+        self.allowed = np.ones((len(self.terrains), len(self.eids), len(EXTRA_DIGITS)), dtype=bool)
+        self._layers = np.arange(len(self.eids))[:, None]
+        # extras added on a terrain, like _add_resource
+        choices = [map_tool.terrain_resource_conf.get(t, list()) for t in self.terrains]
+        self.add_sizes = np.array([len(choice) for choice in choices], dtype=np.int64)
+        self.add_layer = np.zeros((len(self.terrains), max(1, self.add_sizes.max())), dtype=np.int64)
+        self.add_digit = np.zeros(self.add_layer.shape, dtype=np.uint64)
+        self.add_valid = np.zeros(self.add_layer.shape, dtype=bool)
+        for t, terrain in enumerate(self.terrains):
+            if terrain in map_tool.terrain_resource_conf:
+                self.allowed[t, :, 1:] = False
+            for i, value in enumerate(choices[t]):
+                if (eid := value.split("_")[0]) in self.eids:
+                    l, digit = self.eids.index(eid), int(value.split("_")[1], 16)
+                    self.allowed[t, l, digit] = True
+                    self.add_layer[t, i], self.add_digit[t, i] = l, digit
+                    self.add_valid[t, i] = value in map_tool.resource_fpt_conf
+
+    def _digits(self, extras):
+        """Digits (layers, n) of the layers in the packed extras of n tiles."""
+        return ((extras[None] >> self._shifts) & np.uint64(EXTRA_LAYER_MASK)).astype(np.intp)
+
+    def _choice(self, mask):
+        """Random index of a True of every row of mask, uniformly."""
+        draw = self.rng.random(mask.shape)
+        draw[~mask] = -1
+        return draw.argmax(axis=-1)
+
+    def _scope(self, bs, xs, ys):
+        """
+        Rows, cols and valid (n, scope) of the city scopes around the centers of the maps bs,
+        gathered from the footprint table of the map; the tiles dropped by the topology are read at the centers.
+        """
+        rows, cols, valid = self.map_tool.coords.get_scope(xs, ys, CITY_RADIUS_SQ)
+        return np.where(valid, rows, ys[:, None]), np.where(valid, cols, xs[:, None]), valid
+
+    def _refresh(self, bs, ys, xs):
+        """Yields and scores of the edited tiles."""
+        fpt = self.terrain_fpt[self.terrain[bs, ys, xs]] + \
+                self.extras_fpt[self._layers, self._digits(self.extras[bs, ys, xs])].sum(axis=0)
+        self.fpt[bs, ys, xs] = fpt
+        self.tile_score[bs, ys, xs] = YieldGrid.get_score(fpt, self.weight)
+        return
+
+    def score(self, bs, xs, ys):
+        """
+        Score of the city centers of the maps bs like dict_sum of calulate_map_properties_by_order,
+        with the rows, cols, valid of their scopes and the topk tiles (n, topk) of them, best first.
+        """
+        rows, cols, valid = self._scope(bs, xs, ys)
+        fpt, key = self.fpt[bs[:, None], rows, cols] * valid[..., None], self.tile_score[bs[:, None], rows, cols]
+        if self.keep_ocean:
+            key = np.where(self.zero_signal[self.terrain[bs[:, None], rows, cols]], key - 2 * np.abs(key).max(initial=0) - 1, key)
+        best = np.argsort(-np.where(valid, key, -np.inf), axis=-1, kind="stable")[:, :self.topk]
+        score = YieldGrid.get_score(np.take_along_axis(fpt, best[..., None], axis=1).sum(axis=1), self.weight, ndigits=6)
+        return score, rows, cols, valid, best
+
+    def _beyond_lake_limit(self, bs, rows, cols, valid, limit=0.2):
+        lake = (self.terrain[bs[:, None], rows, cols] == self.lake) & valid
+        return lake.sum(axis=1) > limit * valid.sum(axis=1)
+
+    def _draw_terrain(self, levels, no_lake):
+        """Random terrains of the score levels, without the lake for no_lake."""
+        sizes = self.level_sizes[levels] - (no_lake & self.level_lake[levels])
+        return self.level_terrains[levels, (self.rng.random(len(levels)) * sizes).astype(np.int64)]
+
+    def _set_terrain(self, bs, ys, xs, terrain):
+        """Set the terrains of the tiles and clear the digits of the extras they can not keep."""
+        self.terrain[bs, ys, xs] = terrain
+        extras = self.extras[bs, ys, xs]
+        kept = self.allowed[terrain[None, :], self._layers, self._digits(extras)]
+        self.extras[bs, ys, xs] = extras & ~np.bitwise_or.reduce(np.where(kept, np.uint64(0), self._masks), axis=0)
+        self._refresh(bs, ys, xs)
+        return
+
+    def _remove_extra(self, bs, ys, xs):
+        """Clear the digit of the last layer holding an extra of the tiles, like _remove_resource."""
+        present = self._digits(self.extras[bs, ys, xs]) > 0
+        has = present.any(axis=0)
+        layer = len(self.eids) - 1 - present[::-1].argmax(axis=0)
+        bs, ys, xs = bs[has], ys[has], xs[has]
+        self.extras[bs, ys, xs] = self.extras[bs, ys, xs] & ~self._masks[layer[has], 0]
+        self._refresh(bs, ys, xs)
+        return
+
+    def _add_extra(self, bs, ys, xs):
+        """Add a random extra of their terrains to the tiles, like _add_resource."""
+        terrain = self.terrain[bs, ys, xs]
+        index = (self.rng.random(len(bs)) * self.add_sizes[terrain]).astype(np.int64)
+        valid = (self.add_sizes[terrain] > 0) & self.add_valid[terrain, index]
+        layer, digit = self.add_layer[terrain, index][valid], self.add_digit[terrain, index][valid]
+        _bs, _ys, _xs = bs[valid], ys[valid], xs[valid]
+        self.extras[_bs, _ys, _xs] = (self.extras[_bs, _ys, _xs] & ~self._masks[layer, 0]) | (digit << self._shifts[layer, 0])
+        self._refresh(bs, ys, xs)
+        return
+
+    def _accessible(self, bs, xs, ys, margin:int=1):
+        inside = (xs >= margin) & (xs <= self.xsize-margin-1) & (ys >= margin) & (ys <= self.ysize-margin-1)
+        terrain = self.terrain[bs, np.clip(ys, 0, self.ysize-1), np.clip(xs, 0, self.xsize-1)]
+        return inside & ~self.negsignal[terrain]
+
+    def get_city_accessible_locations(self):
+        """A random accessible city center (x, y) of every map, like get_city_accessible_location."""
+        xs, ys = np.zeros(self.batch, dtype=np.int64), np.zeros(self.batch, dtype=np.int64)
+        pending = np.arange(self.batch)
+        while len(pending) > 0:
+            _xs = self.rng.integers(CITY_SCOPE_DEPTH, self.xsize-CITY_SCOPE_DEPTH, len(pending))
+            _ys = self.rng.integers(CITY_SCOPE_DEPTH, self.ysize-CITY_SCOPE_DEPTH, len(pending))
+            found = self._accessible(pending, _xs, _ys)
+            xs[pending[found]], ys[pending[found]] = _xs[found], _ys[found]
+            pending = pending[~found]
+        return xs, ys
+
+    def restore_bound(self, bs, xs, ys, lower:float, upper:float, max_actions:int=WALK_MAX_ACTIONS):
+        """
+        Change the topk tiles of the centers out of [lower, upper] until their scores are back,
+        like the score bound loop of gen_random_walk_map.
+        Return the number of actions of every map, and whether its center is back in the bound:
+        False when no action was valid, where gen_random_walk_map raises, or after max_actions.
+        max_actions: None to go on until the centers are back, like gen_random_walk_map.
+        """
+        if max_actions is None:
+            max_actions = np.inf
+        actions = np.zeros(len(bs), dtype=np.int64)
+        failed = np.zeros(len(bs), dtype=bool)
+        score, rows, cols, inside, best = self.score(bs, xs, ys)
+        need = np.nonzero((score < lower) | (score > upper))[0]
+        while len(need) > 0:
+            move = np.where(score[need] > upper, -1, 1)
+            _bs, _rows, _cols, _inside = bs[need], rows[need], cols[need], inside[need]
+            top_ys, top_xs = np.take_along_axis(_rows, best[need], axis=1), np.take_along_axis(_cols, best[need], axis=1)
+            top_inside = np.take_along_axis(_inside, best[need], axis=1)
+            level = self.level[self.terrain[_bs[:, None], top_ys, top_xs]]
+            changeable = top_inside & (level >= 0) & np.where(move[:, None] > 0, level < len(self.terrain_keys)-1, level > 0)
+            has_extra = self.extras[_bs[:, None], top_ys, top_xs] > 0
+            candidate = np.where(changeable.any(axis=1)[:, None], changeable,
+                                 top_inside & np.where(move[:, None] < 0, has_extra, ~has_extra))
+            # no valid action: leave the map as it is
+            valid = candidate.any(axis=1)
+            pick = self._choice(candidate)
+            _ys, _xs = top_ys[np.arange(len(need)), pick], top_xs[np.arange(len(need)), pick]
+            level = level[np.arange(len(need)), pick]
+
+            change = valid & changeable.any(axis=1)
+            if change.any():
+                no_lake = self._beyond_lake_limit(_bs[change], _rows[change], _cols[change], _inside[change])
+                terrain = self._draw_terrain(level[change] + move[change], no_lake)
+                self._set_terrain(_bs[change], _ys[change], _xs[change], terrain)
+            if (reduce := valid & ~change & (move < 0)).any():
+                self._remove_extra(_bs[reduce], _ys[reduce], _xs[reduce])
+            if (boost := valid & ~change & (move > 0)).any():
+                self._add_extra(_bs[boost], _ys[boost], _xs[boost])
+            actions[need[valid]] += 1
+            failed[need[~valid]] = True
+
+            need = need[valid]
+            score[need], rows[need], cols[need], inside[need], best[need] = self.score(bs[need], xs[need], ys[need])
+            out = (score[need] < lower) | (score[need] > upper)
+            failed[need[out & (actions[need] >= max_actions)]] = True
+            need = need[out & (actions[need] < max_actions)]
+        return actions, ~failed
+
+    def random_gen(self, bs, xs, ys):
+        """Change a random tile of the scopes to a terrain of the same score level, like _random_gen."""
+        rows, cols, valid = self._scope(bs, xs, ys)
+        # the draw among the tiles in the map, the same as over the whole scope away from the edges
+        pick = (np.cumsum(valid, axis=1) > self.rng.integers(0, valid.sum(axis=1))[:, None]).argmax(axis=1)
+        _ys, _xs = rows[np.arange(len(bs)), pick], cols[np.arange(len(bs)), pick]
+        terrain = self.terrain[bs, _ys, _xs]
+        change = ~self.zero_signal[terrain] & (self.level[terrain] >= 0)
+        no_lake = self._beyond_lake_limit(bs[change], rows[change], cols[change], valid[change])
+        bs, _ys, _xs = bs[change], _ys[change], _xs[change]
+        self._set_terrain(bs, _ys, _xs, self._draw_terrain(self.level[terrain[change]], no_lake))
+        draw = self.rng.random((2, len(bs)))
+        if (boost := (draw[0] < self.map_tool.resource_prob) & (draw[1] < 0.5)).any():
+            self._add_extra(bs[boost], _ys[boost], _xs[boost])
+        if (reduce := (draw[0] < self.map_tool.resource_prob) & (draw[1] >= 0.5)).any():
+            self._remove_extra(bs[reduce], _ys[reduce], _xs[reduce])
+        return
+
+    def modify_land(self, bs, land_centers):
+        """Turn the coast around a random tile of every map to land or ocean, like _modify_land."""
+        n = len(bs)
+        xs, ys = self.rng.integers(0, self.xsize, n), self.rng.integers(0, self.ysize, n)
+        _xs, _ys = xs[:, None] + self.around[:, 0], ys[:, None] + self.around[:, 1]
+        inside = (_xs >= 0) & (_xs < self.xsize) & (_ys >= 0) & (_ys < self.ysize)
+        terrain = self.terrain[bs[:, None], np.clip(_ys, 0, self.ysize-1), np.clip(_xs, 0, self.xsize-1)]
+        ocean = inside & self.ocean[terrain]
+        n_ocean, n_land = ocean.sum(axis=1, keepdims=True), (inside & ~ocean).sum(axis=1, keepdims=True)
+        proba = np.where(ocean, 0.4 / np.maximum(n_ocean, 1), np.where(inside, 0.6 / np.maximum(n_land, 1), 0.0))
+        pick = (proba.cumsum(axis=1) / proba.sum(axis=1, keepdims=True) <= self.rng.random((n, 1))).sum(axis=1)
+        pick = np.minimum(pick, len(self.around)-1)
+
+        keep = n_ocean[:, 0] > 0
+        rows = np.arange(n)[keep]
+        bs, _xs, _ys, terrain = bs[keep], _xs[rows, pick[keep]], _ys[rows, pick[keep]], terrain[rows, pick[keep]]
+        distance = np.abs(_ys - land_centers[bs, 1]) + np.abs(_xs - land_centers[bs, 0])
+        draw = self.rng.random(len(bs))
+        zero = self.zero_signal[terrain]
+        to_land = zero & (draw > 1.5 * distance / (self.xsize+self.ysize))
+        to_ocean = ~zero & (draw < distance / (self.xsize+self.ysize))
+        new_terrain = np.where(to_land, self.land[self.rng.integers(0, len(self.land), len(bs))], self.ocean_code)
+        change = to_land | to_ocean
+        bs, _ys, _xs = bs[change], _ys[change], _xs[change]
+        self.terrain[bs, _ys, _xs] = new_terrain[change]
+        self.extras[bs, _ys, _xs] = 0
+        self._refresh(bs, _ys, _xs)
+        return
+
+    def sampling_step(self, bs, xs, ys, margin:int=2):
+        """Walk every center to a random accessible neighbour, -1 where there is none, like _sampling_step."""
+        order = np.argsort(self.rng.random((len(bs), len(self.steps))), axis=1)
+        _xs = xs[:, None] + self.steps[order, 0] * self.map_tool.strides
+        _ys = ys[:, None] + self.steps[order, 1] * self.map_tool.strides
+        accessible = self._accessible(bs[:, None], _xs, _ys, margin)
+        first = accessible.argmax(axis=1)
+        found = accessible.any(axis=1)
+        rows = np.arange(len(bs))
+        return np.where(found, _xs[rows, first], -1), np.where(found, _ys[rows, first], -1)
+
+    def to_maps(self, b:int):
+        """Terrain map and packed extras of the map b, like the rand_map and extra_map of gen_random_walk_map."""
+        rand_map = np.array(self.terrains)[self.terrain[b]].tolist()
+        return rand_map, self.extras[b].copy()
+
 
 class MapTool(object):
     """
@@ -70,7 +555,8 @@ class MapTool(object):
                  terrain_fpt_conf:dict=None,
                  resource_fpt_conf:dict=None,
                  terrain_resource_conf:dict=None,
-                 extra_resources:dict=None
+                 extra_resources:dict=None,
+                 topology:str=None
                  ):
         if raw_data is None:
             raise ValueError("Please input raw_data for global map!")
@@ -86,17 +572,29 @@ class MapTool(object):
 
         self.terrain_keys = list(terrain_fpt_conf.keys())
 
+        self.topology = DEFAULT_TOPOLOGY if topology is None else topology
+
         self._global_map = list()
         self._global_keys = list()
         self._players_map = dict()
         self._players_resource = dict()
-        self._extra_resources = dict()
+        # packed extras of the tiles, see ResourceTool.pack_extras, and the keys of the rows of every layer eid
+        self._extras = None
+        self._extra_keys = dict()
         self._seen_map = list()
         self._seen_keys = list()
+        # layer index of the known map -> keys of its rows, k00 for the seen map
+        self._known_keys = dict()
+        # bit i of a tile set if player i knows it
+        self._known = None
         self._layers = dict()
+        self._yield_grids = OrderedDict()
+        # terrain rows -> connectivity metrics
+        self._connectivity = OrderedDict()
 
         self._parse_map()
         self.xsize, self.ysize = self.cal_size()
+        self.coords = Topology.get(self.xsize, self.ysize, self.topology)
 
     @staticmethod
     def parse_map(map_data, extra_data):
@@ -118,10 +616,16 @@ class MapTool(object):
         
         self._layers["connectivity"] = copy.deepcopy(self._global_map)
 
-        # global seen map data
+        # global seen map data, the rows of k00, and the known map of all the layers
+        known_layers = dict()
         for key, map in self._seen_data.items():
-            self._seen_map.append(map)
-            self._seen_keys.append(key)
+            index = int(re.match(KNOWN_LAYER_PATTERN, key)[1])
+            known_layers.setdefault(index, list()).append(map)
+            self._known_keys.setdefault(index, list()).append(key)
+            if index == 0:
+                self._seen_map.append(map)
+                self._seen_keys.append(key)
+        self._known = MapTool.decode_known([known_layers.get(index, list()) for index in range(max(known_layers, default=-1)+1)])
 
         # player maps data
         for key, data in self._player_map_data.items():
@@ -145,63 +649,69 @@ class MapTool(object):
 
         # global resource data
         for key, data in self._raw_resources.items():
-            self._extra_resources[key] = dict()
-            self._extra_resources[key]["key"] = list()
-            self._extra_resources[key]["map"] = list()
-            for _key, map in data.items():
-                self._extra_resources[key]["key"].append(_key)
-                self._extra_resources[key]["map"].append(map)
+            self._extra_keys[key] = list(data.keys())
+        self._extras = ResourceTool.pack_extras({key: list(data.values()) for key, data in self._raw_resources.items()})
+        if self._extras is None:
+            self._extras = np.zeros((len(self._global_map), len(self._global_map[0]) if self._global_map else 0), dtype=np.uint64)
+        return
+
+    def get_yield_grid(self, input_map=None, extra_resources=None):
+        """YieldGrid of the terrain map and packed extras, the global ones by default, kept while they are edited."""
+        if input_map is None:
+            input_map = self._global_map
+        if extra_resources is None:
+            extra_resources = self._extras
+        key = (id(input_map), id(extra_resources))
+        if (grid := self._yield_grids.get(key)) is None or grid.terrain_map is not input_map or grid.extras is not extra_resources:
+            grid = YieldGrid(input_map, extra_resources, self.terrain_fpt_conf, self.resource_fpt_conf, self.topology)
+            self._yield_grids[key] = grid
+            while len(self._yield_grids) > YIELD_GRID_CACHE_SIZE:
+                self._yield_grids.popitem(last=False)
+        self._yield_grids.move_to_end(key)
+        return grid
+
+    def _update_yield_grids(self, _y, _x, input_map=None, extra_resources=None):
+        """Follow the edit of the tile (y,x) of a terrain map or packed extras in their yield grids."""
+        for grid in self._yield_grids.values():
+            if grid.terrain_map is input_map or grid.extras is extra_resources:
+                grid.update(_y, _x)
         return
 
-    def _search_extra_map(self, extra_map:dict, x:int, y:int):
-        if extra_map is None:
-            return list()
-        resource_list = list()
-        for _, data in extra_map.items():
-            if not data["map"][y][x].endswith("0"):
-                resource_list.append(data["map"][y][x])
-        return resource_list
-    
     def _get_resource_fpt_conf(self, resource):
         if resource in self.resource_fpt_conf:
             return self.resource_fpt_conf[resource]
         return {"food": 0, "shield": 0, "trade": 0}
     
-    def _cal_resource_fpt(self, resource_list):
-        fpt = {"food": 0, "shield": 0, "trade": 0}
-        for _resource in resource_list:
-            if _resource in self.resource_fpt_conf:
-                fpt = dict_sum_by_list([fpt, self._get_resource_fpt_conf(_resource)])
-        return fpt
-    
     def _calulate_map_properties(self, location_list:list, 
                                          weight:dict=None, 
                                          input_map=None, 
                                          extra_resources=None):
-        if input_map is None:
-            input_map = self._global_map
-        if extra_resources is None:
-            extra_resources = self._extra_resources
+        grid = self.get_yield_grid(input_map, extra_resources)
+        input_map = grid.terrain_map
 
-        property_list = list()
+        terrains = list()
         for location in location_list:
             try:
-                terrain = input_map[location[0]][location[1]]
+                terrains.append(input_map[location[0]][location[1]])
             except Exception as ex:
                 raise ValueError(f"{ex}\n{location[0]},{location[1]}")
-            resource_list = self._search_extra_map(extra_resources, location[1], location[0])
-            _properties_terrain = copy.deepcopy(self.terrain_fpt_conf[terrain])
-            _properties_resource = self._cal_resource_fpt(resource_list)
-            _properties = dict_sum_by_list([_properties_terrain, _properties_resource])
-            property_list.append([round(dict_sum(_properties, weight), 3), 
-                                  round(dict_sum(_properties_terrain, weight), 3), 
-                                  round(dict_sum(_properties_resource, weight), 3), 
-                                  {"property": _properties, 
-                                    "terrain_property": _properties_terrain, 
-                                    "resource_property": _properties_resource, 
+        if len(location_list) == 0:
+            return list()
+        ys, xs = [location[0] for location in location_list], [location[1] for location in location_list]
+        scores = [score[ys, xs].tolist() for score in grid.get_scores(weight)]
+        fpt, resource_fpt = grid.fpt[ys, xs].tolist(), grid.resource_fpt[ys, xs].tolist()
+
+        property_list = list()
+        for i, location in enumerate(location_list):
+            property_list.append([scores[0][i], 
+                                  scores[1][i], 
+                                  scores[2][i], 
+                                  {"property": dict(zip(FPT_KEYS, fpt[i])), 
+                                    "terrain_property": dict(self.terrain_fpt_conf[terrains[i]]), 
+                                    "resource_property": dict(zip(FPT_KEYS, resource_fpt[i])), 
                                     "location": location, 
-                                    "terrain": terrain,
-                                    "resource": resource_list}])
+                                    "terrain": terrains[i],
+                                    "resource": list(grid.resources[location[0]][location[1]])}])
         return property_list
 
     def calulate_map_properties_by_total(self, location_list:list, 
@@ -284,46 +794,93 @@ class MapTool(object):
         return 
 
     @staticmethod
-    def _convert_format(gen_map, key_list, format_type:str):
+    def _convert_format(gen_map, key_list, format_type:str, eid:str=None):
         """ Convert map to the special format
+        :parameter gen_map: list<list<str>> or 2-d numpy.ndarray<str>, built (y,x),
+            or numpy.ndarray<uint64> of packed extras, written as the hex digits of the layer eid
         :parameter format: str, support "line"
         """
         output = dict()
+        if eid is not None:
+            gen_map = ResourceTool.unpack_extras(gen_map, [eid])[eid]
         if format_type == FORMAT_MAP_LINE_KEY:
+            lines = MapTool._join_rows(gen_map) if isinstance(gen_map, np.ndarray) else ["".join(row) for row in gen_map]
             for index, key in enumerate(key_list):
-                line = FORMAT_MAP_LINE_PATTERN.format(key=key, line="".join(gen_map[index]))
+                line = FORMAT_MAP_LINE_PATTERN.format(key=key, line=lines[index])
                 output[key] = line
         else:
             raise ValueError(f"Please note that the format only supported {FORMAT_MAP_LINE_KEY}, but you use {format_type}!")
         return output
-    
+
+    @staticmethod
+    def _join_rows(layer):
+        """Rows of a 2-d numpy.ndarray<str> as strings, by a view of all its characters when they are single."""
+        if layer.dtype == np.dtype("<U1") and layer.ndim == 2 and layer.shape[1] > 0:
+            return np.ascontiguousarray(layer).view(f"<U{layer.shape[1]}").reshape(-1).tolist()
+        return ["".join(row) for row in layer.tolist()]
+
+    @staticmethod
+    def _get_resource_array(resource_map):
+        """numpy.ndarray<str> of the resources "e00_1,e03_2" of the tiles, "" for None."""
+        if isinstance(resource_map, np.ndarray):
+            return resource_map
+        return np.array([["" if value is None else value for value in row] for row in resource_map], dtype=str)
+
+    @staticmethod
+    def get_suffixes(layer):
+        """numpy.ndarray<str> of the values "e00_1" of a 2-d layer without their prefix, like "1"."""
+        layer = np.asarray(layer)
+        keys, inverse = np.unique(layer, return_inverse=True)
+        suffixes = np.array([key.split("_")[-1] for key in keys.tolist()], dtype=str)
+        return suffixes[inverse].reshape(layer.shape)
+
+    def get_extras(self, extra_resources=None):
+        """
+        Packed extras of the tiles, one bitmask per tile with the bits of ResourceTool.get_extra_bits.
+        :parameter extra_resources: numpy.ndarray<uint64>, packed extras like the "__raw__" of the resource outputs,
+            the ones of the map by default.
+        :return: numpy.ndarray<uint64>, built (y,x).
+        """
+        return self._extras if extra_resources is None else extra_resources
+
+    def get_extras_mask(self, names:list=None, every:bool=False, extra_resources=None):
+        """numpy.ndarray<bool>, built (y,x), the tiles with any of the extras names, all of them if every, any resource by default."""
+        return ResourceTool.has_extras(self.get_extras(extra_resources), names, every)
+
+    def _get_extras_output(self, extra_resources, format_type):
+        """Sav rows of the extras layers of packed extras."""
+        extra_output = dict()
+        for eid, keys in self._extra_keys.items():
+            extra_output.update(self._convert_format(extra_resources, keys, format_type, eid))
+        return extra_output
+
     def _align_extras_map(self, resource_map, format_type):
         """ Align the external map with global resource map. """
         extra_output = dict()
-        for eid in self._extra_resources:
-            extra_map = copy.deepcopy(self._extra_resources[eid]["map"])
-            extra_output.update(self._convert_format(MapTool.align_to_extra(eid, extra_map, resource_map),
-                                                    self._extra_resources[eid]["key"], format_type))
+        resources = MapTool._get_resource_array(resource_map)
+        for eid, keys in self._extra_keys.items():
+            extra_output.update(self._convert_format(MapTool.align_to_extra(eid, self._extras, resources), keys, format_type))
 
         return extra_output
 
     def _align_players_map(self, global_map, format_type):
         """ Align players map with global map. """
         players_map = dict()
+        global_map = np.asarray(global_map)
         for player in self._player_map_data:
-            player_map = copy.deepcopy(self._players_map[player]["map"])
-            players_map[player] = self._convert_format(MapTool.align_to_map(player_map, global_map),
+            players_map[player] = self._convert_format(MapTool.align_to_map(self._players_map[player]["map"], global_map),
                                                     self._players_map[player]["key"], format_type)
         return players_map
 
     def _align_players_resource(self, global_resource, format_type):
         """ Align players map with global map. """
         players_resource = dict()
+        # eid -> hex digits of the global layer
+        digits = ResourceTool.unpack_extras(global_resource, list(self._extra_keys))
         for player in self._player_resource_data:
             players_resource[player] = dict()
             for eid in self._player_resource_data[player]:
-                player_resource = copy.deepcopy(self._players_resource[player][eid]["map"])
-                players_resource[player].update(self._convert_format(MapTool.align_to_resource(player_resource, global_resource[eid]["map"]),
+                players_resource[player].update(self._convert_format(MapTool.align_to_map(self._players_resource[player][eid]["map"], digits[eid]),
                                                         self._players_resource[player][eid]["key"], format_type))
         return players_resource
 
@@ -373,17 +930,6 @@ class MapTool(object):
                 _locations.append(loc)
         return _locations
     
-    def _check_loop_locations(self, locations):
-        _locations = list()
-        for loc in locations:
-            x, y = loc[0], loc[1]
-            if x < 0: x += self.xsize
-            if y < 0: y += self.ysize
-            if x >= self.xsize: x %= self.xsize
-            if y >= self.ysize: y %= self.ysize
-            _locations.append([x, y])
-        return _locations
-
     def get_map_accessible_location(self):
         x, y = random.choice(list(range(self.xsize))), \
                 random.choice(list(range(self.ysize)))
@@ -402,7 +948,8 @@ class MapTool(object):
         best_locations = set()
         if connectivity:
             metrics = self.cal_connectivity_layer(input_map)
-            best_locations = metrics["best_locations"]
+            # the largest ocean for the ships
+            best_locations = metrics["ocean"]["best_locations"] if is_ocean else metrics["best_locations"]
 
         for x in list(range(CITY_SCOPE_DEPTH, self.xsize-CITY_SCOPE_DEPTH)):
             for y in list(range(CITY_SCOPE_DEPTH, self.ysize-CITY_SCOPE_DEPTH)):
@@ -465,8 +1012,8 @@ class MapTool(object):
                 for _resource in pop_choice_resource:
                     PropertyBean.set_prop(choice_prop, "resource_property", dict_minus_by_list(
                         [PropertyBean.get_prop(choice_prop, "resource_property"), self._get_resource_fpt_conf(_resource)]))
-                    eid = _resource.split("_")[0]
-                    extra_map[eid]["map"][_y][_x] = eid+"_0"
+                    ResourceTool.set_extra(extra_map, (_y, _x), _resource.split("_")[0]+"_0")
+                    self._update_yield_grids(_y, _x, extra_resources=extra_map)
                 new_resource_score = dict_sum(PropertyBean.get_prop(choice_prop, "resource_property"), weight)
                 choice_resource_score = PropertyBean.get_prop(choice_prop, "resource_score")
                 PropertyBean.set_prop(choice_prop, "resource_score", new_resource_score)
@@ -475,8 +1022,8 @@ class MapTool(object):
         return choice_resource_score, new_resource_score
     
     def _clean_resource(self, extra_map, _y, _x):
-        for eid in extra_map:
-            extra_map[eid]["map"][_y][_x] = eid+"_0"
+        extra_map[_y, _x] = 0
+        self._update_yield_grids(_y, _x, extra_resources=extra_map)
         return 
     
     def _remove_resource(self, choice_prop, extra_map, weight, _y, _x):
@@ -490,8 +1037,8 @@ class MapTool(object):
         PropertyBean.set_prop(choice_prop, "resource_score", new_resource_score)
         new_resource = PropertyBean.get_prop(choice_prop, "resource")
         _y, _x = PropertyBean.get_prop(choice_prop, "location")
-        eid = choice_resource.split("_")[0]
-        extra_map[eid]["map"][_y][_x] = eid+"_0"
+        ResourceTool.set_extra(extra_map, (_y, _x), choice_resource.split("_")[0]+"_0")
+        self._update_yield_grids(_y, _x, extra_resources=extra_map)
         #print(f"RESOURCE REMOVE: {choice_resource}, {choice_resource_score} -> {new_resource}, {new_resource_score}!")
         return choice_resource_score, new_resource_score
 
@@ -509,17 +1056,19 @@ class MapTool(object):
         PropertyBean.set_prop(choice_prop, "resource_score", new_resource_score)
         new_resource = PropertyBean.get_prop(choice_prop, "resource")
         _y, _x = PropertyBean.get_prop(choice_prop, "location")
-        eid = choice_resource.split("_")[0]
-        extra_map[eid]["map"][_y][_x] = choice_resource
+        ResourceTool.set_extra(extra_map, (_y, _x), choice_resource)
+        self._update_yield_grids(_y, _x, extra_resources=extra_map)
         #print(f"RESOURCE ADD: {choice_resource}, {choice_resource_score} -> {new_resource}, {new_resource_score}!")
         return choice_resource_score, new_resource_score
 
-    def _random_gen(self, properties_list, terrain_product, extra_map, rand_map, weight):
-        choice_prop = random.choice(properties_list)
+    def _random_gen(self, scope, terrain_product, extra_map, rand_map, weight):
+        """Change a random tile of the scope to a terrain of the same score level, read from the yield grid of the maps."""
+        choice_prop = self._calulate_map_properties([random.choice(scope)], weight, rand_map, extra_map)[0]
         if PropertyBean.get_prop(choice_prop, "terrain") not in FPT_ZERO_SIGNAL_LIST:
             target_terrain = terrain_product[PropertyBean.get_prop(choice_prop, "terrain_score")]
 
-            if self._beyond_limit(properties_list, LAKE_SIGNAL) and LAKE_SIGNAL in target_terrain:
+            lake_rate = sum(rand_map[_y][_x] == LAKE_SIGNAL for _y, _x in scope) / len(scope)
+            if lake_rate > 0.2 and LAKE_SIGNAL in target_terrain:
                 prob = [1/(len(target_terrain)-1) if _ != LAKE_SIGNAL else 0 for _ in target_terrain]
                 new_terrain = np.random.choice(target_terrain, p=prob)
             else:
@@ -530,6 +1079,7 @@ class MapTool(object):
             _y, _x = PropertyBean.get_prop(choice_prop, "location")
             #print(f"RANDOM CHANGE: {rand_map[_y][_x]} -> {new_terrain}!")
             rand_map[_y][_x] = new_terrain
+            self._update_yield_grids(_y, _x, input_map=rand_map)
             # remove unconsistent resource
             self._remove_resource_with_terrain(choice_prop, new_terrain, extra_map, weight, _y, _x)
 
@@ -565,6 +1115,7 @@ class MapTool(object):
         PropertyBean.set_prop(choice_prop, "terrain_score", new_terrain_score)
         #print(f"TERRAIN CHANGE: {rand_map[_y][_x]}, {choice_terrain_score} -> {new_terrain}, {new_terrain_score}!")
         rand_map[_y][_x] = new_terrain
+        self._update_yield_grids(_y, _x, input_map=rand_map)
         return choice_terrain_score, new_terrain_score, new_terrain
     
     def _close_to_ocean(self, x, y, rand_map):
@@ -579,41 +1130,36 @@ class MapTool(object):
         return close_list, accessible_list
 
     def _cal_distance_with_loop(self, loc1, loc2):
-        return min(abs(loc1[0]-loc2[0]), abs(self.xsize-loc1[0]+loc2[0])), min(abs(loc1[1]-loc2[1]), abs(self.ysize-loc1[1]+loc2[1]))
-
-    def _is_less_than_distance(self, center, locations, dist_lower, dist_upper):
-        for location in locations:
-            xdist, ydist = self._cal_distance_with_loop(center, location)
-            if not (xdist >= dist_lower and xdist <= dist_upper \
-                and ydist >= dist_lower and ydist <= dist_upper):
-                return True
-        return False
-
-    def _get_center_recent_locations(self, land_locations, center, radius, known_list, ocean_locations=list()):
-        req_land_locations = list()
-        req_ocean_locations = list()
-
-        for _location in land_locations:
-            xdist, ydist = self._cal_distance_with_loop(center, _location)
-            if xdist <= radius and ydist <= radius and _location not in known_list:
-                req_land_locations.append(_location)
-                known_list += _location
-
-        for _location in ocean_locations:
-            xdist, ydist = self._cal_distance_with_loop(center, _location)
-            if xdist <= radius and ydist <= radius and _location not in known_list:
-                req_ocean_locations.append(_location)
-                known_list += _location
-
-        return req_land_locations, req_ocean_locations
+        xdist, ydist = self.coords.get_distances(loc1[0], loc1[1], loc2[0], loc2[1])
+        return int(xdist), int(ydist)
+
+    def _count_locations(self, locations):
+        """numpy.ndarray<int64> of (ysize, xsize), the number of times the tiles are in the locations [x, y]."""
+        counts = np.zeros((self.ysize, self.xsize), dtype=np.int64)
+        if len(locations) > 0:
+            xs, ys = np.array(locations, dtype=np.int64).reshape(-1, 2).T
+            np.add.at(counts, (ys, xs), 1)
+        return counts
+
+    def _get_center_recent_locations(self, locations, center, radius):
+        """Locations [x, y] within radius of the center along x and y, in their order."""
+        if len(locations) == 0:
+            return list()
+        xs, ys = np.array(locations, dtype=np.int64).reshape(-1, 2).T
+        xdist, ydist = self.coords.get_distances(xs, ys, center[0], center[1])
+        return [locations[i] for i in np.flatnonzero((xdist <= radius) & (ydist <= radius)).tolist()]
 
     def get_unit_clusters(self, land_locations, unit_cnt, radius, distance, max_step=100, extra=0, ocean_locations=list()):
-        step = 0
-        clusters = 0
-
-        unit_clusters = list()
-        center_list = list()
-        known_list = list()
+        """
+        Centers of the unit clusters of the players, in the order of unit_cnt, with enough land and ocean
+        locations within radius, and spaced by distance [lower, upper] along x and y from each other.
+        The locations within radius of every tile are counted at once by summed-area tables, so all the
+        feasible centers of a cluster are known and one is drawn from them; a placement stuck on a cluster
+        restarts, at most CLUSTER_MAX_TRIES times.
+        :return: list of {"center": [x, y], "candidate": [[x, y]]}, with "land" and "ocean" when unit_cnt
+            gives them per player; shorter than the players with units if no placement is found.
+        """
+        players = list(unit_cnt.keys())
         cluster_cnt = 0
         for player, unit_c in unit_cnt.items():
             if isinstance(unit_c, dict):
@@ -622,37 +1168,44 @@ class MapTool(object):
             else:
                 if unit_c > 0:
                     cluster_cnt += 1
-        while clusters < cluster_cnt and step < 100:
-            if isinstance(unit_cnt[list(unit_cnt.keys())[0]], dict):
-                center = random.choice(land_locations+ocean_locations)
-                req_land_locations, req_ocean_locations = self._get_center_recent_locations(land_locations, 
-                                                                                        center, 
-                                                                                        radius, 
-                                                                                        known_list, 
-                                                                                        ocean_locations=ocean_locations)
-
-                if len(req_land_locations) >= min(unit_cnt[list(unit_cnt.keys())[clusters]]["land"]+extra, 3) \
-                    and len(req_ocean_locations) >= min(unit_cnt[list(unit_cnt.keys())[clusters]]["ocean"], 3) \
-                    and center not in center_list \
-                    and not self._is_less_than_distance(center, center_list, distance[0], distance[1]):
-                    unit_clusters.append({"center": center, "candidate": req_land_locations, "land": req_land_locations, "ocean": req_ocean_locations})
-                    center_list.append(center)
-                    clusters += 1
-            else:
-                center = random.choice(land_locations)
-                req_land_locations, req_ocean_locations = self._get_center_recent_locations(land_locations, 
-                                                                                        center, 
-                                                                                        radius, 
-                                                                                        known_list, 
-                                                                                        ocean_locations=ocean_locations)
-
-                if len(req_land_locations) >= unit_cnt[list(unit_cnt.keys())[clusters]]+extra \
-                    and center not in center_list \
-                    and not self._is_less_than_distance(center, center_list, distance[0], distance[1]):
-                    unit_clusters.append({"center": center, "candidate": req_land_locations})
-                    center_list.append(center)
-                    clusters += 1
-            step += 1
+        if cluster_cnt == 0:
+            return list()
+
+        split = isinstance(unit_cnt[players[0]], dict)
+        centers = land_locations+ocean_locations if split else land_locations
+        if len(centers) == 0:
+            return list()
+        xs, ys = np.array(centers, dtype=np.int64).reshape(-1, 2).T
+        land_cnt = self.coords.get_window_sums(self._count_locations(land_locations), radius)[ys, xs]
+        ocean_cnt = self.coords.get_window_sums(self._count_locations(ocean_locations), radius)[ys, xs]
+
+        unit_clusters = list()
+        for _ in range(CLUSTER_MAX_TRIES):
+            clusters = list()
+            spaced = np.ones(len(centers), dtype=bool)
+            while len(clusters) < cluster_cnt:
+                unit_c = unit_cnt[players[len(clusters)]]
+                if split:
+                    feasible = (land_cnt >= min(unit_c["land"]+extra, 3)) & (ocean_cnt >= min(unit_c["ocean"], 3))
+                else:
+                    feasible = land_cnt >= unit_c+extra
+                if len(feasible := np.flatnonzero(feasible & spaced)) == 0:
+                    break
+                center = centers[random.choice(feasible.tolist())]
+                xdist, ydist = self.coords.get_distances(xs, ys, center[0], center[1])
+                spaced &= (xdist >= distance[0]) & (xdist <= distance[1]) & (ydist >= distance[0]) & (ydist <= distance[1])
+                spaced &= (xdist > 0) | (ydist > 0)
+
+                req_land_locations = self._get_center_recent_locations(land_locations, center, radius)
+                if split:
+                    req_ocean_locations = self._get_center_recent_locations(ocean_locations, center, radius)
+                    clusters.append({"center": center, "candidate": req_land_locations, "land": req_land_locations, "ocean": req_ocean_locations})
+                else:
+                    clusters.append({"center": center, "candidate": req_land_locations})
+            if len(clusters) > len(unit_clusters):
+                unit_clusters = clusters
+            if len(unit_clusters) == cluster_cnt:
+                break
         return unit_clusters
 
     def _modify_land(self, rand_map, extra_map, land_center):
@@ -696,45 +1249,42 @@ class MapTool(object):
 
         # remove resource
         if new_terrain is not None:
+            self._update_yield_grids(_y, _x, input_map=rand_map)
             self._clean_resource(extra_map, _y, _x)
         return
 
-    def _rotation_map(self, rotation_angle=90, is_isotropy=True):
-        # terrain rotation
-        input_map = self._global_map
-        rotation_terrain_map = [[' ' for _ in range(self.xsize)] for _ in range(self.ysize)]
-        center_x = int(self.xsize/2) - 1
-        center_y = int(self.ysize/2) - 1
-        for y in range(len(input_map)):
-            for x in range(len(input_map[0])):
-                terrain = input_map[y][x]
-                _x = round(float(x-center_x) * np.cos(rotation_angle) - float(y-center_y) * np.sin(rotation_angle) + center_x) % self.xsize
-                _y = round(float(x-center_y) * np.sin(rotation_angle) + float(y-center_y) * np.cos(rotation_angle) + center_y) # % self.ysize
-                if _y >= 0 and _y < self.ysize:
-                    rotation_terrain_map[_y][_x] = terrain
-        self._global_map = rotation_terrain_map
-
-        # resource rotation
-        rotation_extra_map = [[None for _ in range(self.xsize)] for _ in range(self.ysize)]
-        for eid, data in self._extra_resources.items():
-            for y, l in enumerate(data["map"]):
-                for x, r in enumerate(l):
-                    _x = round(float(x-center_x) * np.cos(rotation_angle) - float(y-center_y) * np.sin(rotation_angle) + center_x) % self.xsize
-                    _y = round(float(x-center_x) * np.sin(rotation_angle) + float(y-center_y) * np.cos(rotation_angle) + center_y) % self.ysize
-                    self._extra_resources[eid]["map"][_y][_x] = self._extra_resources[eid]["map"][y][x]
-                    if not r.endswith("0"):
-                        rotation_extra_map[y][x] = r
-        return rotation_terrain_map, rotation_extra_map
-
-    def _shift_map(self, windows):
+    def transform(self, map_transform:MapTransform):
+        """
+        Move all the layers of the map by a MapTransform in place: terrain, extras,
+        known map and the terrain and extras layers of the players.
+        """
+        # the global layers are replaced and moved
+        self._yield_grids.clear()
+        map_transform.apply_rows(self._global_map)
+        map_transform.apply_rows(self._layers["connectivity"])
+        self._extras = map_transform.apply(self._extras)
+        for player in self._players_map:
+            map_transform.apply_rows(self._players_map[player]["map"])
+            for eid in self._players_resource.get(player, {}):
+                map_transform.apply_rows(self._players_resource[player][eid]["map"])
+        if len(self._seen_map) > 0:
+            map_transform.apply_rows(self._seen_map)
+        if self._known.shape == (self.ysize, self.xsize):
+            self._known = map_transform.apply(self._known)
         return
 
-    def gen_rotation_shift_map(self, format_type:str, rotation:int):
-        rotation_terrain_map, rotation_extra_map = self._rotation_map(rotation_angle=rotation)
-        terrain_output = {"__raw__": self._global_map, "global": MapTool._convert_format(rotation_terrain_map, self._global_keys, format_type)}
-        resource_output = self._align_extras_map(rotation_extra_map, format_type)
-        resource_output["__raw__"] = copy.deepcopy(self._extra_resources)
-        return terrain_output, resource_output, None
+    def gen_rotation_shift_map(self, format_type:str, rotation:float=0, mirror:str=None, shift:tuple=(0, 0)):
+        """
+        Generate a map by an exact transform of the map: a mirror, a rotation by a multiple of pi/2
+        and a shift along the wrapped axes.
+        :return: terrain and resource outputs, and the MapTransform to apply to the units and cities.
+        """
+        map_transform = MapTransform(self.xsize, self.ysize, MapTransform.get_quarter_turns(rotation), mirror, shift, self.topology)
+        self.transform(map_transform)
+        terrain_output = {"__raw__": self._global_map, "global": MapTool._convert_format(self._global_map, self._global_keys, format_type)}
+        resource_output = self._get_extras_output(self._extras, format_type)
+        resource_output["__raw__"] = self._extras.copy()
+        return terrain_output, resource_output, map_transform
 
     def gen_random_walk_map(self, format_type:str, 
                             max_steps:int=1000000, 
@@ -762,7 +1312,9 @@ class MapTool(object):
         land_center = self.get_map_accessible_location()
 
         rand_map = copy.deepcopy(self._global_map)
-        extra_map = copy.deepcopy(self._extra_resources)
+        extra_map = self._extras.copy()
+        # scores of the city centers, kept up to date by the edits of rand_map & extra_map
+        city_index = self.get_yield_grid(rand_map, extra_map).get_city_index(CityTool.cal_city_scope(0, 0), topk, weight, keep_ocean)
         record_covergence = list()
         step = 0
         while step < max_steps:
@@ -780,15 +1332,9 @@ class MapTool(object):
                 # scope
                 scope = CityTool.cal_city_scope(x, y)
 
-                # score
-                total_property_dict, properties_list = self.calulate_map_properties_by_order(scope, 
-                                                                                             topk=topk, 
-                                                                                             weight=weight,
-                                                                                             input_map=rand_map,
-                                                                                             extra_resources=extra_map,
-                                                                                             keep_ocean=keep_ocean)
-                # change terrain
-                score = dict_sum(total_property_dict, weight)
+                # score, the properties of the scope are only built to bring it back in score_bound
+                score = city_index.get_score(x, y)
+                properties_list = None
                 #print(f"=====walk: {walk}, score: {score}=====")
                 if score_bound is not None:
                     lower_cond = score - score_lower_bound_conf
@@ -801,6 +1347,13 @@ class MapTool(object):
 
                     while lower_cond < 0 or upper_cond > 0:
 
+                        if properties_list is None:
+                            _, properties_list = self.calulate_map_properties_by_order(scope, 
+                                                                                       topk=topk, 
+                                                                                       weight=weight,
+                                                                                       input_map=rand_map,
+                                                                                       extra_resources=extra_map,
+                                                                                       keep_ocean=keep_ocean)
                         # reorder
                         properties_list = self._reorder_terrains(properties_list, keep_ocean, topk)
                         topk_list = properties_list[:topk]
@@ -865,7 +1418,7 @@ class MapTool(object):
 
                 if step < 0.6 * max_steps:
                     # randomly change terrain and resource in the same fpt level
-                    self._random_gen(properties_list, terrain_product, extra_map, rand_map, weight)
+                    self._random_gen(scope, terrain_product, extra_map, rand_map, weight)
 
                 if step < 0.5 * max_steps:
                     # randomly change land shape
@@ -878,8 +1431,6 @@ class MapTool(object):
                 walk += 1
             step += 1
 
-        terrain_output = {"__raw__": rand_map, "global": MapTool._convert_format(rand_map, self._global_keys, format_type)}
-
         # optimal extra: todo
         if extra_optimal:
             resource_conf = ResourceTool.get_resource_conf()
@@ -889,71 +1440,187 @@ class MapTool(object):
                     if terrain in self.terrain_optimal_extra_conf:
                         self.terrain_optimal_extra_conf[terrain]
 
-        # resource randomly
-        resource_map = [[None for x in y] for y in rand_map]
-        for eid, data in extra_map.items():
-            for i, y in enumerate(data["map"]):
-                for j, x in enumerate(y):
-                    if not x.endswith("0"):
-                        if resource_map[i][j] is not None:
-                            resource_map[i][j] = resource_map[i][j] + "," + x
-                        else:
-                            resource_map[i][j] = x
-        resource_output = self._align_extras_map(resource_map, format_type)
-        resource_output["__raw__"] = copy.deepcopy(extra_map)
-
         covergence = [len(step) for step in record_covergence]
+        return self._walk_output(rand_map, extra_map.copy(), format_type, covergence, land_center)
+
+    def _walk_output(self, rand_map, extra_map, format_type, covergence, land_center):
+        """Terrain and resource outputs and report of a walked map."""
+        terrain_output = {"__raw__": rand_map, "global": MapTool._convert_format(rand_map, self._global_keys, format_type)}
+
+        resource_output = self._get_extras_output(extra_map, format_type)
+        resource_output["__raw__"] = extra_map
+
         report = {"covergence": covergence, "land_center": land_center}
 
         return terrain_output, resource_output, report
 
-    def gen_other_map(self, terrain_conf, resource_conf, unit_locations, city_locations={}, format_type=None):
-        # recalcuate the player map of unseen part, default a
+    def gen_random_walk_maps(self, format_type:str, 
+                             batch:int, 
+                             max_steps:int, 
+                             topk:int=6, 
+                             weight:dict=None,
+                             score_bound:float=None,
+                             max_walks:int=100,
+                             margin:int=2,
+                             keep_ocean:bool=True,
+                             seed:int=None,
+                             max_actions:int=WALK_MAX_ACTIONS,
+                             max_retries:int=WALK_MAX_RETRIES
+                             ):
+        """ Generate batch maps by random walk, like batch calls of gen_random_walk_map.
+        The maps are walked together by a WalkBatch; each walk step draws for all of them at once,
+        and a center out of score_bound is scored again after every action.
+        A map whose center has no valid action, where gen_random_walk_map raises, or is not back in
+        score_bound after max_actions actions is dropped and walked again, up to max_retries rounds,
+        then ValueError is raised.
+        seed: seed of the numpy generator of the walk, fresh entropy of the OS by default,
+            so that the forked workers of a pool walk different maps.
+        max_actions: actions to bring a center back in score_bound, None to go on until it is back
+            like gen_random_walk_map, which never ends for a bound out of reach.
+        max_retries: rounds of walking again the dropped maps.
+        Return a list of (terrain_output, resource_output, report).
+        """
+        rng = np.random.default_rng(seed)
+        outputs = list()
+        for _ in range(max_retries + 1):
+            walk_batch, covergence, land_centers, ok = self._walk_batch(batch - len(outputs), max_steps, topk, weight, score_bound,
+                                                                        max_walks, margin, keep_ocean, rng, max_actions)
+            for b in np.nonzero(ok)[0].tolist():
+                rand_map, extra_map = walk_batch.to_maps(b)
+                outputs.append(self._walk_output(rand_map, extra_map, format_type, covergence[b].tolist(), land_centers[b].tolist()))
+            if len(outputs) == batch:
+                return outputs
+        raise ValueError(f"No valid action for {batch - len(outputs)} of {batch} maps after {max_retries} retries, score_bound={score_bound}!")
+
+    def _walk_batch(self, batch:int, max_steps:int, topk:int, weight:dict, score_bound, max_walks:int, margin:int, keep_ocean:bool, rng,
+                    max_actions:int=WALK_MAX_ACTIONS):
+        """
+        Walk batch maps at once.
+        Return the WalkBatch, the actions (batch, steps) of the bound loops, the land centers and the maps kept in score_bound.
+        """
+        walk_batch = WalkBatch(self, batch, topk=topk, weight=weight, keep_ocean=keep_ocean, rng=rng)
+        lower, upper = score_bound if score_bound is not None else (-np.inf, np.inf)
+
+        # get land centers
+        land_centers = np.stack([rng.integers(0, self.xsize, batch), rng.integers(0, self.ysize, batch)], axis=1)
+
+        # actions of every step, grown step by step
+        covergence = list()
+        ok = np.ones(batch, dtype=bool)
+        for step in range(max_steps):
+            covergence.append(np.zeros(batch, dtype=np.int64))
+            # initial locations, the failed maps are not walked anymore
+            bs = np.nonzero(ok)[0]
+            xs, ys = walk_batch.get_city_accessible_locations()
+            xs, ys = xs[bs], ys[bs]
+            walk = 0
+            while walk < max_walks and len(bs) > 0:
+                actions, restored = walk_batch.restore_bound(bs, xs, ys, lower, upper, max_actions)
+                covergence[step][bs] += actions
+                ok[bs[~restored]] = False
+                bs, xs, ys = bs[restored], xs[restored], ys[restored]
 
-        for player_id in unit_locations:
-            unit_location = unit_locations[player_id]
-            city_location = city_locations[player_id] if player_id in city_locations else {}
+                if step < 0.6 * max_steps:
+                    # randomly change terrain and resource in the same fpt level
+                    walk_batch.random_gen(bs, xs, ys)
+
+                if step < 0.5 * max_steps:
+                    # randomly change land shape
+                    walk_batch.modify_land(bs, land_centers)
+
+                # randomly walk
+                xs, ys = walk_batch.sampling_step(bs, xs, ys, margin)
+                walking = xs >= 0
+                bs, xs, ys = bs[walking], xs[walking], ys[walking]
+                walk += 1
 
-            # init map & resouce
-            seen_locations = list()
-            for _unit_id, _unit_msg in unit_location.items():
-                _unit_location = _unit_msg["location"]
-                _unit_name = _unit_msg["name"]
-                seen_locations += UnitTool.cal_unit_scope(_unit_name, _unit_location[0], _unit_location[1], self.xsize, self.ysize)
+        covergence = np.stack(covergence, axis=1) if len(covergence) > 0 else np.zeros((batch, 0), dtype=np.int64)
+        return walk_batch, covergence, land_centers, ok
 
-            for _city_id, _city_msg in city_location.items():
-                _city_location = _city_msg["location"]
-                seen_locations += CityTool.cal_city_scope_with_loop(_city_location[0], _city_location[1], self.xsize, self.ysize)
+    @staticmethod
+    def decode_known(layers):
+        """
+        Known map of the layers k00, k01..., list<list<list<str>>> of hex digits,
+        as numpy.ndarray<int64> of (ysize, xsize) with the bit i set where player i knows the tile.
+        """
+        known = None
+        for index, layer in enumerate(layers):
+            if len(layer) == 0:
+                continue
+            digits = np.array([[int(value, 16) for value in row] for row in layer], dtype=np.int64)
+            known = digits << (index * KNOWN_LAYER_PLAYERS) if known is None else known | (digits << (index * KNOWN_LAYER_PLAYERS))
+        return np.zeros((0, 0), dtype=np.int64) if known is None else known
+
+    @staticmethod
+    def encode_known(known, layer_cnt:int=1):
+        """Layers k00, k01... of a known map, list<list<list<str>>> of a hex digit per tile, at least layer_cnt of them."""
+        while int(known.max(initial=0)) >> (layer_cnt * KNOWN_LAYER_PLAYERS) > 0:
+            layer_cnt += 1
+        digits = np.array(list(KNOWN_DIGITS))
+        return [digits[(known >> (index * KNOWN_LAYER_PLAYERS)) & (2**KNOWN_LAYER_PLAYERS - 1)].tolist() for index in range(layer_cnt)]
+
+    @staticmethod
+    def _get_player_no(player_id:str):
+        return int(re.search(r"\d+", player_id)[0])
+
+    def get_vision_mask(self, unit_location:dict, city_location:dict=None):
+        """
+        numpy.ndarray<bool> of (ysize, xsize), the tiles seen by the units and the cities,
+        stamped from the footprints at all their locations at once.
+        :parameter unit_location: {unit_id: {"location": [x, y], "name": str, optional "vision_radius_sq": int}}
+        :parameter city_location: {city_id: {"location": [x, y]}}
+        """
+        # (radius_sq, depth) -> locations [x, y]
+        footprints = dict()
+        for _unit_msg in unit_location.values():
+            if (vision_radius_sq := _unit_msg.get("vision_radius_sq")) is None:
+                vision_radius_sq = UnitTool.get_vision_radius_sq(_unit_msg["name"])
+            footprints.setdefault(UnitTool.get_scope_radius(vision_radius_sq), list()).append(_unit_msg["location"])
+        for _city_msg in (city_location or {}).values():
+            footprints.setdefault((CITY_RADIUS_SQ, CITY_SCOPE_DEPTH), list()).append(_city_msg["location"])
+
+        seen = np.zeros((self.ysize, self.xsize), dtype=bool)
+        for (radius_sq, depth), locations in footprints.items():
+            xs, ys = np.array(locations, dtype=np.int64).reshape(-1, 2).T
+            seen |= self.coords.get_mask(xs, ys, radius_sq, depth)
+        return seen
+
+    def gen_other_map(self, terrain_conf, resource_conf, unit_locations, city_locations={}, format_type=None):
+        """
+        Recalculate the maps of the players from the vision of their units and cities: the tiles out of it
+        are unseen on their terrain and extras layers, and their bits of the known map are set on it only.
+        """
+        if self._known.shape != (self.ysize, self.xsize):
+            self._known = np.zeros((self.ysize, self.xsize), dtype=np.int64)
+        for player_id in unit_locations:
+            seen = self.get_vision_mask(unit_locations[player_id], city_locations.get(player_id, {}))
+            player_bit = 1 << MapTool._get_player_no(player_id)
+            self._known = np.where(seen, self._known | player_bit, self._known & ~player_bit)
 
             # player map
             player_map = self._players_map[player_id]["map"]
-            for y in range(len(player_map)):
-                for x in range(len(player_map[0])):
-                    if int(player_id[-1]) == 0:
-                        self._seen_map[y][x] = "0"
-                    if [y, x] in seen_locations:
-                        player_map[y][x] = "a"
-                        if self._seen_map[y][x] == "0":
-                            self._seen_map[y][x] = str(int(player_id[-1])+1)
-                    else:
-                        player_map[y][x] = "u"
+            player_map[:] = np.where(seen, "a", UNSEEN_SIGNAL).tolist()
 
             # player resource
             for eid in self._players_resource[player_id]:
                 resource_map = self._players_resource[player_id][eid]["map"]
-                for y in range(len(resource_map)):
-                    for x in range(len(resource_map[0])):
-                        if [y, x] in seen_locations:
-                            resource_map[y][x] = "a"
-                        else:
-                            resource_map[y][x] = "0"
+                resource_map[:] = np.where(seen, "a", "0").tolist()
+
+        # every layer of the sav is written back, the new ones keyed like the rows of k00
+        known_layers = MapTool.encode_known(self._known, max(self._known_keys, default=0)+1)
+        self._seen_map[:] = known_layers[0]
+        seen_conf = self._convert_format(self._seen_map, self._seen_keys, format_type)
+        for index, layer in enumerate(known_layers[1:], 1):
+            if (keys := self._known_keys.get(index)) is None:
+                keys = [f"k{index:02d}{key[3:]}" for key in self._seen_keys]
+            seen_conf.update(self._convert_format(layer, keys, format_type))
 
         # align players_map
         players_map = self._align_players_map(terrain_conf["__raw__"], format_type)
         players_resource = self._align_players_resource(resource_conf["__raw__"], format_type)
 
         terrain_conf.update(players_map)
-        terrain_conf.update({"seen": self._convert_format(copy.deepcopy(self._seen_map), self._seen_keys, format_type)})
+        terrain_conf.update({"seen": seen_conf})
 
         resource_conf.update(players_resource)
 
@@ -979,18 +1646,18 @@ class MapTool(object):
         return output
 
     @staticmethod
-    def statis_map_topk(x, y, terrain_map, extra_map, terrain_conf, extra_conf, weight:dict=None, topk:int=6):
-        """ Statistic map by sampling. """        
+    def statis_map_topk(x, y, terrain_map, extra_map, terrain_conf, extra_conf, weight:dict=None, topk:int=6, topology:str=None):
+        """ Statistic map by sampling, with the city scope wrapped by the topology of the map. """        
         if not MapTool._if_accessible(x, y, terrain_map):
             return
         
         # scope
-        scope = CityTool.cal_city_scope_with_loop(x, y, len(terrain_map[0]), len(terrain_map))
+        scope = CityTool.cal_city_scope_with_loop(x, y, len(terrain_map[0]), len(terrain_map), topology)
         total_score, terrain_score, extra_score = MapTool.calulate_cri(scope, weight, terrain_map, extra_map, terrain_conf, extra_conf, topk)
         return total_score, terrain_score, extra_score
 
     @staticmethod
-    def statis_map_properties(terrain_map, extra_map, terrain_conf, extra_conf):
+    def statis_map_properties(terrain_map, extra_map, terrain_conf, extra_conf, topology:str=None):
         statis_terrain = dict()
         statis_extra = dict()
         for y in range(len(terrain_map)):
@@ -998,7 +1665,7 @@ class MapTool(object):
                 if not MapTool._if_accessible(x, y, terrain_map):
                     continue
                     
-                scope = CityTool.cal_city_scope_with_half_loop(x, y, len(terrain_map[0]), len(terrain_map))
+                scope = CityTool.cal_city_scope_with_half_loop(x, y, len(terrain_map[0]), len(terrain_map), topology)
                 for loc in scope:
                     # terrain
                     if (terrain := terrain_map[loc[0]][loc[1]]) not in statis_terrain:
@@ -1074,53 +1741,86 @@ class MapTool(object):
     
     def statis_map(self, unit_locations, threshold, topk:int=6, weight:dict=None, 
                    max_turns=10, input_map=None, extra_resources=None):
-        """ Statistic map by every location. """
+        """ Statistic map by every location.
+        The topk scores of the city scopes of all tiles are computed once, and the units only select their reach.
+        """
         output = {}
+        grid = self.get_yield_grid(input_map, extra_resources)
+        topk_score = grid.get_city_index(CityTool.cal_city_scope(0, 0), topk, weight).scores
+        # the tiles are listed by x, then y
+        score_seq = topk_score.T.reshape(-1)
+        land = ~np.isin(np.array(grid.terrain_map), FPT_ZERO_SIGNAL_LIST)
+        output["global"] = {"topk_score": topk_score}
+        output.update(self._cal_statis(score_seq))
+        # (x, y) -> reach of the units there, shared by the units of all players
+        reach = dict()
         for player in unit_locations:
             output[player] = {}
             for uid in unit_locations[player]:
                 output[player][uid] = {}
                 x = unit_locations[player][uid]["location"][0]
                 y = unit_locations[player][uid]["location"][1]
-                max_turns_scope = UnitTool.cal_unit_max_scope(x, y, max_turns)
-
-                topk_score_list = [[0 for _ in range(self.xsize)] for _ in range(self.ysize)]
-                score_seq = list()
-                unit_score_seq = list()
-                for x in range(self.xsize):
-                    for y in range(self.ysize):
-                        city_scope = CityTool.cal_city_scope(x, y)
-                        city_scope = self._check_loop_locations(city_scope)
-                        topk_property, _ = self.calulate_map_properties_by_order(city_scope, 
-                                                                                topk=topk, 
-                                                                                weight=weight,
-                                                                                input_map=input_map,
-                                                                                extra_resources=extra_resources)
-                        topk_score = dict_sum(topk_property, weight)
-                        topk_score_list[y][x] = topk_score
-                        score_seq.append(topk_score)
-                        if [y, x] in max_turns_scope and input_map[y][x] not in FPT_ZERO_SIGNAL_LIST:
-                            unit_score_seq.append(topk_score)
-                score_seq = np.array(score_seq)
-                unit_score_seq = np.array(unit_score_seq)
-
-                output["global"] = {"topk_score": np.array(topk_score_list)}
-                output.update(self._cal_statis(score_seq))
+                # UnitTool.cal_unit_max_scope, wrapped by the topology of the map
+                if (max_turns_scope := reach.get((x, y))) is None:
+                    max_turns_scope = self.coords.get_mask([x], [y], 2*max_turns**2, max_turns)
+                    reach[(x, y)] = max_turns_scope
+                unit_score_seq = topk_score.T[(max_turns_scope & land).T]
                 output[player][uid].update(self._cal_statis(unit_score_seq))
-                output[player][uid].update({"optimal": self._find_optimal_locations(output["global"]["topk_score"], 
+                output[player][uid].update({"optimal": self._find_optimal_locations(topk_score, 
                                                                             output[threshold], max_turns_scope, max_turns)})
         return output
 
     def _find_optimal_locations(self, statis_map, threshold, scope=None, max_turns=10):
-        """ Find optimal locations. """
-        optimal_locations = list()
-        for x in range(statis_map.shape[1]):
-            for y in range(statis_map.shape[0]):
-                if scope is not None and [y, x] not in scope:
-                    continue
-                if statis_map[y][x] > threshold:
-                    optimal_locations.append([y, x])
-        return optimal_locations
+        """ Find optimal locations [y, x], by x then y.
+        :parameter scope: list of [y, x], or a boolean mask of statis_map.
+        """
+        optimal = statis_map > threshold
+        if scope is not None:
+            if not isinstance(scope, np.ndarray):
+                mask = np.zeros(statis_map.shape, dtype=bool)
+                for y, x in scope:
+                    if 0 <= y < statis_map.shape[0] and 0 <= x < statis_map.shape[1]:
+                        mask[y, x] = True
+                scope = mask
+            optimal &= scope
+        return [[y, x] for x, y in np.argwhere(optimal.T).tolist()]
+
+    @staticmethod
+    def label_components(mask, wrapx:bool=False, wrapy:bool=False):
+        """
+        Label the 4-connected components of the True tiles of a (ysize, xsize) mask, wrapped on the axes asked.
+        The labels count from 1 in the order of the first tile of the components, row by row, 0 for the False tiles.
+        Return the labels and the sizes of the components, sizes[label-1].
+        """
+        ysize, xsize = mask.shape
+        index = np.arange(mask.size).reshape(mask.shape)
+        pairs = [(index[:, :-1], index[:, 1:]), (index[:-1, :], index[1:, :])]
+        if wrapx and xsize > 2:
+            pairs.append((index[:, -1], index[:, 0]))
+        if wrapy and ysize > 2:
+            pairs.append((index[-1, :], index[0, :]))
+        flat = mask.reshape(-1)
+        edges = [(a.reshape(-1), b.reshape(-1)) for a, b in pairs]
+        tails = np.concatenate([a[flat[a] & flat[b]] for a, b in edges])
+        heads = np.concatenate([b[flat[a] & flat[b]] for a, b in edges])
+
+        # hook the greater root of every edge under the smaller one, then jump to the roots
+        parent = np.arange(mask.size)
+        while len(tails) > 0:
+            roots_a, roots_b = parent[tails], parent[heads]
+            if (linked := roots_a == roots_b).all():
+                break
+            tails, heads = tails[~linked], heads[~linked]
+            low, high = np.minimum(roots_a[~linked], roots_b[~linked]), np.maximum(roots_a[~linked], roots_b[~linked])
+            np.minimum.at(parent, high, low)
+            while not np.array_equal(jumped := parent[parent], parent):
+                parent = jumped
+
+        # the root of a component is its first tile
+        roots, inverse, sizes = np.unique(parent[flat], return_inverse=True, return_counts=True)
+        labels = np.zeros(mask.size, dtype=np.int64)
+        labels[flat] = inverse + 1
+        return labels.reshape(mask.shape), sizes
 
     def cal_connectivity_layer(self, grid=None):
         """Label the connectivity of map with different layers. For example, the connectivity layer of map would be like
@@ -1129,47 +1829,39 @@ class MapTool(object):
             1 1 1 1 0 0 0 0
             1 1 1 0 0 3 0 0
            Here, 0 means ocean tiles, and non-0 means different connected lands.
+           The lands and the oceans are connected across the wrapped edges of the topology.
+           The metrics of a map are kept while its terrains are unchanged.
+        :return metrics: dict, the lands "count", "best_island", "best_tiles_count", "best_locations" {(y, x)},
+            their "labels" (ysize, xsize) and "sizes", and the same for the oceans under "ocean".
         """
         if grid is None:
             grid = self._global_map
-        row = self.ysize
-        col = self.xsize
-        visited = set()
-        count = 0
-        directions=[(-1,0), (0,1), (1,0), (0,-1)]
-        island_label = dict()
-        island_visited = set()
-        best_island = -1
-        best_count = -1
-        def findIsland(x, y):
-            for dx, dy in directions:
-                nx, ny = x+dx, y+dy
-                if 0<=nx<row and 0<=ny<col and grid[nx][ny] not in LOCATION_NEGSIGNAL_LIST and (nx,ny) not in visited:
-                    visited.add((nx, ny))
-                    island_visited.add((nx, ny))
-                    findIsland(nx, ny)
-
-        for x in range(row):
-            for y in range(col):
-                if grid[x][y] not in LOCATION_NEGSIGNAL_LIST and (x,y) not in visited:
-                    island_visited.clear()
-                    count +=1
-                    # visited
-                    visited.add((x,y))
-                    island_visited.add((x,y))
-                    # find island
-                    findIsland(x,y)
-                    # label island
-                    island_label[count] = copy.deepcopy(island_visited)
-                    if len(island_visited) > best_count:
-                        best_count = len(island_visited)
-                        best_island = count
-                    for _x, _y in island_visited:
-                        self._layers["connectivity"][_x][_y] = count
-
-        # metrics initialize
-        metrics = {"count": count, "best_island": best_island, "best_tiles_count": best_count, "best_locations": island_label[best_island]}
-        return metrics
+        key = "\n".join("".join(row) for row in grid)
+        if (metrics := self._connectivity.get(key)) is None:
+            terrain = np.array(grid)
+            metrics = self._cal_components(~np.isin(terrain, LOCATION_NEGSIGNAL_LIST))
+            metrics["ocean"] = self._cal_components(np.isin(terrain, OCEAN_TERRAIN_LIST))
+            self._connectivity[key] = metrics
+            while len(self._connectivity) > CONNECTIVITY_CACHE_SIZE:
+                self._connectivity.popitem(last=False)
+        self._connectivity.move_to_end(key)
+
+        layer = np.array(self._layers["connectivity"], dtype=object)
+        layer[metrics["labels"] > 0] = metrics["labels"][metrics["labels"] > 0]
+        self._layers["connectivity"] = layer.tolist()
+        return dict(metrics)
+
+    def _cal_components(self, mask):
+        labels, sizes = MapTool.label_components(mask, self.coords.wrapx, self.coords.wrapy)
+        if len(sizes) == 0:
+            return {"count": 0, "best_island": -1, "best_tiles_count": -1, "best_locations": set(), "labels": labels, "sizes": sizes}
+        best = int(sizes.argmax()) + 1
+        return {"count": len(sizes), 
+                "best_island": best, 
+                "best_tiles_count": int(sizes[best-1]), 
+                "best_locations": set(map(tuple, np.argwhere(labels == best).tolist())),
+                "labels": labels,
+                "sizes": sizes}
 
     @staticmethod
     def map_parser(map_data):
@@ -1212,23 +1904,27 @@ class MapTool(object):
 
     @staticmethod
     def align_to_extra(eid, extra_map, resource_map):
-        for x in range(len(extra_map)):
-            for y in range(len(extra_map[x])):
-                if resource_map[x][y] is None:
-                    extra_map[x][y] = "0"
-                elif eid in resource_map[x][y]:
-                    extras = resource_map[x][y].split(",")
-                    for extra in extras:
-                        if extra.startswith(eid):
-                            extra_map[x][y] = extra.split("_")[1]
-                else:
-                    extra_map[x][y] = "0"                    
-        return extra_map
+        """
+        Layer eid of the resources of the tiles: the value of the last resource of eid, "0" without one.
+        :parameter extra_map: 2-d layer of the shape of the output, like the packed extras.
+        :parameter resource_map: 2-d list of the resources "e00_1,e03_2" of the tiles or None,
+            or its numpy.ndarray<str> with "" for None.
+        :return: numpy.ndarray<str>, built (y,x).
+        """
+        keys, inverse = np.unique(MapTool._get_resource_array(resource_map), return_inverse=True)
+        values = list()
+        for key in keys.tolist():
+            value = "0"
+            for extra in key.split(","):
+                if extra.startswith(eid):
+                    value = extra.split("_")[1]
+            values.append(value)
+        return np.array(values, dtype=str)[inverse].reshape(np.shape(extra_map))
 
     @staticmethod
     def align_to_map(player_map, total_map):
         """ 
-        Align to the goal map. 
+        Align to the goal map: the tiles known by the player, neither unseen nor "0", take the global values.
         :parameter player_map: 2-d map string, the map of player
         :parameter total_map: 2-d map string, the map of global, like
             t0000="aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
@@ -1249,20 +1945,15 @@ class MapTool(object):
             t0015="p        :::::::::      sfffffgfsdspfdppp      pggfpphpmdhhmmfpphpphmffffhfpfp"
             t0016="gg      :::::           sffffffghddfmmgpg       pggppppmmspppddhfhhdddgsdphgfp"
             t0017="aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
+        :return: numpy.ndarray<str>, built (y,x).
         """
-        for x in range(len(player_map)):
-            for y in range(len(player_map[x])):
-                if  player_map[x][y] != total_map[x][y] and player_map[x][y] not in (UNSEEN_SIGNAL, "0"):
-                    player_map[x][y] = total_map[x][y]
-        return player_map
+        player_map = np.asarray(player_map)
+        return np.where((player_map == UNSEEN_SIGNAL) | (player_map == "0"), player_map, total_map)
 
     @staticmethod
     def align_to_resource(player_map, total_map):
-        for x in range(len(player_map)):
-            for y in range(len(player_map[x])):
-                if  player_map[x][y] != total_map[x][y].split("_")[-1] and player_map[x][y] not in (UNSEEN_SIGNAL, "0"):
-                    player_map[x][y] = total_map[x][y].split("_")[-1]
-        return player_map
+        """ Align to the goal resource layer, of the values like "e00_1". """
+        return MapTool.align_to_map(player_map, MapTool.get_suffixes(total_map))
 
     @staticmethod
     def gen_map(map_data, suffix):
@@ -1317,7 +2008,8 @@ if __name__ == "__main__":
                        terrain_fpt_conf=terrain_fpt_conf,
                        resource_fpt_conf=resource_fpt_conf,
                        terrain_resource_conf=terrain_resource_conf,
-                       extra_resources=extra_resources)
+                       extra_resources=extra_resources,
+                       topology=Topology.from_sav(sav_parser).topology)
     metrics = map_tool.cal_connectivity_layer()
     print(map_tool._layers)
     print(metrics)
@@ -15,8 +15,11 @@
 
 import copy
 import random
-from freeciv_sav.utils.dic_tools import recursive_dict_out
+import numpy as np
 from freeciv_sav.bean.format_type import FormatTypeBean
+from freeciv_sav.bean.parse_type import ParseTypeBean
+from freeciv_sav.parser.table import SavTable
+from freeciv_sav.parser.ruleset import TechTree
 
 TECH_VECTOR = ["A_NONE","Advanced Flight","Alphabet","Amphibious Warfare",
                    "Astronomy","Atomic Theory","Automobile","Banking","Bridge Building",
@@ -40,6 +43,7 @@ class ResearchTool(object):
 
     tech_vector = [tech.lower() for tech in TECH_VECTOR]
     tech_mapping = {tech.lower(): tech for tech in TECH_VECTOR}
+    tech_index = {tech.lower(): i for i, tech in enumerate(TECH_VECTOR)}
     
     def __init__(self, techs_data, techs_conf):
         """
@@ -49,56 +53,51 @@ class ResearchTool(object):
             0,"A_UNSET",1,0,0,"A_UNSET",0,"Horseback Riding",FALSE,FALSE,"1000000000000000000000000000000000000000000000000000000000000000000000000000000000000000"
             1,"A_UNSET",1,0,0,"A_UNSET",0,"Warrior Code",FALSE,FALSE,"1000000000000000000000000000000000000000000000000000000000000000000000000000000000000000"
             }
+            as SavTable or pandas.DataFrame
+        techs_conf: RulesetParser.get_tech_tree(), the TechTree is built from "req" if it has no "tree".
         """
+        techs_data = SavTable.adapt(techs_data)
         self._techs_data = techs_data
         self.__techs_data = copy.deepcopy(techs_data)
         self._techs_conf = techs_conf
+        self._tech_tree = techs_conf["tree"] if "tree" in techs_conf else TechTree(techs_conf["req"])
 
     def reset(self):
         self._techs_data = self.__techs_data
         return
 
     def _get_techs_done(self, done):
-        output = list()
-        for i, d in enumerate(list(done)):
-            if d == "1":
-                output.append(self.tech_vector[i].lower())
-        return output
-    
+        return [self.tech_vector[i] for i in np.flatnonzero(ParseTypeBean.bits_from_strings([done])[0])]
+
+    def get_techs_array(self):
+        """Known techs of all players as a boolean array of shape (players, techs), and the player ids."""
+        players = [FormatTypeBean.player_id_format(number) for number in self._techs_data["number"]]
+        return ParseTypeBean.bits_from_strings(self._techs_data["done"]), players
+
     def get_techs_done(self, count=False):
         techs = dict()
-        for _, row in self._techs_data.iterrows():
-            techs_done = self._get_techs_done(row["done"])
-            techs[FormatTypeBean.player_id_format(row["number"])] = len(techs_done) if count else techs_done
+        techs_array, players = self.get_techs_array()
+        for player_id, bits in zip(players, techs_array):
+            techs_done = [self.tech_vector[i] for i in np.flatnonzero(bits)]
+            techs[player_id] = len(techs_done) if count else techs_done
         return techs
     
     def set_techs_done(self, done, known_techs):
-        output = ""
-        known_ids = [self.tech_vector.index(tech) for tech in known_techs]
-        for i, d in enumerate(list(done)):
-            if i > 0:
-                if i in known_ids:
-                    output += "1"
-                else:
-                    output += "0"
-            else:
-                output += d
-        return output
+        """Set the known techs of a done vector, keeping its first bit of A_NONE."""
+        bits = np.zeros(len(done), dtype=bool)
+        bits[[self.tech_index[tech] for tech in known_techs]] = True
+        return done[:1] + FormatTypeBean.strings_from_bits(bits[1:])[0]
     
     def count_techs(self, done):
-        cnt = 0
-        for i in list(done):
-            if i == "1":
-                cnt += 1
-        return cnt
+        return done.count("1")
     
     def set_techs(self, players_info):
-        for _, row in self._techs_data.iterrows():
+        for i, row in self._techs_data.iterrows():
             player_id = FormatTypeBean.player_id_format(row["number"])
-            self._techs_data.loc[row["number"], "done"] = self.set_techs_done(row["done"], players_info[player_id]["done"])
-            self._techs_data.loc[row["number"], "now_name"] = self.tech_mapping[players_info[player_id]["now_name"]]
-            self._techs_data.loc[row["number"], "techs"] = self.count_techs(self._techs_data.loc[row["number"], "done"])
-            self._techs_data.loc[row["number"], "goal_name"] = "A_UNSET"
+            self._techs_data.at[i, "done"] = self.set_techs_done(row["done"], players_info[player_id]["done"])
+            self._techs_data.at[i, "now_name"] = self.tech_mapping[players_info[player_id]["now_name"]]
+            self._techs_data.at[i, "techs"] = self.count_techs(self._techs_data.at[i, "done"])
+            self._techs_data.at[i, "goal_name"] = "A_UNSET"
         return 
 
     def set_now_name(self, name):
@@ -116,28 +115,31 @@ class ResearchTool(object):
     def get_format(self, format="line"):
         return {"r": FormatTypeBean.line_from_dataframe(self._techs_data, "r=")}
 
+    def get_techs_cost(self):
+        """Bulbs spent on the known techs of each player."""
+        tree = self._tech_tree
+        return {player_id: tree.get_cost(tree.get_mask(techs)) for player_id, techs in self.get_techs_done().items()}
+
+    def get_techs_frontier(self):
+        """Techs each player can research next."""
+        tree = self._tech_tree
+        return {player_id: tree.get_names(tree.get_frontier(tree.get_mask(techs)))
+                for player_id, techs in self.get_techs_done().items()}
+
     def get_full_techs_by_edge(self, edge_techs):
-        output = list()
-        for tech in edge_techs:
-            tmp = list()
-            recursive_dict_out(key=tech, dic=self._techs_conf["req"], output=tmp)
-            output.extend([ele for group in tmp for ele in group])
-        output = list(set(output))
-        return output
+        """
+        All the requirements of the edge techs, recursively, in the order of the tech ids.
+        The edge techs are not included, but A_NONE, which requires nothing.
+        """
+        tree = self._tech_tree
+        edge = tree.get_mask(edge_techs)
+        return tree.get_names(tree.get_closure(edge) | (edge & ~tree.advances))
 
     def get_techs_edge(self, techs):
-        output = list()
-        for tech in techs:
-            flag = 0
-            if tech in self._techs_conf["pro"]:
-                future_techs = self._techs_conf["pro"][tech]
-                for _fut in future_techs:
-                    if _fut in techs:
-                        flag = 1
-                        break
-            if flag == 0:
-                output.append(tech)
-        return output
+        """Techs which are not required by another tech of techs, in their order."""
+        tree = self._tech_tree
+        mask = tree.get_mask(techs)
+        return [tech for tech in techs if tree.pro[tree.index[tech]] & mask == 0]
     
     def call_diff(self, last_techs, current_techs):
         if len(last_techs) == 0:
@@ -149,63 +151,65 @@ class ResearchTool(object):
             return False
         return True
 
-    def random_walk(self, neg_depth=3, pos_depth=3, max_walks=10):
+    def random_walk(self, neg_depth=3, pos_depth=3, max_walks=10, verbose=True):
+        """verbose: print every step of the walks."""
+        log = print if verbose else lambda *args: None
         players_known_techs = self.get_techs_done()
         players_info = dict()
         last_known_techs = []
         for playerid, known_techs in players_known_techs.items():
-            print(f"___________________________ {playerid} ___________________________________")
+            log(f"___________________________ {playerid} ___________________________________")
             players_info[playerid] = dict()
             techs_edge = self.get_techs_edge(known_techs)
             walk = 0
 
             while walk < max_walks:
-                print("known_techs: ", known_techs)
-                print("techs_edge: ", techs_edge)
+                log("known_techs: ", known_techs)
+                log("techs_edge: ", techs_edge)
 
                 rand = random.random()
                 choice_tech = "a_none"
 
                 if rand < 0.7:
                     # pos
-                    print("========= pos ========")
+                    log("========= pos ========")
                     choice_tech = random.choice(techs_edge)
                     depth = random.randint(1, pos_depth)
                     _depth = 0
-                    print("pos ---------> ", choice_tech)
+                    log("pos ---------> ", choice_tech)
                     while _depth < depth:
                         if choice_tech not in self._techs_conf["pro"]:
                             break
                         choice_tech = random.choice(self._techs_conf["pro"][choice_tech])
-                        print("add -------> ", choice_tech)
+                        log("add -------> ", choice_tech)
                         _depth += 1
                 elif rand > 0.7 and rand < 0.9:
                     # neg
-                    print("========= neg ========")
+                    log("========= neg ========")
                     random.shuffle(techs_edge)
                     choice_tech = techs_edge.pop()
                     depth = random.randint(1, neg_depth)
                     _depth = 0
-                    print("neg ---------> ", choice_tech)
+                    log("neg ---------> ", choice_tech)
                     while _depth < depth:
                         if choice_tech not in self._techs_conf["req"]:
                             break
                         choice_tech = random.choice(self._techs_conf["req"][choice_tech])
-                        print("pop -------> ", choice_tech)
+                        log("pop -------> ", choice_tech)
                         _depth += 1
                 # update known_techs
-                print("choice_tech: ", choice_tech)
+                log("choice_tech: ", choice_tech)
                 if choice_tech not in techs_edge:
                     techs_edge.append(choice_tech)
-                print(techs_edge)
+                log(techs_edge)
                 known_techs = self.get_full_techs_by_edge(techs_edge)
                 techs_edge = self.get_techs_edge(known_techs)
                 walk += 1
             
             if self.call_diff(last_known_techs, known_techs):
                 return False
-            print("final known_techs: ", known_techs)
-            print("final techs_edge: ", techs_edge)
+            log("final known_techs: ", known_techs)
+            log("final techs_edge: ", techs_edge)
             players_info[playerid]["done"] = known_techs
             players_info[playerid]["edge"] = techs_edge
             players_info[playerid]["now_name"] = self.find_now_tech(known_techs, techs_edge)
@@ -215,14 +219,11 @@ class ResearchTool(object):
         return True
 
     def find_now_tech(self, known_techs, techs_edge):
+        """The first successor of the edge techs whose requirements are all known."""
+        tree = self._tech_tree
+        known = tree.get_mask(known_techs)
         for tech in techs_edge:
-            pro_techs = self._techs_conf["pro"][tech]
-            for _future_tech in pro_techs:
-                req_techs = self._techs_conf["req"][_future_tech]
-                flag = 1
-                for _req_tech in req_techs:
-                    if _req_tech not in known_techs:
-                        flag = 0
-                if flag:
-                    return _future_tech
+            for _future_tech in tree.iter_ids(tree.pro[tree.index[tech]]):
+                if tree.req[_future_tech] & ~known == 0:
+                    return tree.names[_future_tech]
         return ""
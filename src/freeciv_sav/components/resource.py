@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy as np
+
 # count = 20
 RESOURCE_CLASS = ["gold", "iron", "game", "furs", "coal", "fish", "fruit", "gems", "buffalo", "wheat",
         "oasis", "peat", "pheasant", "bonus", "ivory", "silk", "spice", "whales", "wine",
@@ -67,6 +69,22 @@ RESOURCE_CONF = {
     "oil": {"row": "e08", "value": "2"}, 
 }
 
+# bits of a row eNN in the packed extras of a tile, one hex digit of the sav rows
+EXTRA_LAYER_BITS = 4
+EXTRA_LAYER_MASK = (1 << EXTRA_LAYER_BITS) - 1
+# rows e00, e01... held by the 64 bits of the packed extras
+EXTRA_LAYERS = 64 // EXTRA_LAYER_BITS
+EXTRA_DIGITS = "0123456789abcdef"
+# ascii code -> value of the hex digits, for the uint8 rows of SavParser.get_map_array
+EXTRA_ASCII = np.zeros(256, dtype=np.uint64)
+for _value, _digit in enumerate(EXTRA_DIGITS):
+    EXTRA_ASCII[ord(_digit)] = EXTRA_ASCII[ord(_digit.upper())] = _value
+# name -> bit of the packed extras, bit 4*NN of the value "1" of the row eNN
+EXTRA_BITS = {name: EXTRA_LAYER_BITS * int(conf["row"][1:]) + int(conf["value"], 16).bit_length() - 1
+              for name, conf in RESOURCE_CONF.items()}
+# bits of the resources of RESOURCE_CLASS
+RESOURCE_MASK = sum(1 << bit for name, bit in EXTRA_BITS.items() if name in RESOURCE_CLASS)
+
 OPTIMAL_EXTRA_CONF = {
     "inaccessible":{
 
@@ -173,6 +191,99 @@ class ResourceTool(object):
                 for index, resource in enumerate(row_list):
                     row_list[index] = e_table+"_"+resource
         return raw_data
+
+    @staticmethod
+    def get_extra_bits():
+        """Bits {name: bit} of the extras of RESOURCE_CONF in the packed extras of a tile."""
+        return dict(EXTRA_BITS)
+
+    @staticmethod
+    def get_extra_mask(names:list=None):
+        """Mask of the extras names in the packed extras, the resources of RESOURCE_CLASS by default."""
+        if names is None:
+            return np.uint64(RESOURCE_MASK)
+        return np.uint64(sum(1 << EXTRA_BITS[name] for name in set(names)))
+
+    @staticmethod
+    def pack_extras(layers:dict):
+        """
+        Pack the extras layers into one bitmask per tile.
+        :parameter layers: dict<str, 2-d>, {eid: layer}, the hex digits of the sav rows like "9",
+            their ascii codes from SavParser.get_map_array, or the values like "e03_9" of exchagne_rawdata.
+        :return: numpy.ndarray<uint64>, built (y,x), the bits of EXTRA_BITS.
+        """
+        packed = None
+        for eid, layer in layers.items():
+            if (layer := np.asarray(layer)).dtype == np.uint8:
+                digits = EXTRA_ASCII[layer]
+            else:
+                keys, inverse = np.unique(layer, return_inverse=True)
+                digits = np.array([int(key.split("_")[-1], 16) for key in keys.tolist()], dtype=np.uint64)[inverse].reshape(layer.shape)
+            bits = digits << ResourceTool.get_extra_shift(eid)
+            packed = bits if packed is None else packed | bits
+        return packed
+
+    @staticmethod
+    def get_extra_shift(eid:str):
+        """Shift of the digit of the row eid like "e03" in the packed extras."""
+        return np.uint64(EXTRA_LAYER_BITS * int(eid[1:]))
+
+    @staticmethod
+    def get_extra_digits(packed, eids:list=None):
+        """
+        Digits of the rows of packed extras.
+        :parameter eids: list<str>, the rows, the ones holding any extra by default.
+        :return: dict<str, numpy.ndarray<intp>>, {eid: digits} built (y,x).
+        """
+        packed = np.asarray(packed, dtype=np.uint64)
+        mask = np.uint64(EXTRA_LAYER_MASK)
+        if eids is None:
+            eids = [f"e{layer:02d}" for layer in range(EXTRA_LAYERS)
+                    if ((packed >> np.uint64(EXTRA_LAYER_BITS * layer)) & mask).any()]
+        return {eid: ((packed >> ResourceTool.get_extra_shift(eid)) & mask).astype(np.intp) for eid in eids}
+
+    @staticmethod
+    def get_extra_values(extras:int):
+        """Values like "e03_9" of the rows holding extras of a tile in its packed extras."""
+        extras = int(extras)
+        digits = [(layer, extras >> (EXTRA_LAYER_BITS * layer) & EXTRA_LAYER_MASK) for layer in range(EXTRA_LAYERS)]
+        return [f"e{layer:02d}_{EXTRA_DIGITS[digit]}" for layer, digit in digits if digit > 0]
+
+    @staticmethod
+    def set_extra(packed, index, value:str):
+        """Set the row of a value like "e03_9" of the packed extras at index to its digit, "e03_0" clears the row."""
+        eid, digit = value.split("_")
+        shift = ResourceTool.get_extra_shift(eid)
+        packed[index] = (packed[index] & ~(np.uint64(EXTRA_LAYER_MASK) << shift)) | (np.uint64(int(digit, 16)) << shift)
+        return
+
+    @staticmethod
+    def unpack_extras(packed, eids:list, prefix:bool=False):
+        """
+        Layers of packed extras, the reverse of pack_extras.
+        :parameter prefix: bool, the values like "e03_9" of exchagne_rawdata instead of the hex digits.
+        :return: dict<str, numpy.ndarray<str>>, {eid: layer} built (y,x).
+        """
+        layers = dict()
+        for eid, digits in ResourceTool.get_extra_digits(packed, eids).items():
+            layers[eid] = np.array([eid+"_"+digit if prefix else digit for digit in EXTRA_DIGITS], dtype=str)[digits]
+        return layers
+
+    @staticmethod
+    def has_extras(packed, names:list=None, every:bool=False):
+        """
+        numpy.ndarray<bool> of the tiles with any of the extras names, or all of them if every,
+        the resources of RESOURCE_CLASS by default.
+        """
+        mask = ResourceTool.get_extra_mask(names)
+        if every:
+            return (packed & mask) == mask
+        return (packed & mask) != 0
+
+    @staticmethod
+    def get_extra_names(extras:int):
+        """Names of the extras of a tile in its packed extras."""
+        return [name for name, bit in EXTRA_BITS.items() if int(extras) >> bit & 1]
     
 if __name__ == "__main__":
     obj = ResourceTool()
@@ -0,0 +1,203 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import functools
+import numpy as np
+
+# topology of the maps, the server default when the sav does not give it
+DEFAULT_TOPOLOGY = "WRAPX"
+# radius_sq of the city work area and vision, RulesetParser.get_city_radius_sq of classic
+CITY_RADIUS_SQ = 5
+# footprint tables kept per process, by (xsize, ysize, topology, radius_sq, depth)
+FOOTPRINT_CACHE_SIZE = 64
+
+
+class Topology(object):
+    """
+    Coordinates of a map of xsize*ysize tiles with the wrap rules of its topology.
+
+    Footprints are the tiles [dy, dx] within a radius_sq of a center, like the city
+    work area or the vision of a unit. Their offsets are built once per radius_sq,
+    and their wrapped (ysize, xsize, n) index tables once per (topology, radius_sq),
+    so the scopes of any set of centers are gathered from them.
+    A wrapped axis takes the coordinates modulo its size, and the other axis drops
+    the tiles out of the map.
+    :attribute topology: str, the flags like "WRAPX" or "WRAPX|ISO", "" for a flat map.
+    :attribute wrapx, wrapy: bool, the wrapped axes.
+    """
+
+    def __init__(self, xsize:int, ysize:int, topology:str=None):
+        self.xsize = xsize
+        self.ysize = ysize
+        self.topology = DEFAULT_TOPOLOGY if topology is None else topology
+        flags = self.topology.split("|")
+        self.wrapx = "WRAPX" in flags
+        self.wrapy = "WRAPY" in flags
+        # (radius_sq, depth) -> footprints of the tiles, as lists of (y, x)
+        self._locations = dict()
+
+    def __repr__(self):
+        return f"Topology({self.xsize}, {self.ysize}, {self.topology!r})"
+
+    @staticmethod
+    @functools.lru_cache(maxsize=FOOTPRINT_CACHE_SIZE)
+    def get(xsize:int, ysize:int, topology:str=None):
+        """Shared Topology of a map, which keeps the footprint tables of all its users."""
+        return Topology(xsize, ysize, topology)
+
+    @staticmethod
+    def from_sav(sav_parser):
+        """Topology of the map of a sav, sized by its terrain rows."""
+        ysize, xsize = sav_parser.get_map_array("t").shape
+        topology = sav_parser.get_topology()
+        # the newer servers save the wrap flags apart
+        if isinstance(wrap := sav_parser.get_setting("wrap"), str) and wrap != "":
+            topology = "|".join(flag for flag in [topology, wrap] if flag)
+        return Topology.get(int(xsize), int(ysize), topology)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=FOOTPRINT_CACHE_SIZE)
+    def _get_offsets(radius_sq:int, depth:int):
+        span = np.arange(-depth, depth+1)
+        dy, dx = np.meshgrid(span, span, indexing="ij")
+        inside = dy**2 + dx**2 <= radius_sq
+        offsets = np.stack([dy[inside], dx[inside]], axis=1).astype(np.int64)
+        offsets.flags.writeable = False
+        return offsets
+
+    @staticmethod
+    def get_offsets(radius_sq:int, depth:int=None):
+        """
+        Offsets [dy, dx] of the tiles within radius_sq of a center, by dy then dx.
+        :parameter depth: bound of |dy| and |dx|, isqrt(radius_sq) by default.
+        :return: numpy.ndarray<int64>, (n, 2), read-only.
+        """
+        radius_sq = int(radius_sq)
+        return Topology._get_offsets(radius_sq, math.isqrt(radius_sq) if depth is None else int(depth))
+
+    @staticmethod
+    def get_square_offsets(depth:int):
+        """Offsets [dy, dx] of the square of |dy|, |dx| <= depth, by dy then dx."""
+        return Topology.get_offsets(2*depth**2, depth)
+
+    def wrap(self, ys, xs):
+        """
+        Coordinates ys, xs brought into the map by its wrap rules.
+        :return: ys, xs, valid, numpy arrays where valid marks the tiles in the map.
+        """
+        ys, xs = np.asarray(ys, dtype=np.int64), np.asarray(xs, dtype=np.int64)
+        valid = np.ones(np.broadcast(ys, xs).shape, dtype=bool)
+        if self.wrapy:
+            ys = ys % self.ysize
+        else:
+            valid &= (ys >= 0) & (ys < self.ysize)
+        if self.wrapx:
+            xs = xs % self.xsize
+        else:
+            valid &= (xs >= 0) & (xs < self.xsize)
+        return ys, xs, valid
+
+    def get_table(self, radius_sq:int, depth:int=None):
+        """
+        Wrapped footprints of all the tiles as centers.
+        :return: rows, cols, valid, numpy arrays of (ysize, xsize, n), read-only.
+        """
+        return Topology._get_table(self.xsize, self.ysize, self.topology, int(radius_sq), depth)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=FOOTPRINT_CACHE_SIZE)
+    def _get_table(xsize:int, ysize:int, topology:str, radius_sq:int, depth:int):
+        topo = Topology.get(xsize, ysize, topology)
+        offsets = Topology.get_offsets(radius_sq, depth)
+        ys, xs = np.indices((ysize, xsize))
+        table = topo.wrap(ys[..., None] + offsets[:, 0], xs[..., None] + offsets[:, 1])
+        for array in table:
+            array.flags.writeable = False
+        return table
+
+    def get_scope(self, xs, ys, radius_sq:int, depth:int=None):
+        """
+        Footprints of the centers xs, ys, which are in the map.
+        :return: rows, cols, valid, numpy arrays of (*centers, n); the rows and cols
+            of the tiles dropped by the topology are left out of the map.
+        """
+        rows, cols, valid = self.get_table(radius_sq, depth)
+        ys, xs = np.asarray(ys, dtype=np.int64), np.asarray(xs, dtype=np.int64)
+        return rows[ys, xs], cols[ys, xs], valid[ys, xs]
+
+    def get_locations(self, x:int, y:int, radius_sq:int, depth:int=None):
+        """Footprint of a center as a list of [y, x], without the tiles dropped by the topology."""
+        if 0 <= x < self.xsize and 0 <= y < self.ysize:
+            return [[_y, _x] for _y, _x in self._get_locations(int(radius_sq), depth)[y][x]]
+        offsets = Topology.get_offsets(radius_sq, depth)
+        rows, cols, valid = self.wrap(y + offsets[:, 0], x + offsets[:, 1])
+        return np.stack([rows[valid], cols[valid]], axis=1).tolist()
+
+    def _get_locations(self, radius_sq:int, depth:int):
+        # the footprints of the tiles as tuples, built once from the table for the calls one center at a time
+        key = (radius_sq, depth)
+        if (locations := self._locations.get(key)) is None:
+            rows, cols, valid = self.get_table(radius_sq, depth)
+            locations = [[tuple(zip(rows[y, x][valid[y, x]].tolist(), cols[y, x][valid[y, x]].tolist()))
+                          for x in range(self.xsize)] for y in range(self.ysize)]
+            self._locations[key] = locations
+        return locations
+
+    def get_mask(self, xs, ys, radius_sq:int, depth:int=None):
+        """numpy.ndarray<bool> of (ysize, xsize), the tiles in the footprints of the centers."""
+        mask = np.zeros((self.ysize, self.xsize), dtype=bool)
+        offsets = Topology.get_offsets(radius_sq, depth)
+        ys, xs = np.asarray(ys, dtype=np.int64).reshape(-1), np.asarray(xs, dtype=np.int64).reshape(-1)
+        rows, cols, valid = self.wrap(ys[:, None] + offsets[:, 0], xs[:, None] + offsets[:, 1])
+        mask[rows[valid], cols[valid]] = True
+        return mask
+
+    def get_window_sums(self, grid, radius:int):
+        """
+        Sums of a (ysize, xsize) grid over the windows of |dy|, |dx| <= radius around every tile,
+        by summed-area tables wrapped like the map; a window wider than a wrapped axis takes it once.
+        """
+        sums = np.asarray(grid)
+        for axis, wrap in [(0, self.wrapy), (1, self.wrapx)]:
+            sums = Topology._box_sum(sums, radius, axis, wrap)
+        return sums
+
+    @staticmethod
+    def _box_sum(grid, radius:int, axis:int, wrap:bool):
+        size = grid.shape[axis]
+        if wrap and 2*radius+1 >= size:
+            return np.repeat(grid.sum(axis=axis, keepdims=True), size, axis=axis)
+        pad = [(0, 0)] * grid.ndim
+        pad[axis] = (radius, radius)
+        padded = np.pad(grid, pad, mode="wrap" if wrap else "constant")
+        # the table starts with the empty sum
+        table = np.cumsum(padded, axis=axis)
+        table = np.concatenate([np.zeros_like(table.take([0], axis=axis)), table], axis=axis)
+        window = 2*radius+1
+        return table.take(np.arange(window, window+size), axis=axis) - table.take(np.arange(size), axis=axis)
+
+    def get_distances(self, xs1, ys1, xs2, ys2):
+        """
+        Distances along x and y between the tiles, the shorter way round the wrapped axes.
+        :return: xdist, ydist, numpy arrays broadcast from the inputs.
+        """
+        xdist = np.abs(np.asarray(xs1, dtype=np.int64) - np.asarray(xs2, dtype=np.int64))
+        ydist = np.abs(np.asarray(ys1, dtype=np.int64) - np.asarray(ys2, dtype=np.int64))
+        if self.wrapx:
+            xdist = np.minimum(xdist, self.xsize - xdist % self.xsize)
+        if self.wrapy:
+            ydist = np.minimum(ydist, self.ysize - ydist % self.ysize)
+        return xdist, ydist
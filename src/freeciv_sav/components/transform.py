@@ -0,0 +1,108 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import functools
+import numpy as np
+from freeciv_sav.components.topology import Topology
+
+# axes of the mirrors
+MIRROR_AXES = [None, "x", "y"]
+# permutation indexes kept per process
+TRANSFORM_CACHE_SIZE = 32
+
+
+class MapTransform(object):
+    """
+    Exact transform of the tiles of a map: a mirror, then quarter turns about the center,
+    then a translation along the wrapped axes. It is a permutation of the tiles, so all
+    the layers of a map are moved by one gather of the same index, and the units and
+    cities by the same mapping of their coordinates.
+    :attribute rotation: int, the quarter turns, (x, y) -> (xsize-1-y, x) each.
+    :attribute mirror: str, None, "x" for x -> xsize-1-x or "y" for y -> ysize-1-y.
+    :attribute shift: (dx, dy), along the wrapped axes only.
+    :attribute index: numpy.ndarray<int64>, (ysize, xsize), the flat index of the source of every tile.
+    """
+
+    def __init__(self, xsize:int, ysize:int, rotation:int=0, mirror:str=None, shift:tuple=(0, 0), topology:str=None):
+        self.xsize = xsize
+        self.ysize = ysize
+        self.rotation = int(rotation) % 4
+        self.mirror = mirror
+        self.shift = (int(shift[0]), int(shift[1]))
+        self.topology = Topology.get(xsize, ysize, topology)
+        if self.rotation % 2 == 1 and xsize != ysize:
+            raise ValueError(f"A quarter turn does not keep the size of a {xsize}x{ysize} map!")
+        if mirror not in MIRROR_AXES:
+            raise ValueError(f"Please note that the mirror only supported {MIRROR_AXES}, but you use {mirror}!")
+        if (self.shift[0] != 0 and not self.topology.wrapx) or (self.shift[1] != 0 and not self.topology.wrapy):
+            raise ValueError(f"The map of topology {self.topology.topology!r} can not be shifted by {self.shift}!")
+        self.index = MapTransform._get_index(xsize, ysize, self.rotation, mirror, self.shift)
+
+    def __repr__(self):
+        return f"MapTransform({self.xsize}, {self.ysize}, rotation={self.rotation}, mirror={self.mirror!r}, shift={self.shift})"
+
+    @staticmethod
+    def get_quarter_turns(rotation_angle:float):
+        """Quarter turns of an angle in radians, which is a multiple of pi/2."""
+        turns = round(rotation_angle / (math.pi / 2))
+        if not math.isclose(turns * math.pi / 2, rotation_angle, abs_tol=1e-6):
+            raise ValueError(f"Only the multiples of pi/2 are exact rotations of the tiles, but you use {rotation_angle}!")
+        return turns % 4
+
+    @staticmethod
+    def _move(xs, ys, xsize:int, ysize:int, rotation:int, mirror:str, shift:tuple):
+        if mirror == "x":
+            xs = xsize - 1 - xs
+        elif mirror == "y":
+            ys = ysize - 1 - ys
+        if rotation >= 2:
+            xs, ys = xsize - 1 - xs, ysize - 1 - ys
+        if rotation % 2 == 1:
+            xs, ys = xsize - 1 - ys, xs
+        return (xs + shift[0]) % xsize, (ys + shift[1]) % ysize
+
+    @staticmethod
+    @functools.lru_cache(maxsize=TRANSFORM_CACHE_SIZE)
+    def _get_index(xsize:int, ysize:int, rotation:int, mirror:str, shift:tuple):
+        ys, xs = np.indices((ysize, xsize))
+        _xs, _ys = MapTransform._move(xs, ys, xsize, ysize, rotation, mirror, shift)
+        index = np.empty(ysize * xsize, dtype=np.int64)
+        index[_ys.reshape(-1) * xsize + _xs.reshape(-1)] = np.arange(ysize * xsize)
+        index = index.reshape(ysize, xsize)
+        index.flags.writeable = False
+        return index
+
+    def move(self, xs, ys):
+        """Coordinates of the tiles xs, ys after the transform, as numpy arrays."""
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        return MapTransform._move(xs, ys, self.xsize, self.ysize, self.rotation, self.mirror, self.shift)
+
+    def apply(self, layer):
+        """Layer (ysize, xsize), a numpy array or list<list>, after the transform, as a numpy array."""
+        layer = np.asarray(layer)
+        return layer.reshape((-1,) + layer.shape[2:])[self.index]
+
+    def apply_rows(self, layer:list):
+        """
+        list<list> layer moved in place, so that its users see the transform.
+        The values after xsize in a row, like the empty field of the trailing comma of `worked`, stay.
+        """
+        if any(len(row) != self.xsize for row in layer):
+            moved = self.apply([row[:self.xsize] for row in layer]).tolist()
+            layer[:] = [_row + row[self.xsize:] for _row, row in zip(moved, layer)]
+        else:
+            layer[:] = self.apply(layer).tolist()
+        return layer
@@ -16,128 +16,39 @@
 import numpy as np
 import random
 import copy
+import math
+import functools
+from freeciv_sav.parser.table import SavTable
+from freeciv_sav.parser.ruleset import RulesetParser, CLASSIC_RULESET_DIR
+from freeciv_sav.components.topology import Topology
+from freeciv_sav.components.transform import MapTransform
 
 OCEAN_SIGNAL_LIST = [" ", ":", "a"]
 
 UNIT_SCOPE_DEPTH = {2: 2, 8: 3}
+# columns of the tiles of a unit
+UNIT_TILE_COLUMNS = [("x", "y"), ("goto_x", "goto_y"), ("action_decision_tile_x", "action_decision_tile_y")]
+
+
+@functools.lru_cache(maxsize=None)
+def get_classic_unit_types():
+    """UnitTypeTable of the classic ruleset, for the tools built without a ruleset."""
+    return RulesetParser(CLASSIC_RULESET_DIR).get_unit_types()
 
-UNIT_COMBAT_STATIS = {
-    "warriors":[1,1,10],
-    "phalanx":[1,2,10],
-    "archers":[3,2,10],
-    "legion":[4,2,10],
-    "pikemen":[1,2,10],
-    "musketeers":[3,3,20],
-    "partisan":[4,4,20],
-    "alpine troops":[5,5,20],
-    "riflemen":[5,4,20],
-    "marines":[8,5,20],
-    "paratroopers":[6,4,20],
-    "mech. inf.":[6,6,30],
-    "horsemen":[2,1,10],
-    "chariot":[3,1,10],
-    "knights":[4,2,10],
-    "dragoons":[5,2,20],
-    "cavalry":[8,3,20],
-    "armor":[10,5,30],
-    "catapult":[6,1,10],
-    "cannon":[8,1,20],
-    "artillery":[10,1,20],
-    "howitzer":[12,2,30],
-    "fighter":[4,3,20],
-    "bomber":[12,1,20],
-    "helicopter":[10,3,20],
-    "stealth fighter":[8,4,20],
-    "stealth bomber":[18,5,20],
-    "trireme":[1,1,10],
-    "caravel":[2,1,10],
-    "galleon":[0,2,20],
-    "frigate":[4,2,20],
-    "ironclad":[4,4,30],
-    "destroyer":[4,4,30],
-    "cruiser":[6,6,30],
-    "aegis cruiser":[8,8,30],
-    "battleship":[12,12,40],
-    "submarine":[12,2,30],
-    "carrier":[1,9,40],
-    "transport":[0,3,30],
-    "cruise missile":[18,0,10],
-    "nuclear":[99,0,10],
-    "diplomat":[0,0,10],
-    "spy":[0,0,10],
-    "caravan":[0,1,10],
-    "freight":[0,1,10],
-    "explorer":[0,1,10],
-    "leader":[0,2,20],
-    "barbarian leader":[0,0,10],
-    "awacs":[0,1,20],
-}
-
-
-VISUAL_RANGE = {
-    "settlers":2,
-    "workers":2,
-    "engineers":2,
-    "warriors":2,
-    "phalanx":2,
-    "archers":2,
-    "legion":2,
-    "pikemen":2,
-    "musketeers":2,
-    "partisan":2,
-    "alpine troops":2,
-    "riflemen":2,
-    "marines":2,
-    "paratroopers":2,
-    "mech. inf.":2,
-    "horsemen":2,
-    "chariot":2,
-    "knights":2,
-    "dragoons":2,
-    "cavalry":2,
-    "armor":2,
-    "catapult":2,
-    "cannon":2,
-    "artillery":2,
-    "howitzer":2,
-    "fighter":8,
-    "bomber":8,
-    "helicopter":8,
-    "stealth fighter":8,
-    "stealth bomber":8,
-    "trireme":2,
-    "caravel":2,
-    "galleon":2,
-    "frigate":2,
-    "ironclad":2,
-    "destroyer":8,
-    "cruiser":8,
-    "aegis cruiser":8,
-    "battleship":8,
-    "submarine":8,
-    "carrier":8,
-    "transport":8,
-    "cruise missile":2,
-    "nuclear":2,
-    "diplomat":2,
-    "spy":8,
-    "caravan":2,
-    "freight":2,
-    "explorer":2,
-    "leader":8,
-    "barbarian leader":2,
-    "awacs":26
-}
-
-OCEAN_UNITS = ["aegis cruiser", "trireme", "caravel", "galleon", "frigate", "ironclad", "transport", 
-               "destroyer", "cruiser", "battleship", "submarine", "carrier"]
 
 class UnitTool(object):
 
-    def __init__(self, raw_data, unit_obsolete_conf):
+    def __init__(self, raw_data, unit_obsolete_conf, unit_types=None):
+        """
+        raw_data: {player_id: {"u": SavTable or pandas.DataFrame}}
+        unit_types: UnitTypeTable, RulesetParser.get_unit_types(), of the classic ruleset by default.
+        """
+        raw_data = {player_id: {key: SavTable.adapt(table) for key, table in tables.items()}
+                    for player_id, tables in raw_data.items()}
         self._raw_data = copy.deepcopy(raw_data)
         self._data = raw_data
         self.unit_obsolete_conf = unit_obsolete_conf
+        self.unit_types = get_classic_unit_types() if unit_types is None else unit_types
 
     def remove_unit(self, keep_unit_id:int):
         return
@@ -148,9 +59,8 @@ class UnitTool(object):
     def get_max_id(self):
         max_id = -1
         for player_id in self._raw_data:
-            u_df = self._raw_data[player_id]["u"]
-            for _, row in u_df.iterrows():
-                max_id = max(max_id, row['id'])
+            for unit_id in self._raw_data[player_id]["u"]["id"]:
+                max_id = max(max_id, unit_id)
         return max_id
 
     def get_unit_number(self):
@@ -162,14 +72,14 @@ class UnitTool(object):
     def set_unit_type(self, max_walks_rate=0.5, rate=0.1):
         for player_id in self._raw_data:
             u_df = self._raw_data[player_id]["u"]
-            indics = list(u_df[u_df['type_by_name'] != 'Leader'].index)
+            indics = [i for i, type_name in enumerate(u_df["type_by_name"]) if type_name != 'Leader']
             max_walks = int(len(indics)*max_walks_rate)
             walk = 0
             while walk < max_walks:
                 index = random.choice(indics)
                 if random.random() < rate:
-                    print("change---->", index, u_df.loc[index, "type_by_name"])
-                    choice_type = u_df.loc[index, "type_by_name"].lower()
+                    print("change---->", index, u_df.at[index, "type_by_name"])
+                    choice_type = u_df.at[index, "type_by_name"].lower()
                     new_type = "none"
                     if random.random() < 0.5:
                         if choice_type in self.unit_obsolete_conf["pro"]:
@@ -178,7 +88,7 @@ class UnitTool(object):
                         if choice_type in self.unit_obsolete_conf["req"]:
                             new_type = random.choice(self.unit_obsolete_conf["req"][choice_type.lower()])
                     if new_type != "none":
-                        u_df.loc[index, "type_by_name"] = new_type
+                        u_df.at[index, "type_by_name"] = new_type
                 walk += 1
         return
 
@@ -189,8 +99,10 @@ class UnitTool(object):
             print('-------------- start -------------------', player_id)
 
             u_df = self._raw_data[player_id]["u"]
-            records = u_df[u_df['type_by_name'] != 'Leader'].to_dict(orient='record')
-            indexes = list(u_df[u_df['type_by_name'] != 'Leader'].index)
+            rows = u_df.to_dict(orient='records')
+            indexes = [i for i, row in enumerate(rows) if row['type_by_name'] != 'Leader']
+            records = [rows[i] for i in indexes]
+            dropped = list()
 
             cnt = u_df.shape[0]
             # find bound
@@ -217,16 +129,14 @@ class UnitTool(object):
                     _record = random.choice(records)
                     max_id = max_id + 1
                     _record['id'] = max_id
-                    u_df = u_df.append([_record])
+                    u_df.add_row(_record)
                 elif rand_cnt < cnt:
                     # pop id
                     random.shuffle(indexes)
-                    _index = indexes.pop()
-                    u_df = u_df.drop(_index)
-                cnt = u_df.shape[0]
+                    dropped.append(indexes.pop())
+                cnt = u_df.shape[0] - len(dropped)
             print('-------------- finished -------------------')
-            u_df.reset_index(inplace=True)
-            del u_df['index']
+            u_df.drop_rows(dropped)
             self._raw_data[player_id]["u"] = u_df
 
         return
@@ -237,25 +147,32 @@ class UnitTool(object):
             u_df = self._raw_data[player_id]["u"]
             for i, _ in u_df.iterrows():
                 x, y = random.choice(map_locations)
-                u_df.loc[i, "x"] = x
-                u_df.loc[i, "y"] = y
+                u_df.at[i, "x"] = x
+                u_df.at[i, "y"] = y
             self._raw_data[player_id]["u"] = u_df
         return self._raw_data
 
     def rotation_location(self, rotation_angle, xsize, ysize):
-        center_x = int(xsize/2) - 1
-        center_y = int(ysize/2) - 1
+        """Rotate the units by a multiple of pi/2, like MapTool.gen_rotation_shift_map."""
+        self.transform_location(MapTransform(xsize, ysize, MapTransform.get_quarter_turns(rotation_angle)))
+        return 
+
+    def transform_location(self, map_transform):
+        """Move the units, and the tiles of their goto and action decision, by the MapTransform of their map."""
         for player_id in self._raw_data:
+            if "u" not in self._raw_data[player_id]:
+                continue
             u_df = self._raw_data[player_id]["u"]
-            for i, _ in u_df.iterrows():
-                x = u_df.loc[i, "x"]
-                y = u_df.loc[i, "y"]
-                _x = round(float(x-center_x) * np.cos(rotation_angle) - float(y-center_y) * np.sin(rotation_angle) + center_x) % xsize
-                _y = round(float(x-center_x) * np.sin(rotation_angle) + float(y-center_y) * np.cos(rotation_angle) + center_y)
-                u_df.loc[i, "x"] = _x
-                u_df.loc[i, "y"] = _y
+            for x_col, y_col in UNIT_TILE_COLUMNS:
+                if x_col not in u_df.columns or y_col not in u_df.columns:
+                    continue
+                xs, ys = np.array(u_df[x_col], dtype=np.int64), np.array(u_df[y_col], dtype=np.int64)
+                # -1 for no tile
+                valid = (xs >= 0) & (ys >= 0)
+                xs[valid], ys[valid] = map_transform.move(xs[valid], ys[valid])
+                u_df[x_col], u_df[y_col] = xs.tolist(), ys.tolist()
             self._raw_data[player_id]["u"] = u_df
-        return 
+        return
 
     def reset(self):
         self._raw_data = copy.deepcopy(self._data)
@@ -286,25 +203,26 @@ class UnitTool(object):
             if "land" in clusters[index]:
                 land_cluster = clusters[index]["land"]
                 ocean_cluster = clusters[index]["ocean"]
+                ocean = self.unit_types.ocean[self.get_type_codes(player_id)]
                 for i, _ in u_df.iterrows():
-                    a = u_df.loc[i, "type_by_name"].lower()
-                    if u_df.loc[i, "type_by_name"].lower() in OCEAN_UNITS:
+                    a = u_df.at[i, "type_by_name"].lower()
+                    if ocean[i]:
                         x, y = ocean_cluster[random.randrange(len(ocean_cluster))]
                         print(f"insert to ocean {x}, {y}, {a}")
                     else:
                         x, y = land_cluster[random.randrange(len(land_cluster))]
                         print(f"insert to land {x}, {y}, {a}")
 
-                    u_df.loc[i, "x"] = x
-                    u_df.loc[i, "y"] = y
+                    u_df.at[i, "x"] = x
+                    u_df.at[i, "y"] = y
             else:
                 cluster = clusters[index]["candidate"]
                 for i, _ in u_df.iterrows():
                     x, y = cluster[random.randrange(len(cluster))]
-                    a = u_df.loc[i, "type_by_name"].lower()
+                    a = u_df.at[i, "type_by_name"].lower()
                     print(f"insert to candidate {x}, {y}, {a}")
-                    u_df.loc[i, "x"] = x
-                    u_df.loc[i, "y"] = y
+                    u_df.at[i, "x"] = x
+                    u_df.at[i, "y"] = y
             self._raw_data[player_id]["u"] = u_df
         return clusters
     
@@ -318,8 +236,10 @@ class UnitTool(object):
                 continue
             u_df = self._raw_data[player_id]["u"]
             output[player_id] = dict()
+            vision = self.unit_types.vision_radius_sq[self.get_type_codes(player_id)]
             for i in range(u_df.shape[0]):
-                output[player_id].update({u_df.iloc[i]["id"]: {"location": [u_df.iloc[i]["x"], u_df.iloc[i]["y"]], "name": u_df.iloc[i]["type_by_name"]}})
+                output[player_id].update({u_df.at[i, "id"]: {"location": [u_df.at[i, "x"], u_df.at[i, "y"]], "name": u_df.at[i, "type_by_name"],
+                                                             "vision_radius_sq": int(vision[i])}})
         return output
 
     def get_unit_cnt(self):
@@ -336,10 +256,7 @@ class UnitTool(object):
         for player_id in self._raw_data:
             output[player_id] = 0
             if "u" in self._raw_data[player_id]:
-                u_df = self._raw_data[player_id]["u"]
-                for i in range(u_df.shape[0]):
-                    if u_df.iloc[i]["type_by_name"].lower() in UNIT_COMBAT_STATIS:
-                        output[player_id] += 1
+                output[player_id] = int(np.count_nonzero(self.unit_types.combat[self.get_type_codes(player_id)]))
         return output
 
     def get_unit_cluster_cnt(self):
@@ -348,14 +265,44 @@ class UnitTool(object):
             land_cnt = 0
             ocean_cnt = 0
             if "u" in self._raw_data[player_id]:
-                for _, row in self._raw_data[player_id]["u"].iterrows():
-                    if row["type_by_name"].lower() in OCEAN_UNITS:
-                        ocean_cnt += 1
-                    else:
-                        land_cnt += 1
+                codes = self.get_type_codes(player_id)
+                ocean_cnt = int(np.count_nonzero(self.unit_types.ocean[codes]))
+                land_cnt = len(codes) - ocean_cnt
             output[player_id] = {"land": land_cnt, "ocean": ocean_cnt}
         return output
 
+    def get_type_codes(self, player_id):
+        """Unit type codes of the units of player_id, in the row order."""
+        if "u" not in self._raw_data[player_id]:
+            return np.zeros(0, dtype=np.int32)
+        return self.unit_types.get_codes(self._raw_data[player_id]["u"]["type_by_name"])
+
+    def get_unit_arrays(self):
+        """
+        Columns of the units of all players, as numpy arrays of one row per unit:
+        player, id, x, y, type, vision_radius_sq, attack, defense (strengths) and ocean.
+        """
+        players, ids, xs, ys, codes = list(), list(), list(), list(), list()
+        for player_id in self._raw_data:
+            if "u" not in self._raw_data[player_id]:
+                continue
+            u_df = self._raw_data[player_id]["u"]
+            players.extend([player_id] * u_df.shape[0])
+            ids.extend(u_df["id"])
+            xs.extend(u_df["x"])
+            ys.extend(u_df["y"])
+            codes.append(self.get_type_codes(player_id))
+        codes = np.concatenate(codes) if len(codes) > 0 else np.zeros(0, dtype=np.int32)
+        return {"player": np.array(players, dtype=object),
+                "id": np.array(ids, dtype=np.int64),
+                "x": np.array(xs, dtype=np.int64),
+                "y": np.array(ys, dtype=np.int64),
+                "type": codes,
+                "vision_radius_sq": self.unit_types.vision_radius_sq[codes],
+                "attack": self.unit_types.get_strength(codes),
+                "defense": self.unit_types.get_strength(codes, defense=True),
+                "ocean": self.unit_types.ocean[codes]}
+
     def _get_player_has_unit_cnt(self):
         cnt = 0
         for player_id in self._raw_data:
@@ -364,21 +311,33 @@ class UnitTool(object):
         return cnt
 
     @staticmethod
-    def cal_unit_scope(unit_name, x, y, xsize=None, ysize=None):
-        visual_range = VISUAL_RANGE[unit_name.lower()]
-        depth = UNIT_SCOPE_DEPTH[visual_range]
-        vision_list = [(-depth+j, -depth+i) for j in range(depth * 2 + 1) for i in range(depth * 2 + 1) 
-                       if abs(-depth+j)+abs(-depth+i) != 2*depth]
-        location_list = []
-        for _, vision in enumerate(vision_list):
-            _y = y+vision[0]
-            _x = x+vision[1]
-            if xsize is not None and ysize is not None:
-                _y = _y % ysize
-                _x = _x % xsize
-            location_list.append([_y, _x])
-        return location_list
+    def get_vision_radius_sq(unit_name:str):
+        """vision_radius_sq of a unit type in the classic ruleset."""
+        unit_types = get_classic_unit_types()
+        return int(unit_types.vision_radius_sq[unit_types.index[unit_name.lower()]])
+
+    @staticmethod
+    def get_scope_radius(vision_radius_sq:int):
+        """
+        radius_sq and depth of the footprint revealed around a unit of vision_radius_sq,
+        which keeps a margin of a tile: the square of UNIT_SCOPE_DEPTH without its corners.
+        """
+        depth = UNIT_SCOPE_DEPTH.get(vision_radius_sq, math.isqrt(vision_radius_sq) + 1)
+        return depth**2 + (depth-1)**2, depth
+
+    @staticmethod
+    def cal_unit_scope(unit_name, x, y, xsize=None, ysize=None, vision_radius_sq=None, topology:str=None):
+        """
+        vision_radius_sq: of the unit type, looked up in the classic ruleset by default.
+        topology: wrap rules of the map when the sizes are given, DEFAULT_TOPOLOGY by default.
+        """
+        if vision_radius_sq is None:
+            vision_radius_sq = UnitTool.get_vision_radius_sq(unit_name)
+        radius_sq, depth = UnitTool.get_scope_radius(vision_radius_sq)
+        if xsize is None or ysize is None:
+            return (Topology.get_offsets(radius_sq, depth) + [y, x]).tolist()
+        return Topology.get(xsize, ysize, topology).get_locations(x, y, radius_sq, depth)
     
     @staticmethod
     def cal_unit_max_scope(x, y, max_turns=10):
-        return [[-max_turns+j+y, -max_turns+i+x] for j in range(2*max_turns+1) for i in range(2*max_turns+1)]
+        return (Topology.get_square_offsets(max_turns) + [y, x]).tolist()
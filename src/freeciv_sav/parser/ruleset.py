@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import re
+import math
 import glob
-from freeciv_sav.utils.dic_tools import recursive_dict, search_dict 
+import functools
+import numpy as np
 from freeciv_sav.utils.type import TypeEnum, reg_type
 
 IGNORE_SUFFIX = ";"
@@ -25,6 +28,52 @@ HASH_PATTERN = r"#\ ([a-zA-Z,\ ]+).*$"
 QUO_STR_PATTERN = r"^\"([a-zA-Z0-9_\ ]+)\"$"
 NAME_PATTERN = r"_\(\"([a-zA-Z0-9_\.\ \']+)\"\)"
 NAME2_PATTERN = r"_\(\"\?.*\:([a-zA-Z0-9_\.\ ]+)\"\)"
+# precompiled patterns
+QUO_STR_REGEX = re.compile(QUO_STR_PATTERN)
+TAG_REGEX = re.compile(TAG_PATTERN)
+NAME_REGEX = re.compile(NAME_PATTERN)
+NAME2_REGEX = re.compile(NAME2_PATTERN)
+KV_REGEX = re.compile(KV_PATTERN)
+HASH_REGEX = re.compile(HASH_PATTERN)
+# version of the compiled rulesets, bump it when the parsed structure changes
+RULESET_VERSION = 7
+# bulbs of each tech, "name,cost" by line, beside the ruleset files
+TECH_COSTS_FILE = "tech_costs.txt"
+TECH_NONE = "a_none"
+# unit domains, by the terrain classes native to the unit class
+DOMAIN_LAND = 0
+DOMAIN_OCEAN = 1
+DOMAIN_AIR = 2
+# the ruleset shipped with the package
+CLASSIC_RULESET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "classic")
+
+TOKEN_HASH = "hash"
+TOKEN_SECTION = "section"
+TOKEN_INCLUDE = "include"
+TOKEN_ENTRY = "entry"
+TOKEN_TABLE = "table"
+TOKEN_VALUES = "values"
+TOKEN_CLOSE = "close"
+TOKEN_END = "end"
+TOKEN_ERROR = "error"
+# a single value: a string, which may span lines and be wrapped by _("...") or Q_("..."), or a bare word
+VALUE_PATTERN = r"""[a-zA-Z]*_\([ \t]*"(?:[^"\\]|\\.)*"[ \t]*\)|"(?:[^"\\]|\\.)*"|[^\s,;\#{}=\[\]"]+"""
+# spaces, line breaks and ";" comments between the tokens
+SKIP_PATTERN = r"(?:\s|;[^\n]*(?![^\n]))*"
+# values separated by commas, which may continue on the next lines
+VALUES_PATTERN = rf"(?:{VALUE_PATTERN})(?:{SKIP_PATTERN},{SKIP_PATTERN}(?:{VALUE_PATTERN}))*"
+# one alternative per token kind, an entry is matched with its values
+RULESET_TOKEN_REGEX = re.compile(rf"""{SKIP_PATTERN}(?:
+    (?P<hash>\#[^\n]*)
+    |(?P<section>\[[a-zA-Z0-9_]+\])
+    |(?P<include>\*include[ \t]+"[^"\n]*")
+    |(?P<key>[a-zA-Z0-9_\.\-]+)[ \t]*={SKIP_PATTERN}(?:(?P<entry>{VALUES_PATTERN})|(?P<table>\{{))
+    |(?P<values>{VALUES_PATTERN})
+    |(?P<close>\}})
+    |(?P<end>\Z)
+    |(?P<error>\S))""", re.X | re.S)
+# the values of a list, comments between them are matched to be dropped
+VALUES_REGEX = re.compile(rf";[^\n]*|({VALUE_PATTERN})", re.S)
 
 EXTRA_MAP = {
     "mining_shield_incr": "mine",
@@ -35,36 +84,40 @@ EXTRA_MAP = {
 }
 
 def reg_quo_str(line:str):
-    tag = re.match(QUO_STR_PATTERN, line)
+    tag = QUO_STR_REGEX.match(line)
     if tag:
         return tag[1]
     return
 
 def reg_tag(line:str):
-    tag = re.match(TAG_PATTERN, line)
+    tag = TAG_REGEX.match(line)
     if tag: 
         return tag[1]
     return
 
 def reg_name(line:str):
-    if tag := re.match(NAME_PATTERN, line): 
+    if tag := NAME_REGEX.match(line): 
         return tag[1]
-    if tag := re.match(NAME2_PATTERN, line): 
+    if tag := NAME2_REGEX.match(line): 
         return tag[1]
     return reg_quo_str(line)
 
 def reg_kv_pair(line:str):
-    tag = re.match(KV_PATTERN, line)
+    tag = KV_REGEX.match(line)
     if tag: 
         return tag[1].strip(), tag[2].strip()
     return
 
 def reg_hash_line(line:str):
-    tag = re.match(HASH_PATTERN, line)
+    tag = HASH_REGEX.match(line)
     if tag:
         return "#", [i.strip() for i in tag[1].split(',')], TypeEnum.HashtagProperty
     return 
 
+# the values repeat a lot, like "Player" or 0, so their types are cached
+cached_reg_type = functools.lru_cache(maxsize=4096)(reg_type)
+cached_reg_quo_str = functools.lru_cache(maxsize=4096)(reg_quo_str)
+
 def glob_dir(dir:str):
     if dir is None:
         raise ValueError("Please input the right directory of ruleset!")
@@ -74,6 +127,106 @@ def glob_dir(dir:str):
 
     
 
+class ReadOnlyDict(dict):
+    """dict of a compiled table, which can not be modified, copy it with dict() to change it."""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The compiled tables of the ruleset are read-only, copy them to modify!")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return ReadOnlyDict, (dict(self),)
+
+def freeze(value):
+    """Read-only value of a compiled table, with the dicts as ReadOnlyDict and the lists as tuples."""
+    if isinstance(value, dict):
+        return ReadOnlyDict({key: freeze(_value) for key, _value in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(_value) for _value in value)
+    return value
+
+def compiled(method):
+    """Derived table of the ruleset, built once into `tables` and shared read-only by all the calls."""
+    @functools.wraps(method)
+    def wrapper(self):
+        if method.__name__ not in self.tables:
+            self.tables[method.__name__] = freeze(method(self))
+        return self.tables[method.__name__]
+    return wrapper
+
+
+class RulesetTokenizer(object):
+    """
+    Single-pass tokenizer of a ruleset file.
+
+    Iterating yields tuples of (kind, value, pos), where pos is the offset of the token:
+        (TOKEN_SECTION, "terrain_ocean", pos)               for [terrain_ocean]
+        (TOKEN_ENTRY, ("flags", ['"A"', '"B"']), pos)       for flags = "A", "B"
+        (TOKEN_TABLE, "reqs", pos)                          for reqs = {
+        (TOKEN_VALUES, ['"Tech"', '"Radio"'], pos)          for a row of the table
+        (TOKEN_CLOSE, "}", pos)                             at the end of the table
+        (TOKEN_INCLUDE, "default/effects.ruleset", pos)     for *include "default/effects.ruleset"
+        (TOKEN_HASH, ["a", "b"], pos)                       for # a, b
+    Spaces, line breaks and comments are skipped, line continuations of strings are joined.
+    """
+
+    def __init__(self, text:str, filename:str=None):
+        self.text = text
+        self.filename = filename
+
+    def get_line(self, pos:int):
+        return self.text.count("\n", 0, pos) + 1
+
+    @staticmethod
+    def split_values(values:str):
+        if "\\" in values:
+            values = values.replace("\\\n", "")
+        if "," not in values:
+            return [values]
+        return [value for value in VALUES_REGEX.findall(values) if value != ""]
+
+    def __iter__(self):
+        for match in RULESET_TOKEN_REGEX.finditer(self.text):
+            kind = match.lastgroup
+            if kind == TOKEN_ENTRY:
+                yield kind, (match["key"], RulesetTokenizer.split_values(match[kind])), match.start()
+            elif kind == TOKEN_VALUES:
+                yield kind, RulesetTokenizer.split_values(match[kind]), match.start(kind)
+            elif kind == TOKEN_SECTION:
+                yield kind, match[kind][1:-1], match.start(kind)
+            elif kind == TOKEN_TABLE:
+                yield kind, match["key"], match.start(kind)
+            elif kind == TOKEN_HASH:
+                # the "# a, b" comments starting a line, like the terrains of a resource
+                start = match.start(kind)
+                if (reg_hash := reg_hash_line(match[kind])) and self.text[self.text.rfind("\n", 0, start)+1:start].strip() == "":
+                    yield kind, reg_hash[1], start
+            elif kind == TOKEN_INCLUDE:
+                yield kind, match[kind].split('"')[1], match.start(kind)
+            elif kind == TOKEN_END:
+                return
+            elif kind == TOKEN_ERROR:
+                raise ValueError(f"Unexpected {match[kind]!r} in {self.filename} at line {self.get_line(match.start(kind))}!")
+            else:
+                yield kind, match[kind], match.start(kind)
+
+
+class RulesetRecord(object):
+    """
+    A section of a ruleset file, like [terrain_ocean], with its values and types by key.
+    """
+
+    def __init__(self, module:str, tag:str, entries:dict):
+        self.module = module
+        self.tag = tag
+        self.values = {key: entry["__value__"] for key, entry in entries.items()}
+        self.types = {key: entry["__type__"] for key, entry in entries.items()}
+
+    def __repr__(self):
+        return f"RulesetRecord({self.module}.{self.tag})"
+
+
 class TreeNode(object):
     tech: str
 
@@ -85,11 +238,219 @@ class TreeNode(object):
     nprovide: int
     provide: list[super]
 
+class TechTree(object):
+    """
+    Compiled tech tree. Techs are numbered in the order of the ruleset after A_NONE, like
+    the "done" vectors of the sav files, and a set of techs is an int with a bit per tech.
+    :attribute names: tuple<str>, the lowercase tech names by id.
+    :attribute index: dict<str, int>, the ids by name.
+    :attribute req, pro: tuple<int>, the direct requirements and successors of each tech.
+    :attribute req_closure, pro_closure: tuple<int>, all the requirements and successors of each tech.
+    :attribute costs, cumulative_costs: tuple<int>, the bulbs of each tech, alone and with all its requirements.
+
+    It is immutable, so copies share it.
+    """
+
+    def __init__(self, req:dict, costs:dict=None, cost_style:str="Classic", base_cost:int=20, min_cost:int=20):
+        """
+        req: dict<str, list<str>>, the requirements of each tech, like get_tech_tree()["req"].
+        costs: dict<str, int>, the known bulbs of techs, the others follow cost_style.
+        """
+        self.names = tuple([TECH_NONE] + [tech for tech in req if tech != TECH_NONE])
+        self.index = {tech: i for i, tech in enumerate(self.names)}
+        self.req = tuple(self.get_mask(req.get(tech, [])) for tech in self.names)
+        req_closure = [None] * len(self.names)
+        def visit(tech):
+            if req_closure[tech] is None:
+                mask = 0
+                for _req in self.iter_ids(self.req[tech]):
+                    mask |= (1 << _req) | visit(_req)
+                req_closure[tech] = mask
+            return req_closure[tech]
+        pro, pro_closure = [0] * len(self.names), [0] * len(self.names)
+        for tech in range(len(self.names)):
+            visit(tech)
+            for _req in self.iter_ids(self.req[tech]):
+                pro[_req] |= 1 << tech
+            for _req in self.iter_ids(req_closure[tech]):
+                pro_closure[_req] |= 1 << tech
+        self.req_closure = tuple(req_closure)
+        self.pro = tuple(pro)
+        self.pro_closure = tuple(pro_closure)
+        # the advances of the ruleset, every tech but A_NONE
+        self.advances = (1 << len(self.names)) - 2
+
+        costs = dict() if costs is None else costs
+        self.costs = tuple([0] + [costs[tech] if tech in costs else
+                                  TechTree.get_style_cost(cost_style, self.count(req_closure[i] & self.advances) + 1,
+                                                          base_cost, min_cost)
+                                  for i, tech in enumerate(self.names) if i > 0])
+        self.cumulative_costs = tuple(cost + self.get_cost(req_closure[i]) for i, cost in enumerate(self.costs))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @staticmethod
+    def get_style_cost(cost_style:str, num_reqs:int, base_cost:int, min_cost:int):
+        """Bulbs of a tech with num_reqs requirements, itself included, by the tech_cost_style of game.ruleset."""
+        if cost_style in ("Classic", "Classic+"):
+            cost = base_cost * (1.0 + num_reqs) * math.sqrt(1.0 + num_reqs) / 2
+        elif cost_style in ("Experimental", "Experimental+"):
+            cost = base_cost * (num_reqs * num_reqs / (1 + math.sqrt(math.sqrt(num_reqs + 1))) - 0.5)
+        else:
+            # "Linear", and "Civ I|II" which depends on the number of known techs
+            cost = base_cost * num_reqs
+        return int(max(cost, min_cost))
+
+    @staticmethod
+    def iter_ids(mask:int):
+        """Ids of the techs in mask, in increasing order."""
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    @staticmethod
+    def count(mask:int):
+        return bin(mask).count("1")
+
+    def get_mask(self, techs):
+        mask = 0
+        for tech in techs:
+            mask |= 1 << self.index[tech]
+        return mask
+
+    def get_names(self, mask:int):
+        return [self.names[tech] for tech in self.iter_ids(mask)]
+
+    def get_closure(self, mask:int):
+        """All the requirements of the techs in mask, recursively, without the techs themselves."""
+        closure = 0
+        for tech in self.iter_ids(mask):
+            closure |= self.req_closure[tech]
+        return closure
+
+    def get_edge(self, mask:int):
+        """Techs of mask which have no successor in mask."""
+        edge = 0
+        for tech in self.iter_ids(mask):
+            if self.pro[tech] & mask == 0:
+                edge |= 1 << tech
+        return edge
+
+    def get_frontier(self, mask:int):
+        """Techs out of mask whose requirements are all in mask, the techs which can be researched next."""
+        frontier = 0
+        for tech in self.iter_ids(self.advances & ~mask):
+            if self.req[tech] & ~mask == 0:
+                frontier |= 1 << tech
+        return frontier
+
+    def get_cost(self, mask:int):
+        """Bulbs of all the techs in mask."""
+        return sum(self.costs[tech] for tech in self.iter_ids(mask))
+
+
+class UnitTypeTable(object):
+    """
+    Compiled unit types of units.ruleset, as a struct of arrays. Unit types are coded
+    by their order in the ruleset, and every column is a numpy array indexed by the codes.
+    :attribute names: tuple<str>, the lowercase unit type names by code.
+    :attribute index: dict<str, int>, the codes by name.
+    :attribute attack, defense, hitpoints, firepower, move_rate, vision_radius_sq: numpy.ndarray<int>.
+    :attribute unit_class: numpy.ndarray<int>, the codes of class_names.
+    :attribute domain: numpy.ndarray<int>, DOMAIN_LAND, DOMAIN_OCEAN or DOMAIN_AIR.
+    :attribute obsolete_by: numpy.ndarray<int>, the code of the upgrade, -1 if none.
+    :attribute combat: numpy.ndarray<bool>, not the "Settlers" flag.
+    :attribute ocean: numpy.ndarray<bool>, the units of DOMAIN_OCEAN.
+
+    It is immutable, so copies share it.
+    """
+
+    columns = ["attack", "defense", "hitpoints", "firepower", "move_rate", "vision_radius_sq"]
+
+    def __init__(self, units:dict, unit_classes:dict, terrains:dict):
+        """
+        units, unit_classes, terrains: dict<str, dict>, the values of the [unit_*], [unitclass_*]
+            and [terrain_*] sections by lowercase name, like get_records(...)[name].values.
+        """
+        self.names = tuple(units)
+        self.index = {name: code for code, name in enumerate(self.names)}
+        self.class_names = tuple(unit_classes)
+        class_index = {name: code for code, name in enumerate(self.class_names)}
+        for column in self.columns:
+            setattr(self, column, np.array([values.get(column, 0) for values in units.values()], dtype=np.int32))
+
+        # a class is of the ocean, or the land, when it moves on its terrains only
+        native = {name: set() for name in self.class_names}
+        for values in terrains.values():
+            terrain_class = UnitTypeTable.get_names(values.get("class"))
+            for name in UnitTypeTable.get_names(values.get("native_to")):
+                if name in native:
+                    native[name].update(terrain_class)
+        class_domain = [DOMAIN_OCEAN if native[name] == {"oceanic"} else
+                        DOMAIN_LAND if native[name] == {"land"} else DOMAIN_AIR for name in self.class_names]
+
+        unit_class, obsolete_by, combat = list(), list(), list()
+        for values in units.values():
+            unit_class.append(class_index[UnitTypeTable.get_names(values.get("class"))[0]])
+            obsolete_by.append(self.index.get(next(iter(UnitTypeTable.get_names(values.get("obsolete_by"))), None), -1))
+            combat.append("settlers" not in UnitTypeTable.get_names(values.get("flags")))
+        self.unit_class = np.array(unit_class, dtype=np.int32)
+        self.domain = np.array(class_domain, dtype=np.int32)[self.unit_class]
+        self.obsolete_by = np.array(obsolete_by, dtype=np.int32)
+        self.combat = np.array(combat, dtype=bool)
+        self.ocean = self.domain == DOMAIN_OCEAN
+        for column in self.columns + ["unit_class", "domain", "obsolete_by", "combat", "ocean"]:
+            getattr(self, column).flags.writeable = False
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def get_names(value):
+        """Lowercase names of a ruleset value, like '"Land"' or ['"Sea"', '"Air"'], without "none"."""
+        values = value if isinstance(value, list) else [value]
+        names = list()
+        for value in values:
+            if isinstance(value, str) and (value := value.strip('"').lower()) not in ("", "none"):
+                names.append(value)
+        return names
+
+    def get_codes(self, names):
+        """Codes of unit type names, like the "type_by_name" column of the units."""
+        return np.array([self.index[name.lower()] for name in names], dtype=np.int32)
+
+    def get_strength(self, codes, defense:bool=False):
+        """Combat strength of the units, attack (or defense) * hitpoints * firepower."""
+        value = self.defense if defense else self.attack
+        return value[codes] * self.hitpoints[codes] * self.firepower[codes]
+
+    def to_dict(self):
+        """{name: {column: value}}, like the other ruleset tables."""
+        columns = self.columns + ["domain", "combat"]
+        return {name: {column: getattr(self, column)[code].item() for column in columns}
+                for code, name in enumerate(self.names)}
+
+
 class RulesetParser(object):
     """
     Ruleset file parser.
     :parameter dir: str, the path of ruleset files.
     :attribute data: dict<str, dict<str, any>>, the data after parse ruleset files.
+    :attribute tables: dict<str, any>, the derived tables built by `compile`, like get_tech_tree.
+    :attribute missing_includes: list<str>, the `*include` files not found beside the rulesets.
+    :attribute include_paths: list<str>, the paths looked up for the `*include` files, up to the found
+        ones, so that a cache of the parser can tell when they are added or edited.
+    :attribute tech_costs: dict<str, int>, the bulbs of techs from tech_costs.txt, if any.
+    :attribute records: dict<str, dict<str, RulesetRecord>>, the sections of each file.
+    :attribute index: dict<tuple, dict<str, RulesetRecord>>, the sections of (file, prefix, name key)
+        by their lowercase names, built on the first query.
+
+    The queries return the parsed values without copying them, they should not be modified.
     """
 
     hashkey = "#"
@@ -98,82 +459,199 @@ class RulesetParser(object):
     def __init__(self, dir:str):
         rulesets = glob_dir(dir)
 
-        self._raw_data = dict()
         self.data = dict()
+        self.tables = dict()
+        self.missing_includes = list()
+        self.include_paths = list()
+        self.tech_costs = dict()
 
         for ruleset in rulesets:
-            with open(ruleset, "r", encoding="utf-8") as filep:
-                name = ruleset.split(".")[0].split("/")[-1]
-                self._raw_data[name] = list()
-                for line in filep:
-                    self._raw_data[name] += ([] if (tmp := line.strip()) == "" else [tmp])
+            name = os.path.basename(ruleset).split(".")[0]
             self.data[name] = dict()
-            self._parse(name)
-
-    def _parse(self, name):
-        """Parse ruleset into dict structure."""
-        last_tag = None
-        for _, raw_line in enumerate(self._raw_data[name]):
-            # ignore special lines
-            if raw_line.startswith(IGNORE_SUFFIX): 
+            self._parse(name, ruleset)
+
+        if os.path.isfile(tech_costs := os.path.join(dir, TECH_COSTS_FILE)):
+            with open(tech_costs, "r", encoding="utf-8") as filep:
+                for line in filep:
+                    if (line := line.strip()) != "":
+                        tech, cost = line.rsplit(",", 1)
+                        self.tech_costs[tech.lower()] = int(cost)
+
+        self.records = {module: {tag: RulesetRecord(module, tag, entries) for tag, entries in sections.items()}
+                        for module, sections in self.data.items()}
+        self.index = dict()
+        self._paths = None
+
+    def _parse(self, name:str, filename:str):
+        """
+        Parse a ruleset file into dict structure, in one pass over its tokens.
+        Values are stored as {"__value__": value, "__type__": TypeEnum}:
+            key = 1                         single value, typed by reg_type
+            key = "a", "b"                  TypeEnum.List of the values
+            key = { "type", "name" ... }    TypeEnum.Table, a list of rows {column: value}
+        """
+        with open(filename, "r", encoding="utf-8") as filep:
+            tokenizer = RulesetTokenizer(filep.read(), filename)
+        tokens = iter(tokenizer)
+        section = None
+        for kind, value, pos in tokens:
+            if kind == TOKEN_ENTRY:
+                key, values = value
+                if len(values) == 1:
+                    data = dict(zip(("__value__", "__type__"), cached_reg_type(values[0])))
+                else:
+                    data = {"__value__": [cached_reg_type(value)[0] for value in values], "__type__": TypeEnum.List}
+            elif kind == TOKEN_TABLE:
+                key = value
+                data = {"__value__": self._parse_table(tokens, tokenizer, pos), "__type__": TypeEnum.Table}
+            elif kind == TOKEN_SECTION:
+                section = value
+                self.data[name][section] = dict()
                 continue
-            # mark the tag
-            tag = reg_tag(raw_line)
-            if tag:
-                self.data[name][tag] = dict()
-                last_tag = tag
-            # get data belong to the tag
-            kv_pair = reg_kv_pair(raw_line)
-            reg_hash = reg_hash_line(raw_line)
-            if last_tag:
-                if kv_pair:
-                    value = reg_type(kv_pair[1])[0]
-                    stype = reg_type(kv_pair[1])[1]
-                    self.data[name][last_tag][kv_pair[0]] = {"__value__": value, "__type__": stype}
-                elif reg_hash:
-                    if_flag = None
-                    for key, mapping_value in self.hashconf.items():
-                        if last_tag.startswith(key):
-                            if_flag = mapping_value
+            elif kind == TOKEN_HASH:
+                key = self.hashkey
+                if section is not None:
+                    for prefix, mapping_value in self.hashconf.items():
+                        if section.startswith(prefix):
+                            key = mapping_value
                             break
-                    if if_flag is not None:
-                        self.data[name][last_tag][if_flag] = {"__value__": reg_hash[1], "__type__":reg_hash[2]}
-                    else:
-                        self.data[name][last_tag][reg_hash[0]] = {"__value__": reg_hash[1], "__type__":reg_hash[2]}
+                data = {"__value__": value, "__type__": TypeEnum.HashtagProperty}
+            elif kind == TOKEN_INCLUDE:
+                self._include(name, filename, value)
+                continue
+            else:
+                raise ValueError(f"Unexpected {kind} in {filename} at line {tokenizer.get_line(pos)}!")
+            # the entries before the first section are dropped
+            if section is not None:
+                self.data[name][section][key] = data
         return
 
+    @staticmethod
+    def _parse_table(tokens, tokenizer, start:int):
+        """Rows of a table, one per line unless the line ends with a comma, as dicts keyed by the header row."""
+        rows = list()
+        for kind, values, pos in tokens:
+            if kind == TOKEN_CLOSE:
+                break
+            if kind != TOKEN_VALUES:
+                raise ValueError(f"Unexpected {kind} in {tokenizer.filename} at line {tokenizer.get_line(pos)}!")
+            rows.append(values)
+        else:
+            raise ValueError(f"Table not closed in {tokenizer.filename} at line {tokenizer.get_line(start)}!")
+        if len(rows) == 0:
+            return list()
+        header = [reg_quo_str(column) or column for column in rows[0]]
+        return [dict(zip(header, [cached_reg_type(value)[0] for value in row])) for row in rows[1:]]
+
+    def _include(self, name:str, filename:str, include:str):
+        """Parse an included file into the same ruleset, relative to the ruleset directory or its parent."""
+        ruleset_dir = os.path.dirname(filename)
+        for root in [ruleset_dir, os.path.dirname(ruleset_dir)]:
+            self.include_paths.append(path := os.path.join(root, include))
+            if os.path.isfile(path):
+                self._parse(name, path)
+                return
+        self.missing_includes.append(include)
+        return
+
+    def compile(self):
+        """
+        Build all the derived tables, so that the parser is a complete artifact
+        to cache. Return self.
+        """
+        for name in dir(type(self)):
+            if getattr(getattr(type(self), name), "__wrapped__", None) is not None:
+                getattr(self, name)()
+        return self
+
     def get_value(self, keys:list, fetch_key:str=None):
-        """Get data from keys."""
-        return recursive_dict(keys, self.data, fetch_key)
+        """
+        Get data from keys. With fetch_key, like "__value__", stop at the first level holding it,
+        and replace the values of a section by their fetch_key.
+        """
+        node = self.data
+        for depth in range(len(keys) + 1):
+            if not isinstance(node, dict):
+                return node
+            if fetch_key in node:
+                return node[fetch_key]
+            if depth == len(keys):
+                break
+            if keys[depth] not in node:
+                return
+            node = node[keys[depth]]
+        if fetch_key is None:
+            return node
+        if len(keys) == 2 and fetch_key in ("__value__", "__type__"):
+            record = self.records[keys[0]][keys[1]]
+            return record.values if fetch_key == "__value__" else record.types
+        return {_key: value[fetch_key] if isinstance(value, dict) and fetch_key in value else value
+                for _key, value in node.items()}
+
+    def _get_paths(self):
+        """Keys of every level of data in depth-first order, and the positions of each key."""
+        if self._paths is None:
+            paths = list()
+            positions = dict()
+            def visit(path, node):
+                for _key, value in node.items():
+                    positions.setdefault(_key, []).append(len(paths))
+                    paths.append(path + (_key,))
+                    if isinstance(value, dict):
+                        visit(paths[-1], value)
+            visit((), self.data)
+            self._paths = (paths, positions)
+        return self._paths
 
     def search(self, key, fetch_key:str=None):
-        """Search ambiguous key."""
-        return search_dict(key, self.data, fetch_key)
+        """
+        Search ambiguous key. Return {".file.section...": value} of the keys containing it,
+        the keys under a match are not searched.
+        """
+        paths, positions = self._get_paths()
+        matches = sorted(position for _key, _positions in positions.items() if key in _key for position in _positions)
+        output = dict()
+        for position in matches:
+            path = paths[position]
+            if not any(key in _key for _key in path[:-1]):
+                output["."+".".join(path)] = self.get_value(path, fetch_key)
+        return output
 
     def get_property(self, module:str, tag:str, property:str, attribute:str="__value__"):
         if attribute == "__value__":
             return self.data[module][tag][property]["__value__"]
         return self.data[module][tag][property]
 
+    def get_records(self, firstkey:str, keyword:str, name:str="name"):
+        """Sections of firstkey named like [keyword_*], by the lowercase value of their `name` key."""
+        if (records := self.index.get((firstkey, keyword, name))) is None:
+            records = dict()
+            _keyword = keyword+"_"
+            for tag, record in self.records[firstkey].items():
+                if tag.startswith(_keyword):
+                    records[reg_name(record.values[name]).lower()] = record
+            self.index[(firstkey, keyword, name)] = records
+        return records
+
     def get_properties(self, firstkey, keyword, properties:list, name:str="name", value_type=None, lower=False, default_value=0):
         output = dict()
-        for key in self.data[firstkey]:
-            _keyword = keyword+"_"
-            if key.startswith(_keyword):
-                _key = reg_name(self.data[firstkey][key][name]["__value__"]).lower()
-                output[_key] = dict()
-                for property in properties:
-                    if property in self.data[firstkey][key]:
-                        if value_type is None:
-                            output[_key][property] = self.data[firstkey][key][property]["__value__"]
-                        else:
-                            output[_key][property] = reg_quo_str(self.data[firstkey][key][property]["__value__"])
-                        if lower and isinstance(output[_key][property], str):
-                            output[_key][property] = output[_key][property].lower()
-                    else:
-                        output[_key][property] = default_value
+        for _key, record in self.get_records(firstkey, keyword, name).items():
+            output[_key] = dict()
+            for property in properties:
+                if property in record.values:
+                    value = record.values[property]
+                    if value_type is not None:
+                        # the lists of values are unquoted one by one, as the cache only takes strings
+                        value = [cached_reg_quo_str(_value) for _value in value] if isinstance(value, list) \
+                            else cached_reg_quo_str(value)
+                    if lower and isinstance(value, str):
+                        value = value.lower()
+                    output[_key][property] = value
+                else:
+                    output[_key][property] = default_value
         return output
 
+    @compiled
     def get_terrain_resource(self):
         output = dict()
         resource_conf = self.get_properties("terrain", "resource", ["food", "shield", "trade", "terrain"], name="extra")
@@ -184,6 +662,7 @@ class RulesetParser(object):
                 output[terrain].append(resource)
         return output
 
+    @compiled
     def get_terrain_extra(self):
         output = dict()
         extra_conf = self.get_properties("terrain", "terrain", ["mining_shield_incr", "irrigation_food_incr", 
@@ -204,18 +683,20 @@ class RulesetParser(object):
 
         return output
 
+    @compiled
     def get_extra_conflicts(self):
         conflicts_conf = self.get_properties("terrain", "extra", ["conflicts"], default_value="")
         output = {}
         for key, conflicts in conflicts_conf.items():
-            if conflicts["conflicts"] > "":
-                conflicts_list = conflicts["conflicts"].split(",")
-                conflicts_list = [reg_quo_str(confl.strip()).lower() for confl in conflicts_list]
-                output[key] = conflicts_list
+            if len(conflicts := conflicts["conflicts"]) > 0:
+                if isinstance(conflicts, str):
+                    conflicts = conflicts.split(",")
+                output[key] = [reg_quo_str(confl.strip()).lower() for confl in conflicts]
         return output
 
     def get_terrain_optimal_extra(self):
-        terrain_extra_conf = self.get_terrain_extra()
+        # the conflicting extras are deleted below
+        terrain_extra_conf = {terrain: dict(extra_dict) for terrain, extra_dict in self.get_terrain_extra().items()}
         conflicts_conf = self.get_extra_conflicts()
         output = dict()
         print("ori: ", terrain_extra_conf)
@@ -235,6 +716,7 @@ class RulesetParser(object):
                                 del extra_conf[conflict]
         return terrain_extra_conf
 
+    @compiled
     def get_resource_conf(self):
         return self.get_properties("terrain", "resource", ["food", "shield", "trade"], name="extra")
     
@@ -247,12 +729,19 @@ class RulesetParser(object):
                 wonder_list.append(key)
         return wonder_list
 
+    @compiled
     def get_vision_radius_sq(self):
         output = self.get_properties("units", "unit", ["vision_radius_sq"])
         for key, value in output.items():
             output[key] = value["vision_radius_sq"]
         return output
+
+    def get_city_radius_sq(self):
+        """radius_sq of the work area and of the vision of the new cities, {"city": 5, "vision": 5} in classic."""
+        civstyle = self.records["game"]["civstyle"].values
+        return {"city": int(civstyle.get("init_city_radius_sq", 5)), "vision": int(civstyle.get("init_vis_radius_sq", 5))}
     
+    @compiled
     def get_tech_tree(self):
         output = self.get_properties("techs", "advance", ["req1", "req2"], value_type="quo", lower=True)
         req = dict()
@@ -269,8 +758,29 @@ class RulesetParser(object):
                 if _tmp not in pro:
                     pro[_tmp] = list()
                 pro[_tmp].append(key)
-        return {"req": req, "pro": pro}
-
+        return {"req": req, "pro": pro, "tree": self._get_tech_tree(req)}
+
+    def _get_tech_tree(self, req:dict):
+        """TechTree of the requirements, with the bulbs of tech_costs.txt, the ruleset or the tech_cost_style."""
+        research = self.records["game"]["research"].values if "research" in self.records.get("game", {}) else {}
+        cost_style = str(research.get("tech_cost_style", '"Classic"')).strip('"')
+        costs = dict()
+        if cost_style.endswith("+"):
+            for tech, record in self.get_records("techs", "advance").items():
+                if isinstance(cost := record.values.get("cost"), int) and cost > 0:
+                    costs[tech] = cost
+        costs.update(self.tech_costs)
+        return TechTree(req, costs, cost_style=cost_style,
+                        base_cost=research.get("base_tech_cost", 20), min_cost=research.get("min_tech_cost", 20))
+
+    @compiled
+    def get_unit_types(self):
+        """UnitTypeTable of units.ruleset."""
+        def values(firstkey, keyword):
+            return {name: record.values for name, record in self.get_records(firstkey, keyword).items()}
+        return UnitTypeTable(values("units", "unit"), values("units", "unitclass"), values("terrain", "terrain"))
+
+    @compiled
     def get_unit_obsolete(self):
         output = self.get_properties("units", "unit", ["obsolete_by"], value_type="quo", lower=True)
         req = dict()
@@ -292,9 +802,11 @@ class RulesetParser(object):
 
 if __name__ == "__main__":
     rule_parser = RulesetParser(dir="src/freeciv_sav/config/classic/")
-    assert list(rule_parser.data.keys()) == ["buildings", "effects", "styles", "nations", "units", 
-                                             "cities", "actions", "techs", "game", "terrain", "governments"], "Ruleset not completed!"
-    assert len(rule_parser.data["terrain"]["terrain_ocean"].keys()) == 40, "Check data structure!"
+    assert sorted(rule_parser.data.keys()) == sorted(["buildings", "effects", "styles", "nations", "units", 
+                                             "cities", "actions", "techs", "game", "terrain", "governments"]), "Ruleset not completed!"
+    assert len(rule_parser.data["terrain"]["terrain_ocean"].keys()) == 41, "Check data structure!"
+    assert rule_parser.get_property("buildings", "building_airport", "reqs") == \
+        [{"type": '"Tech"', "name": '"Radio"', "range": '"Player"'}], "Check table values!"
     assert rule_parser.get_value(["terrain", "terrain_ocean", "shield"])["__value__"] == 0, "Check get_value method!"
     assert rule_parser.get_property("terrain", "terrain_ocean", "shield") == 0, "Check get_property method!"
     # print(rule_parser.search("forest", fetch_key="__value__"))
@@ -13,11 +13,15 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import re
-from io import StringIO
-import pandas as pd
+import collections
+import multiprocessing
+import numpy as np
+from freeciv_sav.parser.table import SavTable
 from freeciv_sav.bean.parse_type import ParseTypeBean
 from freeciv_sav.bean.format_type import FormatTypeBean
+from freeciv_sav.utils.io import IOManager
 
 # terrain map
 PLAYER_TERRAIN_SIGNAL = "map_t"
@@ -40,6 +44,8 @@ PATTERN_PLAYER_KEY = r"player\d+"
 RAW_REPRE = "__raw__"
 GLOBAL_TERRAIN_SIGNAL = "t"
 SEEN_TERRAIN_SIGNAL = "k00"
+# rows of the layers k00, k01... of the known map
+SEEN_TERRAIN_PATTERN = r"k\d\d_"
 EXTRA_RESOURCE_SIGNAL = "e0"
 EXTRA_RESOURCE_PATTERN = r"(e0\d)"
 PLAYER_RESOURCE_PATTERN = r"map_(e0\d)"
@@ -51,45 +57,230 @@ TECH_SIGNAL = "t"
 # eowner
 # dc
 
+# version of the SavParser objects kept by ParseCache, bump it when their state changes
+SAV_PARSER_VERSION = 1
+# token kinds emitted by SavTokenizer
+TOKEN_SECTION = "section"
+TOKEN_BASIC = "basic"
+TOKEN_CODE = "code"
+TOKEN_TABLE = "table"
+# precompiled patterns
+KEY_PATTERN = re.compile(R"^[\.a-zA-Z0-9_-]+=")
+CSV_PATTERN = re.compile(R"""(?:^|,)(?=[^"]|(")?)"?((?(1)[^"]*|[^,"]*))"?(?=,|$)""")
+PLAYER_KEY_PATTERN = re.compile(PATTERN_PLAYER_KEY)
+# section headers and the openers of multi-line blocks, for the lazy index
+SECTION_SCAN_PATTERN = re.compile(
+    rb"^[ \t]*(?:\[([^\n]*)\]|[\.a-zA-Z0-9_-]+=([\$\{])([^\n]*?))[ \t\r]*$", re.M)
+BLOCK_END_PATTERNS = {b"$": re.compile(rb"\$[ \t\r]*$", re.M),
+                      b"{": re.compile(rb"\}[ \t\r]*$", re.M)}
+HEAD_TAG = "__head__"
+# tile without owner, source or worker in the comma-separated map rows
+EMPTY_TILE = "-"
+
+
+class SavTokenizer:
+    """
+    Single-pass state machine over the stripped, non-empty lines of a sav file.
+
+    Iterating yields tuples of (kind, name, value, index) as soon as a token is
+    complete, where index is the number of the line that opened the token:
+        (TOKEN_SECTION, "map", None, index)        for [map]
+        (TOKEN_BASIC, "turn", "40", index)         for turn=40
+        (TOKEN_CODE, "code", ["..."], index)       for code=$...$
+        (TOKEN_TABLE, "u", ['"id","x"', ...], index) for u={...}
+    Values of code blocks and tables are the raw lines between the delimiters,
+    the line carrying the closing delimiter is dropped.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __iter__(self):
+        key_match = KEY_PATTERN.match
+        # state of the open block: kind, closing char, name, collected lines, index
+        block_kind = None
+        block_end = block_name = block_rows = block_index = None
+        for index, line in enumerate(self.lines):
+            if block_kind is not None:
+                if line[-1] == block_end:
+                    yield block_kind, block_name, block_rows, block_index
+                    block_kind = None
+                else:
+                    block_rows.append(line)
+                continue
+
+            if line[0] == "[" and line[-1] == "]":
+                yield TOKEN_SECTION, line[1:-1], None, index
+                continue
+
+            if (match := key_match(line)) is None:
+                continue
+            name = line[:match.end() - 1]
+            value = line[match.end():]
+            if value[:1] == "$":
+                block_kind, block_end = TOKEN_CODE, "$"
+            elif value[:1] == "{":
+                block_kind, block_end = TOKEN_TABLE, "}"
+            else:
+                yield TOKEN_BASIC, name, value, index
+                continue
+
+            # the block may be closed on the line where it is opened
+            value = value[1:]
+            if value != "" and value[-1] == block_end:
+                yield block_kind, name, [], index
+                block_kind = None
+            else:
+                block_name, block_rows, block_index = name, [value], index
+
+
 class SavParser:
     """Sav file parser."""
 
-    def __init__(self, filename: str = None):
+    def __init__(self, filename: str = None, lazy: bool = False):
         """
         Parameters
         ----------
-        filename: name of sav file. Must be a unzipped file ending with `.sav`
+        filename: name of sav file, plain or compressed by gzip, bzip2, xz or zstd
+        lazy: only index the section headers on open, and parse a section
+            the first time it is asked for by `get()` or a `get_*` accessor.
+            `tags` then only holds the sections parsed so far.
         """
         self.filename = filename
-        self.lines = []
+        self.lazy = lazy
+        self._lines = []
         self.tags = {}
         self.players = list()
+        # section name -> [start, end) byte offsets of its body, in lazy mode
+        self.offsets = dict()
+        # decompressed content of a compressed file, in lazy mode
+        self._data = None
         if self.filename is not None:
             self._parse()
 
     def reset(self, filename: str):
         self.filename = filename
-        self.lines.clear()
+        self._lines.clear()
         self.tags.clear()
         self.players.clear()
+        self.offsets.clear()
+        self._data = None
         self._parse()
         return
 
+    @property
+    def lines(self):
+        """Stripped, non-empty lines of the file, read on demand in lazy mode."""
+        if self.lazy and len(self._lines) == 0 and self.filename is not None:
+            if self._data is not None:
+                for _ in self._read_lines(self._data.decode("utf-8").split("\n")):
+                    pass
+            else:
+                with IOManager.open_sav(self.filename) as filep:
+                    for _ in self._read_lines(filep):
+                        pass
+        return self._lines
+
     def _parse(self):
-        with open(self.filename, "r", encoding="utf-8") as filep:
-            for line in filep:
-                self.lines += ([] if (tmp := line.strip()) == "" else [tmp])
-
-        # Probably we can change the model to "read a line and parse"
-        # instead of this "read all and parse parts" strategy?
-        self.parse(self.tag_cond, self.tags)
-        for key in self.tags:
-            self.parse_tag(key)
-            # record player keys
-            if re.match(PATTERN_PLAYER_KEY, key):
-                self.players.append(key)
+        if self.lazy:
+            self._index()
+            return
+        with IOManager.open_sav(self.filename) as filep:
+            self._consume(SavTokenizer(self._read_lines(filep)), self._lines, HEAD_TAG)
         return
 
+    def _read_lines(self, filep):
+        """Strip lines while reading and keep them for the writer."""
+        lines = self._lines
+        for line in filep:
+            if (tmp := line.strip()) != "":
+                lines.append(tmp)
+                yield tmp
+
+    def _consume(self, tokens, lines: list, tag_name: str):
+        """
+        Fill tags from the token stream of SavTokenizer.
+
+        lines: the list the tokens are read from, to keep the raw lines.
+        tag_name: the tag that receives the tokens before the first section.
+        """
+        tag = self.tags[tag_name] = {RAW_REPRE: None}
+        first = 0
+        for kind, name, value, index in tokens:
+            if kind == TOKEN_BASIC:
+                tag[name] = self.parse_basic(value)
+            elif kind == TOKEN_SECTION:
+                tag[RAW_REPRE] = lines[first:index]
+                first = index + 1
+                tag = self.tags[name] = {RAW_REPRE: None}
+                # record player keys
+                if PLAYER_KEY_PATTERN.match(name):
+                    self.players.append(name)
+            elif kind == TOKEN_TABLE:
+                tag[name] = self.parse_table(value)
+            else:
+                tag[name] = self.parse_code(value)
+        tag[RAW_REPRE] = lines[first:]
+        return
+
+    def _index(self):
+        """Record the byte offsets of every section body without parsing it."""
+        with IOManager.open_sav(self.filename, "rb") as filep:
+            data = filep.read()
+        # compressed streams can not seek cheaply, keep them in memory
+        if IOManager.get_codec(self.filename) is not None:
+            self._data = data
+        for name, offset in SavParser.index_sections(data).items():
+            self.offsets[name] = offset
+            if PLAYER_KEY_PATTERN.match(name):
+                self.players.append(name)
+        return
+
+    @staticmethod
+    def index_sections(data, sections: set = None):
+        """
+        Byte offsets {section: [start, end)} of the section bodies in the content of a sav file.
+        data: bytes or mmap. Headers inside code blocks and tables are skipped.
+        sections: stop once these sections are indexed, instead of reading the whole file.
+        """
+        names = [HEAD_TAG]
+        starts = [0]
+        ends = []
+        pos = 0
+        remain = None if sections is None else set(sections)
+        while (match := SECTION_SCAN_PATTERN.search(data, pos)) is not None:
+            pos = match.end()
+            if match[1] is not None:
+                ends.append(match.start())
+                if remain is not None:
+                    remain.discard(names[-1])
+                    if len(remain) == 0:
+                        return {name: [start, end] for name, start, end in zip(names, starts, ends)}
+                names.append(match[1].decode("utf-8"))
+                starts.append(pos)
+                continue
+            # skip to the end of a multi-line block
+            rest = match[3].strip()
+            if rest == b"" or rest[-1:] != (b"$" if match[2] == b"$" else b"}"):
+                if (end := BLOCK_END_PATTERNS[match[2]].search(data, pos + 1)) is None:
+                    break
+                pos = end.end()
+        ends.append(len(data))
+        return {name: [start, end] for name, start, end in zip(names, starts, ends)}
+
+    def _load(self, key: str):
+        """Parse a single section of the lazy index."""
+        start, end = self.offsets[key]
+        if self._data is not None:
+            text = self._data[start:end].decode("utf-8")
+        else:
+            with open(self.filename, "rb") as filep:
+                filep.seek(start)
+                text = filep.read(end - start).decode("utf-8")
+        lines = [tmp for line in text.split("\n") if (tmp := line.strip()) != ""]
+        self._consume(SavTokenizer(lines), lines, key)
+        return self.tags[key]
+
     def _parse_map(self):
         """
         Convert raw_data to 2-d array.
@@ -118,67 +309,29 @@ class SavParser:
         (is_a_tag: bool, name_of_tag: str, end_position: int)
         """
         return ((x, line[:x.end() - 1], x.end()) if
-                (x := re.match(R"^[\.a-zA-Z0-9_-]+=", line)) else
+                (x := KEY_PATTERN.match(line)) else
                 (False, "", 0))
 
-    def parse(self, cond: callable, coll: dict):
-        """Parse the stored lines."""
-        last = 0
-        last_tag = "__head__"
-        for index, line in enumerate(self.lines):
-            result, name, rest = cond(line)
-            if result:
-                if last_tag != "":
-                    coll[last_tag] = {
-                        RAW_REPRE: (  # [ self.lines[last][rest:]] +
-                            self.lines[last + 1:index])
-                    }
-
-                last = index
-                last_tag = name
-
-        coll[last_tag] = {
-            RAW_REPRE: (  # [self.lines[last][rest:]] +
-                self.lines[last + 1:])
-        }
-
-    def parse_code(self, lines: list, cur_index: int, prefix: int):
-        """
-        Parse code-style item.
-
-        cur_index: int. Is set to be a "previous line number"
-        """
-
-        text = ""
-        while (lines[cur_index][prefix:] == ""
-               or lines[cur_index][prefix:][-1] != "$"):
-            text += lines[cur_index][prefix:] + "\n"
-            prefix = 0
-            cur_index += 1
-
-        return text, cur_index + 1
+    @staticmethod
+    def parse_code(rows: list):
+        """Parse code-style item from the lines between `$` delimiters."""
+        if len(rows) == 0:
+            return ""
+        return "\n".join(rows) + "\n"
 
-    def parse_table(self, lines: list, cur_index: int, prefix: int):
+    @staticmethod
+    def parse_table(rows: list):
         """
-        Parse table-style item.
-
-        Parameters
-        ----------
-        cur_index: int. Is set to be a "previous line number"
+        Parse table-style item from the lines between `{` and `}` into a SavTable.
+        Fall back to the list of lines if it is not a regular csv table.
         """
+        table = SavTable.from_rows(rows)
+        if table is None:
+            return rows + [""]
+        return table
 
-        text = ""
-        while (lines[cur_index][prefix:][-1] != "}"):
-            text += lines[cur_index][prefix:] + "\n"
-            prefix = 0
-            cur_index += 1
-        try:
-            table = pd.read_csv(StringIO(text))
-        except pd.errors.ParserError:
-            table = text.split("\n")
-        return table, cur_index+1
-
-    def parse_basic(self, lines: list, cur_index: int, prefix: int):
+    @staticmethod
+    def parse_basic(value: str):
         """
         Parse simple items.
         (one-liner of csv format, no tables, no codes)
@@ -188,44 +341,89 @@ class SavParser:
         into
             [('"', 'Workers'), ('', '12'), ('', 'FALSE'), ('"', 'Great Library')]
         """
-        line = lines[cur_index][prefix:]
-        return re.findall(
-            R"""(?:^|,)(?=[^"]|(")?)"?((?(1)[^"]*|[^,"]*))"?(?=,|$)""",
-            line), cur_index + 1
+        # most of the values are a single bare or quoted field
+        if '"' not in value:
+            if "," not in value:
+                return [("", value)]
+        elif value[0] == '"' and value[-1] == '"' and value.count('"') == 2:
+            return [('"', value[1:-1])]
+        return CSV_PATTERN.findall(value)
 
-    def parse_line(self, lines: list, cur_index: int, prefix: int):
+    def get(self, key):
+        """Get data by key."""
+        if key not in self.tags and self.lazy:
+            return self._load(key)
+        return self.tags[key]
+
+    @staticmethod
+    def parse_many(paths, workers: int = 1, select: list = None, chunksize: int = 16):
         """
+        Parse many sav files with a pool of processes, yielding a result per file in the
+        order of paths. At most two chunks per worker are in flight, so memory stays
+        bounded for any number of paths.
 
+        select: names of the sections to return. A compact summary is returned if None.
+        Each result is a dict with "filename", "error" (None, or the error of this file) and
+        either the selected "sections" or the summary "size", "turn", "players" and "sections".
         """
-        # print("PARSE_LINE", lines)
-        if lines[cur_index][prefix] == "$":
-            return self.parse_code(lines, cur_index, prefix + 1)
-        if lines[cur_index][prefix] == "{":
-            return self.parse_table(lines, cur_index, prefix + 1)
+        chunks = SavParser._chunk(paths, chunksize)
+        if workers <= 1:
+            for chunk in chunks:
+                yield from SavParser._parse_chunk(chunk, select)
+            return
+        # the chunks in flight, by the order of paths
+        inflight = collections.deque()
+        with multiprocessing.Pool(workers) as pool:
+            for chunk in chunks:
+                inflight.append((chunk, pool.apply_async(SavParser._parse_chunk, (chunk, select))))
+                if len(inflight) >= 2 * workers:
+                    yield from SavParser._wait_chunk(*inflight.popleft())
+            while len(inflight) > 0:
+                yield from SavParser._wait_chunk(*inflight.popleft())
 
-        return self.parse_basic(lines, cur_index, prefix)
+    @staticmethod
+    def _wait_chunk(chunk: list, result):
+        """Results of a chunk, an error per file if its worker failed."""
+        try:
+            return result.get()
+        except Exception as error:
+            return [{"filename": filename, "error": repr(error)} for filename in chunk]
 
-    def parse_tag(self, key: str):
-        """
-        """
-        lines = self.tags[key][RAW_REPRE]
-        cur_index = 0
-        while cur_index < len(lines):
-            if len(lines[cur_index].strip()) == 0:
-                cur_index += 1
-                continue
-            result, name, prefix = self.def_cond(lines[cur_index])
+    @staticmethod
+    def _chunk(paths, chunksize: int):
+        chunk = list()
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = list()
+        if len(chunk) > 0:
+            yield chunk
 
-            if result:
-                # print(name)
-                data, cur_index = self.parse_line(lines, cur_index, prefix)
-                self.tags[key][name] = data
-            else:
-                cur_index += 1
+    @staticmethod
+    def _parse_chunk(chunk: list, select: list = None):
+        output = list()
+        for filename in chunk:
+            result = {"filename": filename, "error": None}
+            try:
+                sav_parser = SavParser(filename, lazy=True)
+                if select is None:
+                    result.update({"size": os.path.getsize(filename),
+                                   "turn": int(ParseTypeBean.get_realvalue(sav_parser.get("game")["turn"])),
+                                   "players": list(sav_parser.players),
+                                   "sections": sav_parser.get_tag_names()})
+                else:
+                    result["sections"] = {name: sav_parser.get(name) for name in select if name in sav_parser.offsets}
+            except Exception as error:
+                result["error"] = f"{type(error).__name__}: {error}"
+            output.append(result)
+        return output
 
-    def get(self, key):
-        """Get data by key."""
-        return self.tags[key]
+    def get_tag_names(self):
+        """Names of all sections in the file, parsed or not."""
+        if self.lazy:
+            return list(self.offsets.keys())
+        return list(self.tags.keys())
     
     def get_game_map(self, tag_name: str = "", prefix: str = None):
         """
@@ -234,18 +432,18 @@ class SavParser:
         If prefix is None, then get available map names from tag_name.
         Otherwise, get the map itself.
         """
+        tag_names = self.get_tag_names()
         if prefix is None:
-            search_base = ({tag_name: self.tags[tag_name]}
-                           if tag_name in self.tags else self.tags)
+            search_base = [tag_name] if tag_name in tag_names else tag_names
             prefix_available = {}
-            for name, tag in search_base.items():
-                if len(prefix_list := [item[:-4] for item in tag.keys() if item[-4:] == "0000"]) > 0:
+            for name in search_base:
+                if len(prefix_list := [item[:-4] for item in self.get(name).keys() if item[-4:] == "0000"]) > 0:
                     prefix_available[name] = prefix_list
             return prefix_available
 
-        assert tag_name in self.tags
+        assert tag_name in tag_names
 
-        tag = self.tags[tag_name]
+        tag = self.get(tag_name)
         assert prefix+"0000" in tag
 
         line_names = sorted([name for name in tag.keys() if prefix==name[:-4]])
@@ -256,12 +454,34 @@ class SavParser:
         data = [method(tag[x][0][1]) for x in line_names]
         return data
 
+    def get_map_array(self, prefix: str, tag: str = "map"):
+        """
+        Decode the rows `prefix####` of a section into a 2-d array of shape (ysize, xsize).
+
+        Rows of characters, like `t####`, `k00_####`, `e00_####` and `map_t####`, give
+        their ascii codes as uint8. Comma-separated rows, like `owner####` and `worked####`,
+        give int32 with -1 for the empty tiles `-`.
+        FormatTypeBean.line_from_map_array encodes the array back to sav rows.
+        """
+        section = self.get(tag)
+        rows = list()
+        while (row := section.get(f"{prefix}{len(rows):04d}")) is not None:
+            rows.append(row[0][1])
+        if len(rows) == 0:
+            raise KeyError(f"No map rows {prefix}#### in [{tag}]!")
+        if "," not in rows[0]:
+            data = "".join(rows).encode("ascii")
+            return np.frombuffer(data, dtype=np.uint8).reshape(len(rows), -1).copy()
+        # the worked rows end with a separator
+        text = ",".join(row.rstrip(",") for row in rows).replace(EMPTY_TILE, "-1")
+        return np.array(text.split(","), dtype=np.int32).reshape(len(rows), -1)
+
     def get_map_abbr_dict(self):
-        terrident = self.tags["savefile"]["terrident"].copy()
-        terrident["name"] = terrident["name"].str.lower()
+        terrident = self.get("savefile")["terrident"]
+        names = [name.lower() for name in terrident["name"]]
         return {
-            "full": terrident.set_index("name").to_dict()["identifier"],
-            "abbr": terrident.set_index("identifier").to_dict()["name"]
+            "full": dict(zip(names, terrident["identifier"])),
+            "abbr": dict(zip(terrident["identifier"], names))
         }
 
     def _get_map(self, key, feature, sep=""):
@@ -289,7 +509,9 @@ class SavParser:
         return self._get_map("map", GLOBAL_TERRAIN_SIGNAL)
 
     def get_seen_map(self):
-        return self._get_map("map", SEEN_TERRAIN_SIGNAL)
+        """Rows of every layer k00, k01... of the known map."""
+        return {key: list(ParseTypeBean.adapt_to_parser(row)) for key, row in self.get("map").items()
+                if re.match(SEEN_TERRAIN_PATTERN, key)}
 
     def get_extra_resources(self):
         map_data = self.get("map")
@@ -330,9 +552,24 @@ class SavParser:
     def get_player_unit_info(self):
         return self._get_player_inf(lambda key, row: key == UNIT_SIGNAL)
 
+    def get_setting(self, name: str, default=None):
+        """Value of a server setting of the [settings] table, default if it is not saved."""
+        settings = self.get("settings")["set"]
+        names = list(settings["name"])
+        if name not in names:
+            return default
+        return settings["value"][names.index(name)]
+
+    def get_topology(self):
+        """Topology flags of the map, like "WRAPX" or "WRAPX|ISO", "" for a flat map, None if not saved."""
+        if (topology := self.get_setting("topology")) is None:
+            return None
+        # an empty value is read as NaN
+        return topology if isinstance(topology, str) else ""
+
     def get_game_info(self):
         dic = dict()
-        for key, value in self.tags["game"].items():
+        for key, value in self.get("game").items():
             if key != "__raw__":
                 dic[key] = value
         return dic
@@ -353,15 +590,27 @@ class SavParser:
         return self._get_map("map", GLOBAL_WORKED_SIGNAL, sep=",")
     
     def get_global_techs_info(self):
-        return self.tags["research"]["r"]
+        return self.get("research")["r"]
     
+    def get_techs_done_array(self):
+        """
+        Known techs of the research table as a boolean array of shape (rows, techs),
+        in the order of the rows; the `number` column gives their players.
+        """
+        return ParseTypeBean.bits_from_strings(self.get_global_techs_info()["done"])
+
+    def get_techs_done_mask(self):
+        """Known techs of the research table as {number: int bitmask}, bit i for the i-th tech."""
+        research = self.get_global_techs_info()
+        return {number: ParseTypeBean.mask_from_bits(done) for number, done in zip(research["number"], research["done"])}
+
     def get_events(self):
-        return self.tags["event_cache"]["events"]
+        return self.get("event_cache")["events"]
 
     def get_treaty(self):
         output = dict()
-        if "treaty0" in self.tags:
-            for key, value in self.tags["treaty0"].items():
+        if "treaty0" in self.get_tag_names():
+            for key, value in self.get("treaty0").items():
                 if key != "__raw__":
                     output[key] = value
         return output
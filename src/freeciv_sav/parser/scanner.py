@@ -0,0 +1,120 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import glob
+import mmap
+import multiprocessing
+from freeciv_sav.parser.sav import SavParser, BLOCK_END_PATTERNS
+from freeciv_sav.parser.table import SavTable, NAN
+from freeciv_sav.utils.io import IOManager
+
+FILENAME_COLUMN = "filename"
+
+
+class SavScanner(object):
+    """
+    Read a few values from many sav files without parsing them.
+
+    keys: "section.key" like "game.turn", "player0.nunits" or "score0.total".
+        The key of a table, like "player0.u", gives its number of rows.
+
+    Plain files are memory-mapped; compressed ones are decompressed in memory.
+    Only the sections of the keys are searched, and only the values found are decoded.
+    """
+
+    def __init__(self, keys: list):
+        self.keys = list(keys)
+        self._targets = list()
+        for key in self.keys:
+            section, name = key.split(".", 1)
+            pattern = re.compile(rb"^[ \t]*" + re.escape(name.encode("utf-8")) + rb"=(.*?)[ \t\r]*$", re.M)
+            self._targets.append((key, section, pattern))
+        self._sections = {section for _, section, _ in self._targets}
+
+    def scan_file(self, filename: str):
+        """Values {key: value} of one file, NaN for the keys not found."""
+        if IOManager.get_codec(filename) is not None:
+            with IOManager.open_sav(filename, "rb") as filep:
+                return self._scan(filep.read())
+        with open(filename, "rb") as filep:
+            with mmap.mmap(filep.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self._scan(data)
+
+    def _scan(self, data):
+        offsets = SavParser.index_sections(data, self._sections)
+        values = dict()
+        for key, section, pattern in self._targets:
+            values[key] = NAN
+            if section not in offsets:
+                continue
+            start, end = offsets[section]
+            if (match := pattern.search(data, start, end)) is not None:
+                values[key] = SavScanner._decode(data, match)
+        return values
+
+    @staticmethod
+    def _decode(data, match):
+        value = match[1].decode("utf-8")
+        if value.startswith("{"):
+            # count the rows between the header and the closing line of a table
+            if value.endswith("}"):
+                return 0
+            if (end := BLOCK_END_PATTERNS[b"{"].search(data, match.end())) is None:
+                return NAN
+            return data[match.end()+1:end.start()].count(b"\n")
+        fields = SavParser.parse_basic(value)
+        if len(fields) == 1:
+            return SavScanner._convert(fields[0])
+        return [SavScanner._convert(field) for field in fields]
+
+    @staticmethod
+    def _convert(field):
+        quote, value = field
+        if quote != "":
+            return value
+        return SavTable._convert([value])[0]
+
+    def scan(self, filenames: list, workers: int = 1, chunksize: int = 64):
+        """
+        Scan many files with a pool of workers.
+        Return a SavTable with the filename and a column per key.
+        """
+        filenames = list(filenames)
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                rows = pool.map(self.scan_file, filenames, chunksize=chunksize)
+        else:
+            rows = [self.scan_file(filename) for filename in filenames]
+        table = SavTable([FILENAME_COLUMN]+self.keys)
+        table[FILENAME_COLUMN] = filenames
+        for key in self.keys:
+            table[key] = [row[key] for row in rows]
+        return table
+
+    def scan_tree(self, root: str, workers: int = 1):
+        """Scan all the sav files under root, like tests/minitasks/<user>/."""
+        filenames = sorted(glob.glob(os.path.join(root, "**", "*.sav*"), recursive=True))
+        return self.scan(filenames, workers=workers)
+
+
+if __name__ == "__main__":
+    from sys import argv
+    root = argv[1] if len(argv) > 1 else "tests/minitasks/base/"
+    scanner = SavScanner(["game.turn", "player0.nunits", "player0.ncities", "player0.u", "player0.c", "score0.total"])
+    result = scanner.scan_tree(root, workers=os.cpu_count())
+    for row in result.to_dict(orient="records"):
+        print(row)
@@ -0,0 +1,188 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import copy
+
+# default missing values of pandas.read_csv
+NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+             "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "n/a", "nan", "null"}
+TRUE_VALUES = {"True", "TRUE", "true"}
+FALSE_VALUES = {"False", "FALSE", "false"}
+NAN = float("nan")
+INT_MIN, UINT_MAX = -2**63, 2**64 - 1
+
+
+class _TableAt(object):
+    """Get and set a single value by `table.at[index, column]`."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, key):
+        index, column = key
+        return self._table.data[column][index]
+
+    def __setitem__(self, key, value):
+        index, column = key
+        self._table.data[column][index] = value
+
+
+class SavTable(object):
+    """
+    Column-oriented table of sav files, like the `u=`, `c=` and `r=` tables.
+
+    Columns are typed lists as pandas.read_csv would type them: int, float,
+    bool or str, with float("nan") for missing values. Rows are indexed by
+    position. `shape`, `at`, `iterrows` and `to_dict` follow pandas, and a
+    DataFrame is only built by `to_dataframe`.
+    """
+
+    def __init__(self, columns: list, data: dict = None):
+        self.columns = list(columns)
+        self.data = {column: [] for column in self.columns} if data is None else data
+
+    def __len__(self):
+        return len(self.data[self.columns[0]]) if len(self.columns) > 0 else 0
+
+    def __getitem__(self, column: str):
+        return self.data[column]
+
+    def __setitem__(self, column: str, values: list):
+        if column not in self.data:
+            self.columns.append(column)
+        self.data[column] = list(values)
+
+    def __repr__(self):
+        return f"SavTable(columns={self.columns}, rows={len(self)})"
+
+    @property
+    def shape(self):
+        return len(self), len(self.columns)
+
+    @property
+    def at(self):
+        return _TableAt(self)
+
+    @staticmethod
+    def from_rows(rows: list):
+        """
+        Parse the lines between `{` and `}` of a table, header first.
+        Return None if it is not a regular csv table.
+        """
+        reader = csv.reader(rows)
+        header = next(reader, None)
+        if header is None:
+            return None
+        columns = SavTable._mangle(header)
+        records = list(reader)
+        width = len(columns)
+        for record in records:
+            if len(record) > width:
+                return None
+            if len(record) < width:
+                record.extend([""] * (width - len(record)))
+        values = zip(*records) if len(records) > 0 else [()] * width
+        return SavTable(columns, {column: SavTable._convert(value) for column, value in zip(columns, values)})
+
+    @staticmethod
+    def from_dataframe(df):
+        return SavTable(list(df.columns), {column: df[column].tolist() for column in df.columns})
+
+    @staticmethod
+    def adapt(table):
+        """Convert a pandas.DataFrame to SavTable, leave other values as they are."""
+        if hasattr(table, "iterrows") and not isinstance(table, SavTable):
+            return SavTable.from_dataframe(table)
+        return table
+
+    @staticmethod
+    def _mangle(header: list):
+        """Name the empty and duplicated columns as pandas does."""
+        columns = list()
+        for i, column in enumerate(header):
+            if column == "":
+                column = f"Unnamed: {i}"
+            name, cnt = column, 0
+            while name in columns:
+                cnt += 1
+                name = f"{column}.{cnt}"
+            columns.append(name)
+        return columns
+
+    @staticmethod
+    def _convert(values):
+        """Type a column of strings, like pandas.read_csv."""
+        missing = [value in NA_VALUES for value in values]
+        has_missing = True in missing
+        try:
+            column = [NAN if miss else int(value) for value, miss in zip(values, missing)]
+            # integers out of 64 bits stay strings, like the "done" vectors of research
+            if all(miss or INT_MIN <= value <= UINT_MAX for value, miss in zip(column, missing)):
+                return [float(value) for value in column] if has_missing else column
+        except ValueError:
+            try:
+                return [NAN if miss else float(value) for value, miss in zip(values, missing)]
+            except ValueError:
+                pass
+        if all(miss or value in TRUE_VALUES or value in FALSE_VALUES for value, miss in zip(values, missing)):
+            return [NAN if miss else value in TRUE_VALUES for value, miss in zip(values, missing)]
+        return [NAN if miss else value for value, miss in zip(values, missing)]
+
+    def iterrows(self):
+        """Yield (index, row dict) pairs."""
+        for index, values in enumerate(zip(*[self.data[column] for column in self.columns])):
+            yield index, dict(zip(self.columns, values))
+
+    def to_dict(self, orient: str = "list"):
+        """
+        orient: "list" for {column: values}, "records" for [{column: value}],
+            "split" for {"index", "columns", "data"}.
+        """
+        if orient == "list":
+            return {column: list(self.data[column]) for column in self.columns}
+        if orient in ("records", "record"):
+            return [row for _, row in self.iterrows()]
+        if orient == "split":
+            return {"index": list(range(len(self))),
+                    "columns": list(self.columns),
+                    "data": [list(values) for values in zip(*[self.data[column] for column in self.columns])]}
+        raise ValueError(f"Unsupported orient {orient}!")
+
+    def add_row(self, record: dict):
+        """Append a row in place, missing columns are set as NaN."""
+        for column in self.columns:
+            self.data[column].append(record.get(column, NAN))
+        return
+
+    def drop_rows(self, indexes: list):
+        """Remove the rows at the given positions in place."""
+        dropped = set(indexes)
+        for column in self.columns:
+            self.data[column] = [value for index, value in enumerate(self.data[column]) if index not in dropped]
+        return
+
+    def copy(self):
+        return SavTable(self.columns, copy.deepcopy(self.data))
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({column: self.data[column] for column in self.columns}, columns=self.columns)
+
+
+if __name__ == "__main__":
+    table = SavTable.from_rows(['"id","x","y","name","done"', '1,2,3,"Warriors",TRUE', '2,4,,"Settlers",FALSE'])
+    print(table, table.to_dict(orient="records"))
+    print(table.to_dataframe().dtypes)
@@ -0,0 +1,390 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import time
+import shutil
+import tempfile
+from sys import argv
+from freeciv_sav.parser.sav import SavParser, SavTokenizer
+from freeciv_sav.parser.scanner import SavScanner
+from freeciv_sav.parser.ruleset import RulesetParser, RulesetTokenizer, glob_dir
+from freeciv_sav.components.research import ResearchTool
+from freeciv_sav.components.unit import UnitTool
+from freeciv_sav.components.map import MapTool, YieldGrid
+from freeciv_sav.components.city import CityTool
+from freeciv_sav.components.topology import Topology
+from freeciv_sav.components.terrain import TerrainTool
+from freeciv_sav.components.resource import ResourceTool
+from freeciv_sav.utils.dic_tools import exchange_key, exchange_key_value
+from freeciv_sav.utils.cache import ParseCache
+from freeciv_sav.utils.io import IOManager, SAV_CODECS, zstandard
+
+BASE_SAV_PATTERN = "tests/minitasks/base/*.sav"
+RULESET_DIR = "src/freeciv_sav/config/classic/"
+WEIGHT = {"food": 0.4, "shield": 0.4, "trade": 0.2}
+
+
+class Benchmark(object):
+    """
+    Timing of the sav toolkit on the base saves.
+
+    Run from the root of the repository:
+        python src/freeciv_sav/tasks/benchmark.py {parser,lazy,codecs,map,scanner,cache,ruleset,ruleset_query,research,units,yields,walk,many} [rounds]
+    """
+
+    def __init__(self, pattern:str=BASE_SAV_PATTERN, rounds:int=10):
+        self.files = sorted(glob.glob(pattern))
+        if len(self.files) == 0:
+            raise ValueError(f"No sav file matches {pattern}!")
+        self.rounds = rounds
+        self.size = sum(os.path.getsize(filename) for filename in self.files)
+
+    def _timeit(self, func, files=None):
+        """Throughput is counted on the size of the plain saves."""
+        files = self.files if files is None else files
+        # warm up imports and file cache
+        for filename in files:
+            func(filename)
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            for filename in files:
+                func(filename)
+        cost = (time.perf_counter() - start) / self.rounds
+        return {"ms_per_file": round(cost / len(files) * 1000, 3),
+                "mb_per_sec": round(self.size / cost / 2**20, 3)}
+
+    @staticmethod
+    def _tokenize(filename):
+        with IOManager.open_sav(filename) as filep:
+            for _ in SavTokenizer(tmp for line in filep if (tmp := line.strip()) != ""):
+                pass
+        return
+
+    def bench_parser(self):
+        """Time the tokenizer alone and the full SavParser."""
+        return {"files": len(self.files),
+                "tokenize": self._timeit(Benchmark._tokenize),
+                "parse": self._timeit(SavParser)}
+
+    @staticmethod
+    def _tradetech(filename, lazy=False):
+        sav_parser = SavParser(filename, lazy=lazy)
+        sav_parser.get_global_techs_info()
+        sav_parser.get_players_info()
+        sav_parser.get_events()
+        sav_parser.get_treaty()
+        return
+
+    def bench_lazy(self):
+        """Time the sections read by the tradetech task, eager against lazy parsing."""
+        return {"files": len(self.files),
+                "index": self._timeit(lambda filename: SavParser(filename, lazy=True)),
+                "eager": self._timeit(Benchmark._tradetech),
+                "lazy": self._timeit(lambda filename: Benchmark._tradetech(filename, lazy=True))}
+
+    @staticmethod
+    def _read(filename):
+        with IOManager.open_sav(filename, "rb") as filep:
+            filep.read()
+        return
+
+    def bench_codecs(self):
+        """Time writing, reading and tokenizing the saves with every compression codec."""
+        output = {"files": len(self.files)}
+        contents = dict()
+        for filename in self.files:
+            with open(filename, "r", encoding="utf-8") as filep:
+                contents[filename] = filep.read()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for codec in [""] + list(SAV_CODECS):
+                if codec == ".zst" and zstandard is None:
+                    output[codec] = "zstandard is not installed"
+                    continue
+                targets = {filename: os.path.join(tmp_dir, os.path.basename(filename)+codec) for filename in self.files}
+                def write(filename):
+                    with IOManager.get_handler(targets[filename]) as filep:
+                        filep.write(contents[filename])
+                write_cost = self._timeit(write)
+                files = list(targets.values())
+                output[codec or "plain"] = {
+                    "ratio": round(self.size / sum(os.path.getsize(target) for target in files), 3),
+                    "write": write_cost,
+                    "read": self._timeit(Benchmark._read, files),
+                    "tokenize": self._timeit(Benchmark._tokenize, files)}
+        finally:
+            shutil.rmtree(tmp_dir)
+        return output
+
+    def bench_map(self):
+        """
+        Time decoding the terrain, extras and ownership layers of [map] as lists and as arrays,
+        and the extras layers packed into one bitmask per tile.
+        """
+        prefixes = ["t", "k00_", "owner", "eowner", "source", "worked"] + [f"e{i:02d}_" for i in range(9)]
+        parsers = [SavParser(filename) for filename in self.files]
+        def as_lists(parser):
+            for prefix in prefixes:
+                parser.get_game_map("map", prefix)
+        def as_arrays(parser):
+            for prefix in prefixes:
+                parser.get_map_array(prefix)
+        def packed(parser):
+            ResourceTool.pack_extras({f"e{i:02d}": parser.get_map_array(f"e{i:02d}_") for i in range(9)})
+        return {"files": len(self.files),
+                "lists": self._timeit(as_lists, parsers),
+                "arrays": self._timeit(as_arrays, parsers),
+                "packed": self._timeit(packed, parsers)}
+
+    def bench_scanner(self, count:int=10000, workers:int=None):
+        """
+        Read the keys of a corpus analysis from `count` saves linked to the base saves,
+        with a SavParser per file and with the SavScanner.
+        """
+        keys = ["game.turn", "player0.nunits", "player0.ncities", "player0.u", "player0.c", "score0.total"]
+        workers = os.cpu_count() if workers is None else workers
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            corpus = list()
+            for i in range(count):
+                filename = self.files[i % len(self.files)]
+                corpus.append(os.path.join(tmp_dir, f"{i:05d}_"+os.path.basename(filename)))
+                os.link(os.path.abspath(filename), corpus[-1])
+            size = sum(os.path.getsize(filename) for filename in corpus)
+            def parse(filename):
+                sav_parser = SavParser(filename, lazy=True)
+                for key in keys:
+                    section, name = key.split(".", 1)
+                    sav_parser.get(section).get(name)
+            # the full parse is timed on a sample and scaled up
+            sample = corpus[:max(count // 20, 1)]
+            start = time.perf_counter()
+            for filename in sample:
+                SavParser(filename)
+            full_cost = (time.perf_counter() - start) * count / len(sample)
+            start = time.perf_counter()
+            for filename in sample:
+                parse(filename)
+            lazy_cost = (time.perf_counter() - start) * count / len(sample)
+            scanner = SavScanner(keys)
+            start = time.perf_counter()
+            scanner.scan(corpus)
+            scan_cost = time.perf_counter() - start
+            start = time.perf_counter()
+            scanner.scan(corpus, workers=workers)
+            pool_cost = time.perf_counter() - start
+        finally:
+            shutil.rmtree(tmp_dir)
+        return {"files": count, "workers": workers,
+                **{name: {"seconds": round(cost, 3), "mb_per_sec": round(size / cost / 2**20, 3)}
+                   for name, cost in [("parse", full_cost), ("lazy_parse", lazy_cost),
+                                      ("scan", scan_cost), ("scan_pool", pool_cost)]}}
+
+    def bench_cache(self):
+        """Time the parsing done by a task generator: the template and the ruleset, parsed or cached."""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache = ParseCache(tmp_dir)
+            def parse(filename):
+                SavParser(filename)
+                RulesetParser(RULESET_DIR)
+            def load(filename):
+                cache.load_sav(filename)
+                cache.load_ruleset(RULESET_DIR)
+            return {"files": len(self.files),
+                    "parse": self._timeit(parse),
+                    "cache": self._timeit(load)}
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @staticmethod
+    def _tokenize_ruleset(ruleset_dir):
+        for filename in glob_dir(ruleset_dir):
+            with open(filename, "r", encoding="utf-8") as filep:
+                for _ in RulesetTokenizer(filep.read(), filename):
+                    pass
+        return
+
+    def bench_ruleset(self):
+        """
+        Time tokenizing and parsing the ruleset, then parsing and building its derived tables,
+        against loading the compiled cache.
+        """
+        rule_parser = RulesetParser(RULESET_DIR)
+        getters = ["get_terrain_resource", "get_terrain_extra", "get_extra_conflicts", "get_resource_conf",
+                   "get_vision_radius_sq", "get_tech_tree", "get_unit_obsolete"]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache = ParseCache(tmp_dir)
+            def query(rule_parser):
+                for getter in getters:
+                    getattr(rule_parser, getter)()
+            return {"sections": sum(len(sections) for sections in rule_parser.data.values()),
+                    "entries": sum(len(entries) for sections in rule_parser.data.values() for entries in sections.values()),
+                    "tokenize": self._timeit(lambda _: Benchmark._tokenize_ruleset(RULESET_DIR), self.files[:1]),
+                    "parse_only": self._timeit(lambda _: RulesetParser(RULESET_DIR), self.files[:1]),
+                    "parse": self._timeit(lambda _: query(RulesetParser(RULESET_DIR)), self.files[:1]),
+                    "compiled": self._timeit(lambda _: query(cache.load_ruleset(RULESET_DIR)), self.files[:1]),
+                    "bytes": sum(os.path.getsize(filename) for filename in glob.glob(os.path.join(tmp_dir, "*.pkl")))}
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def bench_ruleset_query(self):
+        """Time the ruleset lookups of the task generators on a parsed ruleset, in microseconds per call."""
+        rule_parser = RulesetParser(RULESET_DIR)
+        queries = {
+            "get_properties": lambda: rule_parser.get_properties("terrain", "terrain", ["food", "shield", "trade"]),
+            "get_properties_quo": lambda: rule_parser.get_properties("techs", "advance", ["req1", "req2"],
+                                                                     value_type="quo", lower=True),
+            "get_value": lambda: rule_parser.get_value(["terrain", "terrain_ocean"], "__value__"),
+            "search": lambda: rule_parser.search("forest", fetch_key="__value__")}
+        output = dict()
+        for name, query in queries.items():
+            query()
+            start = time.perf_counter()
+            for _ in range(self.rounds):
+                query()
+            output[name] = round((time.perf_counter() - start) / self.rounds * 1e6, 3)
+        return output
+
+    def bench_research(self):
+        """Time the tech random walk of the research task, and the tech queries on the compiled tech tree."""
+        techs_conf = RulesetParser(RULESET_DIR).get_tech_tree()
+        techs_data = {filename: SavParser(filename).get_global_techs_info() for filename in self.files}
+        def walk(filename):
+            ResearchTool(techs_data[filename], techs_conf).random_walk(max_walks=5, verbose=False)
+        def query(filename):
+            research_tool = ResearchTool(techs_data[filename], techs_conf)
+            research_tool.get_techs_cost()
+            research_tool.get_techs_frontier()
+        return {"files": len(self.files),
+                "techs": len(techs_conf["tree"].names),
+                "random_walk": self._timeit(walk),
+                "cost_frontier": self._timeit(query)}
+
+    def bench_units(self):
+        """
+        Time the unit counts and locations of the task generators, the unit columns of all players,
+        and the placement of the unit clusters on the land and ocean locations.
+        """
+        rule_parser = RulesetParser(RULESET_DIR)
+        unit_obsolete_conf, unit_types = rule_parser.get_unit_obsolete(), rule_parser.get_unit_types()
+        unit_tools = {filename: UnitTool(SavParser(filename).get_player_unit_info(), unit_obsolete_conf, unit_types)
+                      for filename in self.files}
+        map_tools = {filename: Benchmark._map_tool(filename, rule_parser) for filename in self.files}
+        locations = {filename: (map_tool.get_unit_accessible_locations(connectivity=True), map_tool.get_unit_accessible_locations(is_ocean=True))
+                     for filename, map_tool in map_tools.items()}
+        def counts(filename):
+            unit_tools[filename].get_combat_unit_cnt()
+            unit_tools[filename].get_unit_cluster_cnt()
+        def clusters(filename):
+            land_locations, ocean_locations = locations[filename]
+            map_tools[filename].get_unit_clusters(land_locations, unit_tools[filename].get_unit_cluster_cnt(), 2, [5, 20],
+                                                  ocean_locations=ocean_locations)
+        return {"files": len(self.files),
+                "unit_types": len(unit_types),
+                "counts": self._timeit(counts),
+                "location": self._timeit(lambda filename: unit_tools[filename].get_location()),
+                "arrays": self._timeit(lambda filename: unit_tools[filename].get_unit_arrays()),
+                "clusters": self._timeit(clusters)}
+
+    @staticmethod
+    def _map_tool(filename, rule_parser):
+        """MapTool of a sav file, built like the task generator does."""
+        tid_conf, rid_conf = TerrainTool.get_tid(), ResourceTool.get_rid()
+        sav_parser = SavParser(filename)
+        return MapTool(raw_data=sav_parser.get_global_map(),
+                       player_map_data=sav_parser.get_players_map(),
+                       player_resource_data=sav_parser.get_players_resource(),
+                       seen_map=sav_parser.get_seen_map(),
+                       terrain_fpt_conf=exchange_key(rule_parser.get_properties("terrain", "terrain", ["food", "shield", "trade"]), tid_conf),
+                       resource_fpt_conf=exchange_key(rule_parser.get_resource_conf(), rid_conf),
+                       terrain_resource_conf=exchange_key_value(rule_parser.get_terrain_resource(), dict(tid_conf, **rid_conf)),
+                       extra_resources=ResourceTool.exchagne_rawdata(sav_parser.get_extra_resources()),
+                       topology=Topology.from_sav(sav_parser).topology)
+
+    def bench_yields(self):
+        """
+        Time building the yield grid of a map, then scoring the city scope of every tile on it
+        one by one, and all at once like statis_map, and the city scores kept under tile edits.
+        """
+        rule_parser = RulesetParser(RULESET_DIR)
+        map_tools = {filename: Benchmark._map_tool(filename, rule_parser) for filename in self.files}
+        def build(filename):
+            map_tool = map_tools[filename]
+            YieldGrid(map_tool._global_map, map_tool._extras, map_tool.terrain_fpt_conf, map_tool.resource_fpt_conf,
+                      map_tool.topology).get_scores(WEIGHT)
+        def scopes(filename):
+            map_tool = map_tools[filename]
+            for x in range(map_tool.xsize):
+                for y in range(map_tool.ysize):
+                    map_tool.calulate_map_properties_by_order(CityTool.cal_city_scope_with_loop(x, y, map_tool.xsize, map_tool.ysize, map_tool.topology),
+                                                              topk=6, weight=WEIGHT)
+        def topk_scores(filename):
+            map_tool = map_tools[filename]
+            YieldGrid(map_tool._global_map, map_tool._extras, map_tool.terrain_fpt_conf,
+                      map_tool.resource_fpt_conf, map_tool.topology).get_city_index(CityTool.cal_city_scope(0, 0), 6, WEIGHT).scores
+        grids = {filename: map_tool.get_yield_grid() for filename, map_tool in map_tools.items()}
+        def updates(filename):
+            grid = grids[filename]
+            city_index = grid.get_city_index(CityTool.cal_city_scope(0, 0), 6, WEIGHT, keep_ocean=True)
+            for y in range(0, len(grid.terrain_map), 4):
+                grid.update(y, y)
+                city_index.get_score(y, y)
+        return {"files": len(self.files),
+                "grid": self._timeit(build),
+                "city_scopes": self._timeit(scopes),
+                "topk_scores": self._timeit(topk_scores),
+                "index_updates": self._timeit(updates)}
+
+    def bench_walk(self, batch:int=64, max_steps:int=10, max_walks:int=100):
+        """Time gen_random_walk_map map by map against gen_random_walk_maps on a batch, per generated map."""
+        map_tool = Benchmark._map_tool(self.files[0], RulesetParser(RULESET_DIR))
+        kwargs = dict(format_type="line", score_bound=[7, 10], max_steps=max_steps, max_walks=max_walks, topk=6, weight=WEIGHT)
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            map_tool.gen_random_walk_map(**kwargs)
+        single = (time.perf_counter() - start) / self.rounds
+        start = time.perf_counter()
+        map_tool.gen_random_walk_maps(batch=batch, **kwargs)
+        batched = (time.perf_counter() - start) / batch
+        return {"file": self.files[0], "batch": batch,
+                "single": {"ms_per_map": round(single * 1000, 3)},
+                "batched": {"ms_per_map": round(batched * 1000, 3)}}
+
+    def bench_many(self, repeat:int=50, workers:int=None):
+        """Time SavParser.parse_many over the base saves repeated `repeat` times."""
+        workers = os.cpu_count() if workers is None else workers
+        corpus = self.files * repeat
+        size = self.size * repeat
+        output = {"files": len(corpus), "workers": workers}
+        for name, select in [("summary", None), ("research", ["research"]),
+                             ("players", [f"player{i}" for i in range(8)])]:
+            start = time.perf_counter()
+            for _ in SavParser.parse_many(corpus, workers=workers, select=select):
+                pass
+            cost = time.perf_counter() - start
+            output[name] = {"ms_per_file": round(cost / len(corpus) * 1000, 3),
+                            "mb_per_sec": round(size / cost / 2**20, 3)}
+        return output
+
+
+if __name__ == "__main__":
+    task = argv[1] if len(argv) > 1 else "parser"
+    rounds = int(argv[2]) if len(argv) > 2 else 10
+    benchmark = Benchmark(rounds=rounds)
+    print(getattr(benchmark, "bench_"+task)())
@@ -16,6 +16,7 @@
 import glob
 from civrealm.envs.freeciv_minitask_env import MAX_ID, MinitaskDifficulty, MinitaskType
 from civrealm.freeciv.build_server import run_bash_command
+from freeciv_sav.utils.io import IOManager
 
 class Checker(object):
     def __init__(self, tmp_path, tmp_mas_path):
@@ -36,7 +37,7 @@ class Checker(object):
         print(f"ZIP SET: {zip_set}")
         for zip in zip_set:
             run_bash_command(f"unzip -o {zip} -d {self.tmp_mas_path}")
-        check_list = glob.glob(self.tmp_mas_path+"*.sav")
+        check_list = [IOManager.strip_codec(sav) for sav in glob.glob(self.tmp_mas_path+"*.sav*")]
 
         for minitask in MinitaskType.list():
             print(f"----------- checking {minitask}--------------")
@@ -53,7 +54,7 @@ class Checker(object):
     def init_task(self, name, mas_path, minitask=None, max_id=MAX_ID):
         zip_set = mas_path+f"{name}/{minitask}.zip"
         run_bash_command(f"unzip -o {zip_set} -d {self.tmp_mas_path}")
-        check_list = glob.glob(self.tmp_mas_path+"*.sav")
+        check_list = [IOManager.strip_codec(sav) for sav in glob.glob(self.tmp_mas_path+"*.sav*")]
         for level in MinitaskDifficulty.list():
             for id in range(max_id):
                 sav_name = self.tmp_mas_path+'{}_T1_task_{}_level_{}_id_{}.sav'.format(name, minitask, level, id)
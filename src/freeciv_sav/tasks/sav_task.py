@@ -20,10 +20,12 @@ from freeciv_sav.parser.ruleset import RulesetParser
 from freeciv_sav.components.map import MapTool
 from freeciv_sav.utils.dic_tools import exchange_key, exchange_key_value
 from freeciv_sav.utils.io import IOManager
+from freeciv_sav.utils.cache import ParseCache, DEFAULT_CACHE_DIR
 from freeciv_sav.components.terrain import TerrainTool
 from freeciv_sav.components.resource import ResourceTool
 from freeciv_sav.components.player import PlayerTool
 from freeciv_sav.components.city import CityTool
+from freeciv_sav.components.topology import Topology
 from freeciv_sav.bean.format_type import FormatTypeBean
 from freeciv_sav.components.unit import UnitTool
 from freeciv_sav.components.game import GameTool
@@ -35,6 +37,8 @@ from civrealm.freeciv.build_server import run_bash_command
 from sys import argv
 
 TAG_PATTERN = r"^\[([a-zA-Z0-9_]+)\]$"
+# operators built by the `_register_*` methods on first use
+OPERATORS = ("map_op", "player_op", "unit_op", "game_op", "city_op", "event_op", "research_op", "treaty_op")
 
 class SavTaskGenerator(object):
     """
@@ -42,10 +46,13 @@ class SavTaskGenerator(object):
 
     :param user_name: string, user name
     :param task_type: string, type of mini task
+    :param compression: string, suffix of the compressed output: "gz", "bz2", "xz" or "zst", None for plain text
+    :param cache_dir: string, directory of the parsed sav and ruleset cache, None to parse them every time
 
     """
     def __init__(self, user_name:str, task_type:str, task_subtype:str,
-                 max_turns:int, goal:float, pct_require:str, input_file:str, ruleset_dir:str, docker_path:str, shared_mas_path:str=None):
+                 max_turns:int, goal:float, pct_require:str, input_file:str, ruleset_dir:str, docker_path:str, shared_mas_path:str=None, compression:str=None,
+                 cache_dir:str=DEFAULT_CACHE_DIR):
         self.user_name = user_name
         self.task_type = task_type
         self.task_subtype = task_subtype
@@ -54,21 +61,34 @@ class SavTaskGenerator(object):
         self.pct_require = pct_require
         self.docker_path = docker_path
         self.shared_mas_path = shared_mas_path
-        self.sav_parser = SavParser(input_file)
-        self.rule_parser = RulesetParser(ruleset_dir)
+        self.compression = compression
+        # maps walked in advance by walk_maps, taken by the next generators
+        self.walked_maps = list()
+        if cache_dir is not None:
+            cache = ParseCache(cache_dir)
+            self.sav_parser = cache.load_sav(input_file)
+            self.rule_parser = cache.load_ruleset(ruleset_dir)
+        else:
+            self.sav_parser = SavParser(input_file, lazy=True)
+            self.rule_parser = RulesetParser(ruleset_dir)
         self._init()
 
     def _init(self):
-        self.map_op = self._register_map_op()
-        self.player_op = self._register_player_op()
-        self.unit_op = self._register_unit_op()
-        self.game_op = self._register_game_op()
-        self.city_op = self._register_city_op()
-        self.event_op = self._register_event_op()
-        self.research_op = self._register_research_op()
-        self.treaty_op = self._register_treaty_op()
+        """
+        Drop the registered operators. They are rebuilt on first use, so a task
+        only parses the sav sections its operators read.
+        """
+        for name in OPERATORS:
+            self.__dict__.pop(name, None)
         return
 
+    def __getattr__(self, name):
+        if name in OPERATORS:
+            operator = getattr(self, "_register_"+name)()
+            setattr(self, name, operator)
+            return operator
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
     def _register_event_op(self):
         print(" =======> BEGIN BUILD EVENT OPERATOR <==========")
         return EventTool(self.sav_parser.get_events())
@@ -92,7 +112,8 @@ class SavTaskGenerator(object):
                              global_owner_data=self.sav_parser.get_tiles_own_info(),
                              global_eowner_data=self.sav_parser.get_tiles_eown_info(),
                              global_source_data=self.sav_parser.get_tiles_source_info(),
-                             global_worked_data=self.sav_parser.get_tiles_worked_info())
+                             global_worked_data=self.sav_parser.get_tiles_worked_info(),
+                             topology=Topology.from_sav(self.sav_parser).topology)
 
     def _register_game_op(self):
         print(" =======> BEGIN BUILD GAME OPERATOR <==========")
@@ -100,7 +121,8 @@ class SavTaskGenerator(object):
 
     def _register_unit_op(self):
         print(" =======> BEGIN BUILD UNIT OPERATOR <==========")
-        return UnitTool(self.sav_parser.get_player_unit_info(), unit_obsolete_conf=self.rule_parser.get_unit_obsolete())
+        return UnitTool(self.sav_parser.get_player_unit_info(), unit_obsolete_conf=self.rule_parser.get_unit_obsolete(),
+                        unit_types=self.rule_parser.get_unit_types())
 
     def _register_map_op(self):
         print(" =======> BEGIN BUILD MAP OPERATOR <==========")
@@ -139,7 +161,8 @@ class SavTaskGenerator(object):
                        terrain_fpt_conf=terrain_fpt_conf,
                        resource_fpt_conf=resource_fpt_conf,
                        terrain_resource_conf=terrain_resource_conf,
-                       extra_resources=extra_resources)
+                       extra_resources=extra_resources,
+                       topology=Topology.from_sav(self.sav_parser).topology)
 
     @staticmethod
     def push_to_docker(filename:str, docker_path:str):
@@ -305,11 +328,38 @@ class SavTaskGenerator(object):
             self.gen_sav(terrain_conf, resource_conf, output_file.format(i))
         return
 
+    def walk_maps(self, batch:int, format_type:str, 
+                        score_bound:float,
+                        max_steps:int,
+                        max_walks:int,
+                        topk:int, 
+                        weight:dict,
+                        keep_ocean:bool=True):
+        """
+        Walk batch maps at once by gen_random_walk_maps, for the next calls of the generators
+        with the same parameters, and return them.
+        """
+        self.walked_maps.extend(self.map_op.gen_random_walk_maps(format_type=format_type, 
+                                                                 batch=batch,
+                                                                 score_bound=score_bound, 
+                                                                 max_steps=max_steps, 
+                                                                 max_walks=max_walks,
+                                                                 topk=topk, 
+                                                                 weight=weight,
+                                                                 keep_ocean=keep_ocean))
+        return self.walked_maps
+
+    def _gen_random_walk_map(self, **kwargs):
+        """A map of gen_random_walk_map, the next one walked in advance by walk_maps if any."""
+        if len(self.walked_maps) > 0:
+            return self.walked_maps.pop(0)
+        return self.map_op.gen_random_walk_map(**kwargs)
+
     def _get_name(self):
         return self.user_name
     
     def _format_output_file(self, output_file, difficulty, map_id):
-        return output_file.format(self.user_name, self.task_type+'_'+self.task_subtype, self.user_name, difficulty, map_id)+".sav"
+        return output_file.format(self.user_name, self.task_type+'_'+self.task_subtype, self.user_name, difficulty, map_id)+".sav"+(f".{self.compression}" if self.compression else "")
     
     def gen_build_city(self, format_type:str, 
                              score_bound:float,
@@ -322,7 +372,7 @@ class SavTaskGenerator(object):
                              keep_ocean:bool=True,
                              map_id:int=1):
         # global map & resource update
-        terrain_conf, resource_conf, report = self.map_op.gen_random_walk_map(format_type=format_type, 
+        terrain_conf, resource_conf, report = self._gen_random_walk_map(format_type=format_type, 
                                                 score_bound=score_bound, 
                                                 max_steps=max_steps, 
                                                 max_walks=max_walks,
@@ -378,7 +428,7 @@ class SavTaskGenerator(object):
                              map_id:int=1):
         while True:
             # global map & resource update
-            terrain_conf, resource_conf, _ = self.map_op.gen_random_walk_map(format_type=format_type, 
+            terrain_conf, resource_conf, _ = self._gen_random_walk_map(format_type=format_type, 
                                                     score_bound=score_bound, 
                                                     max_steps=max_steps, 
                                                     max_walks=max_walks,
@@ -437,7 +487,7 @@ class SavTaskGenerator(object):
                              map_id:int=1):
         while True:
             # global map & resource update
-            terrain_conf, resource_conf, _ = self.map_op.gen_random_walk_map(format_type=format_type, 
+            terrain_conf, resource_conf, _ = self._gen_random_walk_map(format_type=format_type, 
                                                     score_bound=score_bound, 
                                                     max_steps=max_steps, 
                                                     max_walks=max_walks,
@@ -497,7 +547,7 @@ class SavTaskGenerator(object):
                              map_id:int=1):
         while True:
             # global map & resource update
-            terrain_conf, resource_conf, _ = self.map_op.gen_random_walk_map(format_type=format_type, 
+            terrain_conf, resource_conf, _ = self._gen_random_walk_map(format_type=format_type, 
                                                     score_bound=score_bound, 
                                                     max_steps=max_steps, 
                                                     max_walks=max_walks,
@@ -585,7 +635,7 @@ class SavTaskGenerator(object):
             treaty_conf = self.treaty_op.get_format(format="line")
 
             # research update
-            if not self.research_op.random_walk(pos_depth=3, neg_depth=3, max_walks=5):
+            if not self.research_op.random_walk(pos_depth=3, neg_depth=3, max_walks=5, verbose=False):
                 self.research_op.reset()
                 continue
             research_conf = self.research_op.get_format(format="line")
@@ -617,7 +667,7 @@ class SavTaskGenerator(object):
                              map_id:int=1):
         while True:
             # global map & resource update
-            terrain_conf, resource_conf, _ = self.map_op.gen_random_walk_map(format_type=format_type, 
+            terrain_conf, resource_conf, _ = self._gen_random_walk_map(format_type=format_type, 
                                                     score_bound=score_bound, 
                                                     max_steps=max_steps, 
                                                     max_walks=max_walks,
@@ -680,19 +730,20 @@ class SavTaskGenerator(object):
                              map_id:int=1):
         while True:
             # init parameters
-            rotation = random.choice([0, np.pi, np.pi*1.5])
+            # the quarter turns keep the size of the square maps only
+            rotation = random.choice([0, np.pi, np.pi*1.5] if self.map_op.xsize == self.map_op.ysize else [0, np.pi])
 
             # global map & resource update
-            terrain_conf, resource_conf, _ = self.map_op.gen_rotation_shift_map(format_type=format_type, rotation=rotation)
+            terrain_conf, resource_conf, map_transform = self.map_op.gen_rotation_shift_map(format_type=format_type, rotation=rotation)
 
             # unit update
-            self.unit_op.rotation_location(rotation, xsize=self.map_op.xsize, ysize=self.map_op.ysize)
+            self.unit_op.transform_location(map_transform)
             self.unit_op.set_unit_number()
             unit_locations = self.unit_op.get_location()
             unit_conf = self.unit_op.get_conf()
 
             # city update
-            self.city_op.rotation_location(rotation)
+            self.city_op.transform_location(map_transform)
             city_location = self.city_op.get_location()
             city_conf = self.city_op.get_player_city_data()
             print(self.city_op.get_city_map_data())
@@ -739,7 +790,7 @@ class SavTaskGenerator(object):
                              map_id:int=1):
         while True:
             # global map & resource update
-            terrain_conf, resource_conf, _ = self.map_op.gen_random_walk_map(format_type=format_type, 
+            terrain_conf, resource_conf, _ = self._gen_random_walk_map(format_type=format_type, 
                                                     score_bound=score_bound, 
                                                     max_steps=max_steps, 
                                                     max_walks=max_walks,
@@ -813,6 +864,7 @@ if __name__ == "__main__":
     map_cnt = int(argv[2])
     docker_image = argv[3]
     control_list = argv[4].split(",")
+    compression = argv[5] if len(argv) > 5 and argv[5] != "" else None
 
     shared_mas_path = None
     docker_path = "{}:/var/lib/tomcat10/webapps/data/savegames/{}/".format(docker_image, user_name)
@@ -823,10 +875,13 @@ if __name__ == "__main__":
     max_steps = 100
     max_walks = 200
     topk = 6
+    # maps of a task and difficulty walked at once, for the tasks on random walk maps
+    walk_batch = 32
+    walk_subtypes = ("build_city", "ancient_era", "modern_era", "industry_era", "info_era", "medieval", 
+                     "naval", "naval_modern", "attack_city", "defend_city", "citytile_wonder", "build_infra")
 
-    def func(params):
-        user_name, task, difficulty, map_id = params["user_name"], params["task"], params["difficulty"], params["map_id"]
-        sav_manager = SavTaskGenerator(
+    def get_generator(user_name, task):
+        return SavTaskGenerator(
             user_name=user_name,
             task_type=task["type"],
             task_subtype=task["subtype"],
@@ -836,7 +891,14 @@ if __name__ == "__main__":
             input_file=task["input_file"],
             ruleset_dir=ruleset_dir, 
             docker_path=docker_path,
-            shared_mas_path=shared_mas_path)
+            shared_mas_path=shared_mas_path,
+            compression=compression)
+
+    def func(params, walked_maps=None):
+        user_name, task, difficulty, map_id = params["user_name"], params["task"], params["difficulty"], params["map_id"]
+        sav_manager = get_generator(user_name, task)
+        if walked_maps is not None:
+            sav_manager.walked_maps = walked_maps
 
         if task["subtype"] == "build_city":
             sav_manager.gen_build_city(format_type=format_type, 
@@ -928,6 +990,24 @@ if __name__ == "__main__":
                                     )
         return
 
+    def func_batch(params_batch):
+        """Walk the maps of a batch of the same task and difficulty at once, then generate their tasks one by one."""
+        user_name, task, difficulty = params_batch[0]["user_name"], params_batch[0]["task"], params_batch[0]["difficulty"]
+        if task["subtype"] not in walk_subtypes:
+            for params in params_batch:
+                func(params)
+            return
+        walked_maps = get_generator(user_name, task).walk_maps(len(params_batch), format_type=format_type, 
+                                    score_bound=difficulty["score_bound"] if task["subtype"] == "build_city" else [-1, 100], 
+                                    max_steps=max_steps, 
+                                    max_walks=max_walks,
+                                    topk=topk, 
+                                    weight=weight,
+                                    keep_ocean=True)
+        for params, walked_map in zip(params_batch, walked_maps):
+            func(params, [walked_map])
+        return
+
     from freeciv_sav.tasks.checker import Checker
     params_list = list()
 
@@ -942,12 +1022,27 @@ if __name__ == "__main__":
                             params_list.append({"task": task, "difficulty": difficulty, "map_id": map_id, "user_name": user_name})
                     else:
                         params_list.append({"task": task, "difficulty": difficulty, "map_id": map_id, "user_name": user_name})
+    # the maps of the same task and difficulty, by batches of walk_batch
+    batches = list()
+    for params in params_list:
+        if len(batches) > 0 and len(batches[-1]) < walk_batch and \
+            batches[-1][0]["task"] is params["task"] and batches[-1][0]["difficulty"] is params["difficulty"]:
+            batches[-1].append(params)
+        else:
+            batches.append([params])
+
+    # parse the ruleset and every template once, the generators load them from the cache
+    cache = ParseCache()
+    cache.load_ruleset(ruleset_dir)
+    for input_file in {param["task"]["input_file"] for param in params_list}:
+        cache.load_sav(input_file)
+
     if "online" in control_list:
         pool = multiprocessing.Pool(50)
-        res = pool.map(func, params_list)
+        res = pool.map(func_batch, batches)
         pool.close()
         pool.join()
     else:
-        for param in params_list:
-            func(param)
+        for params_batch in batches:
+            func_batch(params_batch)
         print(f"FINISHED {len(params_list)} TASKS!")
@@ -0,0 +1,142 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+from freeciv_sav.parser import sav, table, ruleset
+from freeciv_sav.parser.sav import SavParser, SAV_PARSER_VERSION
+from freeciv_sav.parser.ruleset import RulesetParser, glob_dir, RULESET_VERSION, TECH_COSTS_FILE
+
+# bump to drop the cache files written by older parsers
+CACHE_VERSION = 1
+# pickled entries kept in memory per process, the least recently used are dropped
+CACHE_MAX_ENTRIES = 32
+# sources of the pickled parsers, so that editing them gives new entries
+SAV_SOURCES = [sav.__file__, table.__file__]
+RULESET_SOURCES = [ruleset.__file__]
+DEFAULT_CACHE_DIR = os.environ.get("FREECIV_SAV_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "freeciv_sav"))
+
+
+class ParseCache(object):
+    """
+    Persistent cache of parsed files, like the sav templates and the ruleset directories.
+
+    Entries are pickled into `cache_dir`, named by the builder and the content hash of
+    the source files, so editing a source gives a new entry. The keys also take the
+    version and the source code of the parsers. The hashes are kept per process while
+    the size and mtime of a file are unchanged, and the last CACHE_MAX_ENTRIES entries
+    in memory.
+    Every load unpickles a new object, as the task generators modify what they parse.
+    """
+
+    # path -> (size, mtime_ns, digest)
+    _digests = dict()
+    # cache file -> pickled bytes, by the order of use
+    _entries = OrderedDict()
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def _digest(path: str):
+        stat = os.stat(path)
+        if (record := ParseCache._digests.get(path)) is not None and record[:2] == (stat.st_size, stat.st_mtime_ns):
+            return record[2]
+        with open(path, "rb") as filep:
+            digest = hashlib.blake2b(filep.read(), digest_size=16).hexdigest()
+        ParseCache._digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def get_key(self, name: str, paths: list, version=None):
+        """Cache key of the builder `name` of `version` over the contents of paths."""
+        hasher = hashlib.blake2b(f"{name}:{CACHE_VERSION}:{version}".encode("utf-8"), digest_size=16)
+        for path in sorted(paths):
+            hasher.update(os.path.basename(path).encode("utf-8"))
+            hasher.update(ParseCache._digest(path).encode("ascii"))
+        return f"{name}-{hasher.hexdigest()}"
+
+    def load(self, name: str, paths: list, builder, version=None, validate=None):
+        """
+        Return the object built by `builder()` from the files in paths,
+        built once and then unpickled from the cache.
+        :parameter validate: callable, False for an entry out of date, which is built again in its place.
+        """
+        filename = os.path.join(self.cache_dir, self.get_key(name, paths, version) + ".pkl")
+        if (data := ParseCache._entries.get(filename)) is None:
+            try:
+                with open(filename, "rb") as filep:
+                    data = filep.read()
+            except OSError:
+                data = pickle.dumps(builder(), protocol=pickle.HIGHEST_PROTOCOL)
+                self._dump(filename, data)
+            ParseCache._entries[filename] = data
+            while len(ParseCache._entries) > CACHE_MAX_ENTRIES:
+                ParseCache._entries.popitem(last=False)
+        else:
+            ParseCache._entries.move_to_end(filename)
+        obj = pickle.loads(data)
+        if validate is not None and not validate(obj):
+            obj = builder()
+            data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+            self._dump(filename, data)
+            ParseCache._entries[filename] = data
+        return obj
+
+    def _dump(self, filename: str, data: bytes):
+        # write and rename, so that the concurrent workers never read a partial file
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as filep:
+            filep.write(data)
+        os.replace(tmp_name, filename)
+        return
+
+    def load_sav(self, filename: str):
+        """Parsed SavParser of a sav file."""
+        sav_parser = self.load("sav", [filename] + SAV_SOURCES, lambda: SavParser(filename), version=SAV_PARSER_VERSION)
+        # the entry may come from a copy of the file
+        sav_parser.filename = filename
+        return sav_parser
+
+    def load_ruleset(self, ruleset_dir: str):
+        """Compiled RulesetParser of a ruleset directory, with its derived tables."""
+        paths = glob_dir(ruleset_dir) + glob.glob(os.path.join(ruleset_dir, TECH_COSTS_FILE)) + RULESET_SOURCES
+        def build():
+            rule_parser = RulesetParser(ruleset_dir).compile()
+            rule_parser.include_key = ParseCache._get_include_key(rule_parser)
+            return rule_parser
+        # the included files are only known once parsed, their state is checked on load
+        validate = lambda rule_parser: getattr(rule_parser, "include_key", None) == ParseCache._get_include_key(rule_parser)
+        return self.load("ruleset", paths, build, version=RULESET_VERSION, validate=validate)
+
+    @staticmethod
+    def _get_include_key(rule_parser):
+        """Hash of the contents of the files included by a ruleset, and of the missing ones."""
+        hasher = hashlib.blake2b(digest_size=16)
+        for path in sorted(set(rule_parser.include_paths)):
+            hasher.update(path.encode("utf-8"))
+            hasher.update(ParseCache._digest(path).encode("ascii") if os.path.isfile(path) else b"missing")
+        return hasher.hexdigest()
+
+    def clear(self):
+        """Remove all cache files."""
+        for filename in glob.glob(os.path.join(self.cache_dir, "*.pkl")):
+            os.remove(filename)
+        ParseCache._entries.clear()
+        return
@@ -80,15 +80,15 @@ def exchange_key(dic, meta_dic):
     return output
 
 def exchange_key_value(dic, meta_dic):
-    """ dict(list) structure """
+    """ dict(list) structure, the lists are copied so that dic is not modified """
     output = dict()
     for key, value in dic.items():
         new_key = key
         if key in meta_dic:
             new_key = meta_dic[key]
-            output[new_key] = value
+            output[new_key] = list(value)
         else:
-            output[new_key] = value
+            output[new_key] = list(value)
         for _key, _value in enumerate(value):
             if _value in meta_dic:
                 output[new_key][_key] = meta_dic[_value]
@@ -13,10 +13,26 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import bz2
+import gzip
+import lzma
 import json
-import pandas as pd
 import numpy as np
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# compression suffix of sav files -> magic bytes, as written by the freeciv server
+SAV_CODECS = {
+    ".gz": b"\x1f\x8b",
+    ".bz2": b"BZh",
+    ".xz": b"\xfd7zXZ\x00",
+    ".zst": b"\x28\xb5\x2f\xfd",
+}
+
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
@@ -26,18 +42,65 @@ class NumpyEncoder(json.JSONEncoder):
 class IOManager(object):
 
     @staticmethod
-    def save_csv_from_df(df:pd.DataFrame):
+    def save_csv_from_df(df):
         return
     
     @staticmethod
     def save_csv_from_dict(dic:dict, filename:str):
+        import pandas as pd
         data = pd.DataFrame(dic)
         data.to_csv(filename, index=False, encoding="utf-8")
         return
     
+    @staticmethod
+    def get_codec(filename:str, mode:str="r"):
+        """
+        Compression suffix of a sav file, None for plain text.
+        Picked from the magic bytes on read and from the file extension on write.
+        """
+        if "r" in mode and os.path.isfile(filename):
+            with open(filename, "rb") as filep:
+                magic = filep.read(6)
+            for codec, signature in SAV_CODECS.items():
+                if magic.startswith(signature):
+                    return codec
+            return None
+        codec = os.path.splitext(filename)[1]
+        return codec if codec in SAV_CODECS else None
+
+    @staticmethod
+    def open_sav(filename:str, mode:str="r"):
+        """
+        Open a plain or compressed sav file as a stream.
+
+        mode: "r", "w" for text handlers, "rb", "wb" for binary handlers.
+        """
+        codec = IOManager.get_codec(filename, mode)
+        binary = "b" in mode
+        mode = mode.replace("b", "") + ("b" if binary else "t")
+        encoding = None if binary else "utf-8"
+        if codec is None:
+            return open(filename, mode, encoding=encoding)
+        if codec == ".gz":
+            return gzip.open(filename, mode, encoding=encoding)
+        if codec == ".bz2":
+            return bz2.open(filename, mode, encoding=encoding)
+        if codec == ".xz":
+            return lzma.open(filename, mode, encoding=encoding)
+        if zstandard is None:
+            raise ImportError(f"zstandard is required for {filename}: pip install zstandard")
+        return zstandard.open(filename, mode, encoding=encoding)
+
+    @staticmethod
+    def strip_codec(filename:str):
+        """Name of a sav file without its compression suffix."""
+        root, codec = os.path.splitext(filename)
+        return root if codec in SAV_CODECS else filename
+
     @staticmethod
     def get_handler(filename):
-        return open(filename, "w", encoding="utf-8")
+        """Text writer of a sav file, compressed by the suffix of filename."""
+        return IOManager.open_sav(filename, "w")
     
     @staticmethod
     def save_json(dic:dict, filename:str):
@@ -21,6 +21,12 @@ INTEGER_COMMENT_PATTERN = r"^(\-?[1-9][0-9]*|0)\ *;.*$"
 INTEGERSTR_PATTERN = r"^0[0-9]+$"
 QUOTATION_STR_PATTERN = r"^\"[a-zA-Z0-9_\-\ ]+\"$"
 STR_PATTERN = r"^[a-zA-Z0-9_\-\ ]+$"
+# precompiled patterns
+INTEGER_REGEX = re.compile(INTEGER_PATTERN)
+INTEGERSTR_REGEX = re.compile(INTEGERSTR_PATTERN)
+INTEGER_COMMENT_REGEX = re.compile(INTEGER_COMMENT_PATTERN)
+QUOTATION_STR_REGEX = re.compile(QUOTATION_STR_PATTERN)
+STR_REGEX = re.compile(STR_PATTERN)
 
 @unique
 class TypeEnum(Enum):
@@ -31,16 +37,18 @@ class TypeEnum(Enum):
     QuotationStr = 4
     IntegerCommentAfter = 5
     HashtagProperty = 6
+    List = 7
+    Table = 8
 
 def reg_type(value:str):
-    if re.match(INTEGER_PATTERN, value):
+    if INTEGER_REGEX.match(value):
         return int(value), TypeEnum.Integer
-    elif re.match(INTEGERSTR_PATTERN, value):
+    elif INTEGERSTR_REGEX.match(value):
         return value, TypeEnum.IntegerStr
-    elif new_v := re.match(INTEGER_COMMENT_PATTERN, value):
+    elif new_v := INTEGER_COMMENT_REGEX.match(value):
         return new_v[1], TypeEnum.IntegerCommentAfter
-    elif re.match(QUOTATION_STR_PATTERN, value):
+    elif QUOTATION_STR_REGEX.match(value):
         return value, TypeEnum.QuotationStr
-    elif re.match(STR_PATTERN, value):
+    elif STR_REGEX.match(value):
         return value, TypeEnum.Str
     return value, TypeEnum.Unknown
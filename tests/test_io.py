@@ -0,0 +1,82 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import pytest
+from freeciv_sav.utils import io as sav_io
+from freeciv_sav.utils.io import IOManager, SAV_CODECS
+from freeciv_sav.parser.sav import SavParser
+
+BASE_SAV = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "minitasks", "base", "*.sav")))[0]
+
+
+class FakeZstandard(object):
+    """zstandard stand-in which keeps the plain text, to check the selection of the codec alone."""
+
+    def __init__(self):
+        self.opened = list()
+
+    def open(self, filename, mode, encoding=None):
+        self.opened.append((filename, mode))
+        return open(filename, mode, encoding=encoding)
+
+
+@pytest.fixture
+def content():
+    with open(BASE_SAV, "r", encoding="utf-8") as filep:
+        return filep.read()
+
+
+@pytest.mark.parametrize("codec", [""] + list(SAV_CODECS))
+def test_round_trip(tmp_path, content, codec):
+    if codec == ".zst" and sav_io.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    filename = str(tmp_path / ("test.sav" + codec))
+    with IOManager.get_handler(filename) as filep:
+        filep.write(content)
+    assert IOManager.get_codec(filename) == (codec or None)
+    with IOManager.open_sav(filename) as filep:
+        assert filep.read() == content
+    assert SavParser(filename).get("game") == SavParser(BASE_SAV).get("game")
+
+
+def test_codec_from_magic(tmp_path, content):
+    # a compressed sav is read by its magic bytes whatever its name
+    filename = str(tmp_path / "test.sav")
+    with IOManager.get_handler(str(tmp_path / "test.sav.gz")) as filep:
+        filep.write(content)
+    os.rename(str(tmp_path / "test.sav.gz"), filename)
+    assert IOManager.get_codec(filename) == ".gz"
+    assert IOManager.get_codec(str(tmp_path / "new.sav.xz"), "w") == ".xz"
+    assert IOManager.get_codec(str(tmp_path / "new.sav.txt"), "w") is None
+    assert IOManager.strip_codec("a/b.sav.zst") == "a/b.sav"
+
+
+def test_zst_selection(tmp_path, content, monkeypatch):
+    fake = FakeZstandard()
+    monkeypatch.setattr(sav_io, "zstandard", fake)
+    filename = str(tmp_path / "test.sav.zst")
+    with IOManager.get_handler(filename) as filep:
+        filep.write(content)
+    assert fake.opened == [(filename, "wt")]
+    with open(filename, "rb") as filep:
+        assert filep.read(len(SAV_CODECS[".zst"])) != SAV_CODECS[".zst"]
+
+
+def test_zst_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(sav_io, "zstandard", None)
+    with pytest.raises(ImportError):
+        IOManager.get_handler(str(tmp_path / "test.sav.zst"))
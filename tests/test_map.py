@@ -0,0 +1,126 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from collections import deque
+import numpy as np
+import pytest
+from freeciv_sav.components.map import MapTool, YieldGrid
+from freeciv_sav.components.city import CityTool
+from freeciv_sav.components.resource import ResourceTool
+
+
+def bfs_components(mask, wrapx, wrapy):
+    """Labels and sizes of the 4-connected components of mask by a breadth-first search, row by row."""
+    ysize, xsize = mask.shape
+    labels = np.zeros(mask.shape, dtype=np.int64)
+    sizes = list()
+    for y in range(ysize):
+        for x in range(xsize):
+            if not mask[y, x] or labels[y, x] > 0:
+                continue
+            sizes.append(0)
+            labels[y, x] = len(sizes)
+            queue = deque([(y, x)])
+            while len(queue) > 0:
+                _y, _x = queue.popleft()
+                sizes[-1] += 1
+                for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                    ny, nx = _y + dy, _x + dx
+                    if wrapy:
+                        ny %= ysize
+                    if wrapx:
+                        nx %= xsize
+                    if 0 <= ny < ysize and 0 <= nx < xsize and mask[ny, nx] and labels[ny, nx] == 0:
+                        labels[ny, nx] = len(sizes)
+                        queue.append((ny, nx))
+    return labels, np.array(sizes, dtype=np.int64)
+
+
+@pytest.mark.parametrize("wrapx, wrapy", [(False, False), (True, False), (False, True), (True, True)])
+@pytest.mark.parametrize("seed", range(5))
+def test_label_components(seed, wrapx, wrapy):
+    rng = np.random.default_rng(seed)
+    for shape, density in [((16, 20), 0.5), ((25, 40), 0.6), ((7, 3), 0.7), ((1, 9), 0.5)]:
+        mask = rng.random(shape) < density
+        labels, sizes = MapTool.label_components(mask, wrapx, wrapy)
+        expected_labels, expected_sizes = bfs_components(mask, wrapx if shape[1] > 2 else False, wrapy if shape[0] > 2 else False)
+        assert np.array_equal(labels, expected_labels)
+        assert np.array_equal(sizes, expected_sizes)
+
+
+def test_label_across_edges():
+    # a strip along the left and right edges is one land on WRAPX only
+    mask = np.zeros((5, 6), dtype=bool)
+    mask[:, 0] = mask[:, -1] = True
+    assert len(MapTool.label_components(mask)[1]) == 2
+    labels, sizes = MapTool.label_components(mask, wrapx=True)
+    assert sizes.tolist() == [10] and (labels[mask] == 1).all()
+    assert len(MapTool.label_components(np.zeros((3, 3), dtype=bool))[1]) == 0
+
+
+TERRAIN_CONF = {"g": {"food": 2, "shield": 0, "trade": 0}, "h": {"food": 1, "shield": 0, "trade": 0},
+                "p": {"food": 1, "shield": 1, "trade": 0}, "m": {"food": 0, "shield": 1, "trade": 0}}
+EXTRA_CONF = {"e03_4": {"food": 0, "shield": 0, "trade": 2}, "e03_8": {"food": 2, "shield": 1, "trade": 0}}
+WEIGHT = {"food": 0.4, "shield": 0.4, "trade": 0.2}
+
+
+@pytest.mark.parametrize("topology", ["", "WRAPX", "WRAPX|WRAPY"])
+def test_city_index_topology(topology):
+    rng = np.random.default_rng(7)
+    ysize, xsize = 9, 11
+    terrain_map = rng.choice(list(TERRAIN_CONF), (ysize, xsize)).tolist()
+    extra_layer = rng.choice(["e03_0", "e03_4", "e03_8"], (ysize, xsize)).tolist()
+    extras = ResourceTool.pack_extras({"e03": extra_layer})
+    grid = YieldGrid(terrain_map, extras, TERRAIN_CONF, EXTRA_CONF, topology)
+    city_index = grid.get_city_index(CityTool.cal_city_scope(0, 0), 6, WEIGHT)
+    for edit in range(3):
+        for y in range(ysize):
+            for x in range(xsize):
+                scope = CityTool.cal_city_scope_with_loop(x, y, xsize, ysize, topology)
+                expected = MapTool.calulate_cri(scope, WEIGHT, terrain_map, {"e03": extra_layer}, TERRAIN_CONF, EXTRA_CONF, 6)[0]
+                assert city_index.get_score(x, y) == pytest.approx(expected)
+        # an edit at the corner reaches the centers across the wrapped edges only
+        terrain_map[0][0] = "g" if terrain_map[0][0] != "g" else "m"
+        extra_layer[0][0] = "e03_8"
+        ResourceTool.set_extra(extras, (0, 0), "e03_8")
+        grid.update(0, 0)
+
+
+def test_known_round_trip():
+    rng = np.random.default_rng(3)
+    known = rng.integers(0, 2**12, (6, 7))
+    layers = MapTool.encode_known(known)
+    assert len(layers) == 3 and all(len(value) == 1 for layer in layers for row in layer for value in row)
+    assert np.array_equal(MapTool.decode_known(layers), known)
+    assert len(MapTool.encode_known(np.zeros((2, 2), dtype=np.int64), 2)) == 2
+
+
+def test_known_layers_of_sav():
+    from freeciv_sav.parser.sav import SavParser
+    sav_parser = SavParser(os.path.join(os.path.dirname(__file__), "minitasks", "base", "myagent_T1_task_development_build_city.sav"))
+    seen_map = sav_parser.get_seen_map()
+    # players 4 and 6 know a tile out of three on k01
+    k01 = {"k01"+key[3:]: ["5" if (y + x) % 3 == 0 else "0" for x in range(len(row))] for y, (key, row) in enumerate(seen_map.items())}
+    map_tool = MapTool(raw_data=sav_parser.get_global_map(), player_map_data=sav_parser.get_players_map(),
+                       player_resource_data=sav_parser.get_players_resource(), seen_map=dict(seen_map, **k01),
+                       terrain_fpt_conf={}, resource_fpt_conf={}, terrain_resource_conf={},
+                       extra_resources=ResourceTool.exchagne_rawdata(sav_parser.get_extra_resources()))
+    assert np.array_equal(map_tool._known >> 4, np.array([[int(value, 16) for value in row] for row in k01.values()]))
+    terrain_conf, _ = map_tool.gen_other_map({"__raw__": map_tool._global_map}, {"__raw__": map_tool._extras},
+                                             {"player0": {0: {"location": [3, 3], "name": "Settlers"}}}, format_type="line")
+    assert list(terrain_conf["seen"]) == list(seen_map) + list(k01)
+    for key, row in k01.items():
+        assert terrain_conf["seen"][key] == f'{key}="{"".join(row)}"'
@@ -0,0 +1,58 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import numpy as np
+import pytest
+from freeciv_sav.parser.sav import SavParser
+from freeciv_sav.bean.format_type import FormatTypeBean
+
+SAV_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "**", "*.sav"), recursive=True))
+PREFIXES = ["t", "k00_", "owner", "eowner", "source", "worked"] + [f"e{i:02d}_" for i in range(9)]
+
+
+def get_rows(parser, prefix, tag="map"):
+    section = parser.get(tag)
+    rows = list()
+    while (row := section.get(f"{prefix}{len(rows):04d}")) is not None:
+        rows.append(row[0][1])
+    return rows
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_round_trip(filename):
+    parser = SavParser(filename)
+    for prefix in PREFIXES:
+        if len(rows := get_rows(parser, prefix)) == 0:
+            continue
+        array = parser.get_map_array(prefix)
+        assert array.shape[0] == len(rows)
+        assert array.dtype == (np.uint8 if "," not in rows[0] else np.int32)
+        suffix = "," if rows[0].endswith(",") else ""
+        lines = FormatTypeBean.line_from_map_array(array, prefix, suffix)
+        assert list(lines) == [f"{prefix}{y:04d}" for y in range(len(rows))]
+        for (key, line), row in zip(lines.items(), rows):
+            assert line == f'{key}="{row}"', key
+
+
+@pytest.mark.parametrize("filename", SAV_FILES[:1], ids=os.path.basename)
+def test_lists(filename):
+    parser = SavParser(filename)
+    terrain = parser.get_map_array("t")
+    rows = [row for key, row in parser.get_global_map().items()]
+    assert terrain.tobytes().decode("ascii") == "".join("".join(row) for row in rows)
+    with pytest.raises(KeyError):
+        parser.get_map_array("no_such_layer")
@@ -0,0 +1,139 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import random
+import pytest
+import numpy as np
+import freeciv_sav
+from freeciv_sav.parser.sav import SavParser
+from freeciv_sav.parser.ruleset import RulesetParser, TECH_NONE
+from freeciv_sav.components.research import ResearchTool
+from freeciv_sav.utils.dic_tools import recursive_dict_out
+
+RULESET_DIR = os.path.join(os.path.dirname(freeciv_sav.__file__), "config", "classic")
+SAV_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "minitasks", "**", "*.sav"), recursive=True))
+
+
+@pytest.fixture(scope="module")
+def techs_conf():
+    return RulesetParser(RULESET_DIR).get_tech_tree()
+
+
+def get_requirements(req, tech):
+    """All the requirements of a tech, by a plain recursive walk of the ruleset."""
+    output = set()
+    for _req in req.get(tech, []):
+        output |= {_req} | get_requirements(req, _req)
+    return output
+
+
+def get_random_techs(tree, seed, count):
+    rand = random.Random(seed)
+    return rand.sample(tree.names[1:], count)
+
+
+def test_tech_ids(techs_conf):
+    # the ids of the tree are the positions in the done vectors
+    assert list(techs_conf["tree"].names) == ResearchTool.tech_vector
+    assert set(techs_conf["tree"].names) == set(techs_conf["req"]) | {TECH_NONE}
+
+
+def test_closure(techs_conf):
+    tree, req = techs_conf["tree"], techs_conf["req"]
+    successors = {tech: set() for tech in tree.names}
+    for tech in tree.names:
+        requirements = get_requirements(req, tech)
+        assert set(tree.get_names(tree.req_closure[tree.index[tech]])) == requirements, tech
+        assert set(tree.get_names(tree.req[tree.index[tech]])) == set(req.get(tech, [])), tech
+        for _req in requirements:
+            successors[_req].add(tech)
+    for tech in tree.names:
+        assert set(tree.get_names(tree.pro_closure[tree.index[tech]])) == successors[tech], tech
+        assert set(tree.get_names(tree.pro[tree.index[tech]])) == set(techs_conf["pro"].get(tech, [])), tech
+        assert tree.cumulative_costs[tree.index[tech]] == tree.costs[tree.index[tech]] + \
+            sum(tree.costs[tree.index[_req]] for _req in get_requirements(req, tech))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_frontier(techs_conf, seed):
+    tree, req = techs_conf["tree"], techs_conf["req"]
+    techs = get_random_techs(tree, seed, 6)
+    known = set(techs) | {_req for tech in techs for _req in get_requirements(req, tech)}
+    mask = tree.get_mask(known)
+    assert set(tree.get_names(tree.get_closure(tree.get_mask(techs)))) == \
+        {_req for tech in techs for _req in get_requirements(req, tech)}
+    assert set(tree.get_names(tree.get_frontier(mask))) == \
+        {tech for tech in tree.names[1:] if tech not in known and all(_req in known for _req in req[tech])}
+    assert set(tree.get_names(tree.get_edge(mask))) == \
+        {tech for tech in known if not any(tech in req[_tech] for _tech in known if _tech != TECH_NONE)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_research_tool(techs_conf, seed):
+    tree, req, pro = techs_conf["tree"], techs_conf["req"], techs_conf["pro"]
+    research_tool = ResearchTool(None, techs_conf)
+    edge_techs = get_random_techs(tree, seed, 4)
+    # the requirements by recursive_dict_out, with A_NONE as the leaf of every walk
+    groups = list()
+    for tech in edge_techs:
+        recursive_dict_out(key=tech, dic=req, output=groups)
+    assert set(research_tool.get_full_techs_by_edge(edge_techs)) == {tech for group in groups for tech in group}
+
+    known_techs = sorted({_req for tech in edge_techs for _req in get_requirements(req, tech)} | set(edge_techs),
+                         key=tree.index.get)
+    techs_edge = [tech for tech in known_techs if not any(_tech in known_techs for _tech in pro.get(tech, []))]
+    assert research_tool.get_techs_edge(known_techs) == techs_edge
+    now_tech = ""
+    for tech in techs_edge:
+        now_tech = next((_tech for _tech in pro.get(tech, []) if all(_req in known_techs for _req in req[_tech])), "")
+        if now_tech != "":
+            break
+    assert research_tool.find_now_tech(known_techs, techs_edge) == now_tech
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_techs_done_mask(techs_conf, filename):
+    tree, req = techs_conf["tree"], techs_conf["req"]
+    sav_parser = SavParser(filename)
+    research = sav_parser.get_global_techs_info()
+    masks = sav_parser.get_techs_done_mask()
+    assert list(masks) == list(research["number"])
+    assert np.array_equal(sav_parser.get_techs_done_array(), [[bit == "1" for bit in done] for done in research["done"]])
+    research_tool = ResearchTool(research, techs_conf)
+    techs_done = research_tool.get_techs_done()
+    for number, done in zip(research["number"], research["done"]):
+        known_techs = [ResearchTool.tech_vector[i] for i, bit in enumerate(done) if bit == "1"]
+        assert masks[number] == tree.get_mask(known_techs)
+        assert techs_done["player%s" % number] == known_techs
+        assert set(tree.get_names(tree.get_closure(masks[number]))) == \
+            {_req for tech in known_techs for _req in get_requirements(req, tech)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_set_techs_done(techs_conf, seed):
+    tree, req = techs_conf["tree"], techs_conf["req"]
+    research_tool = ResearchTool(None, techs_conf)
+    techs = get_random_techs(tree, seed, 5)
+    known_techs = set(techs) | {_req for tech in techs for _req in get_requirements(req, tech)}
+    for first in "01":
+        done = first + "0" * (len(tree.names) - 1)
+        new_done = research_tool.set_techs_done(done, known_techs)
+        assert new_done == first + "".join("1" if tech in known_techs else "0" for tech in ResearchTool.tech_vector[1:])
+        # the bit of A_NONE is kept
+        assert research_tool._get_techs_done(new_done) == [TECH_NONE] * (first == "1") + \
+            [tech for tech in ResearchTool.tech_vector[1:] if tech in known_techs]
+        assert research_tool.count_techs(new_done) == new_done.count("1")
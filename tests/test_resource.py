@@ -0,0 +1,72 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import glob
+import numpy as np
+import pytest
+from freeciv_sav.parser.sav import SavParser
+from freeciv_sav.components.resource import ResourceTool, EXTRA_DIGITS, EXTRA_BITS
+
+BASE_SAVS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "minitasks", "base", "*.sav")))
+EIDS = [f"e{index:02d}" for index in range(9)]
+
+
+def random_layers(seed, shape=(7, 11)):
+    rng = np.random.default_rng(seed)
+    return {eid: rng.choice(list(EXTRA_DIGITS), shape).tolist() for eid in EIDS}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_round_trip_digits(seed):
+    layers = random_layers(seed)
+    packed = ResourceTool.pack_extras(layers)
+    assert packed.dtype == np.uint64
+    unpacked = ResourceTool.unpack_extras(packed, EIDS)
+    assert all(unpacked[eid].tolist() == layers[eid] for eid in EIDS)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_round_trip_prefix(seed):
+    layers = {eid: [[eid+"_"+digit for digit in row] for row in layer] for eid, layer in random_layers(seed).items()}
+    packed = ResourceTool.pack_extras(layers)
+    unpacked = ResourceTool.unpack_extras(packed, EIDS, prefix=True)
+    assert all(unpacked[eid].tolist() == layers[eid] for eid in EIDS)
+
+
+@pytest.mark.parametrize("filename", BASE_SAVS[:3])
+def test_pack_sav_rows(filename):
+    sav_parser = SavParser(filename)
+    # the uint8 ascii rows of get_map_array and the values of exchagne_rawdata pack the same
+    arrays = {eid: sav_parser.get_map_array(eid+"_") for eid in EIDS}
+    packed = ResourceTool.pack_extras(arrays)
+    raw = ResourceTool.exchagne_rawdata(sav_parser.get_extra_resources())
+    assert np.array_equal(packed, ResourceTool.pack_extras({eid: list(data.values()) for eid, data in raw.items()}))
+    unpacked = ResourceTool.unpack_extras(packed, EIDS)
+    for eid in EIDS:
+        assert unpacked[eid].tolist() == [[chr(code).lower() for code in row] for row in arrays[eid].tolist()]
+
+
+def test_set_extra():
+    packed = ResourceTool.pack_extras({"e03": [["6", "0"]], "e04": [["1", "8"]]})
+    ResourceTool.set_extra(packed, (0, 0), "e03_8")
+    ResourceTool.set_extra(packed, (0, 1), "e04_0")
+    assert ResourceTool.unpack_extras(packed, ["e03", "e04"])["e03"].tolist() == [["8", "0"]]
+    assert ResourceTool.unpack_extras(packed, ["e03", "e04"])["e04"].tolist() == [["1", "0"]]
+    assert ResourceTool.get_extra_values(packed[0, 0]) == ["e03_8", "e04_1"]
+    assert ResourceTool.get_extra_values(packed[0, 1]) == []
+    assert list(ResourceTool.get_extra_digits(packed)) == ["e03", "e04"]
+    assert ResourceTool.get_extra_names(packed[0, 0]) == ["iron", "game"]
+    assert ResourceTool.has_extras(packed).tolist() == [[True, False]]
+    assert int(packed[0, 0]) == 1 << EXTRA_BITS["iron"] | 1 << EXTRA_BITS["game"]
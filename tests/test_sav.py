@@ -0,0 +1,187 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import glob
+import math
+import shutil
+import pytest
+from freeciv_sav.utils.io import IOManager
+from freeciv_sav.parser.sav import SavParser, SavTokenizer, RAW_REPRE, HEAD_TAG
+from freeciv_sav.parser.table import SavTable
+
+SAV_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "minitasks", "**", "*.sav"), recursive=True))
+
+
+def parse_line_by_line(filename):
+    """
+    Sections of a sav split on the stripped lines first, then parsed key by key, like the
+    SavParser before the tokenizer. Tables are kept as their lines, {section: {key: value}}.
+    """
+    with open(filename, "r", encoding="utf-8") as filep:
+        lines = [tmp for line in filep if (tmp := line.strip()) != ""]
+    sections = dict()
+    name, first = HEAD_TAG, 0
+    for index, line in enumerate(lines):
+        if line[0] == "[" and line[-1] == "]":
+            sections[name] = lines[first:index]
+            name, first = line[1:-1], index + 1
+    sections[name] = lines[first:]
+
+    output = dict()
+    for name, rows in sections.items():
+        tag = output[name] = {RAW_REPRE: rows}
+        index = 0
+        while index < len(rows):
+            if (match := re.match(r"^[\.a-zA-Z0-9_-]+=", rows[index])) is None:
+                index += 1
+                continue
+            key, value = rows[index][:match.end() - 1], rows[index][match.end():]
+            if value[:1] not in ("$", "{"):
+                tag[key] = re.findall(r"""(?:^|,)(?=[^"]|(")?)"?((?(1)[^"]*|[^,"]*))"?(?=,|$)""", value)
+                index += 1
+                continue
+            block, rest, end = list(), value[1:], "$" if value[0] == "$" else "}"
+            while rest == "" or rest[-1] != end:
+                block.append(rest)
+                index += 1
+                rest = rows[index]
+            index += 1
+            tag[key] = ("".join(row + "\n" for row in block) if value[0] == "$" else
+                        SavTable.from_rows(block) or block + [""])
+    return output
+
+
+def same_value(value, expected):
+    if isinstance(expected, SavTable):
+        return isinstance(value, SavTable) and value.columns == expected.columns and len(value) == len(expected) and \
+            all(same_value(_value, _expected) for column in expected.columns
+                for _value, _expected in zip(value[column], expected[column]))
+    if isinstance(expected, dict):
+        return isinstance(value, dict) and list(value) == list(expected) and \
+            all(same_value(value[key], expected[key]) for key in expected)
+    if isinstance(expected, float) and math.isnan(expected):
+        return isinstance(value, float) and math.isnan(value)
+    return value == expected and type(value) is type(expected)
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_tokenizer(filename):
+    expected = parse_line_by_line(filename)
+    sav_parser = SavParser(filename)
+    assert list(sav_parser.tags) == list(expected)
+    for name in expected:
+        assert same_value(sav_parser.get(name), expected[name]), name
+    assert sav_parser.players == [name for name in expected if re.match(r"player\d+", name)]
+
+
+def test_tokenizer_blocks():
+    lines = ["a=1", "[game]", 'name="x","y"', "code=$first", "second", "$", "empty=$$",
+             'u={"id","x"', "1,2", "}", "[map]", "t0000=aa"]
+    assert list(SavTokenizer(lines)) == [
+        ("basic", "a", "1", 0), ("section", "game", None, 1), ("basic", "name", '"x","y"', 2),
+        ("code", "code", ["first", "second"], 3), ("code", "empty", [], 6),
+        ("table", "u", ['"id","x"', "1,2"], 7), ("section", "map", None, 10), ("basic", "t0000", "aa", 11)]
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_index_sections(filename):
+    sav_parser = SavParser(filename)
+    with open(filename, "rb") as filep:
+        data = filep.read()
+    offsets = SavParser.index_sections(data)
+    assert list(offsets) == list(sav_parser.tags)
+    for name, (start, end) in offsets.items():
+        rows = [tmp for line in data[start:end].decode("utf-8").split("\n") if (tmp := line.strip()) != ""]
+        assert rows == sav_parser.get(name)[RAW_REPRE], name
+    # stop once the asked sections are indexed
+    partial = SavParser.index_sections(data, {"game"})
+    assert "game" in partial and len(partial) < len(offsets)
+    assert all(partial[name] == offsets[name] for name in partial)
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_lazy(filename):
+    sav_parser = SavParser(filename)
+    lazy_parser = SavParser(filename, lazy=True)
+    assert lazy_parser.tags == {}
+    assert lazy_parser.get_tag_names() == list(sav_parser.tags)
+    assert lazy_parser.players == sav_parser.players
+    assert same_value(lazy_parser.get("game"), sav_parser.get("game"))
+    assert list(lazy_parser.tags) == ["game"]
+    for name in sav_parser.tags:
+        assert same_value(lazy_parser.get(name), sav_parser.get(name)), name
+    assert lazy_parser.lines == sav_parser.lines
+
+
+def test_lazy_compressed(tmp_path):
+    filename = str(tmp_path / "test.sav.gz")
+    with open(SAV_FILES[0], "r", encoding="utf-8") as filep, IOManager.get_handler(filename) as _filep:
+        shutil.copyfileobj(filep, _filep)
+    sav_parser = SavParser(SAV_FILES[0])
+    lazy_parser = SavParser(filename, lazy=True)
+    assert lazy_parser.get_tag_names() == list(sav_parser.tags)
+    for name in ["map", "game", sav_parser.players[0]]:
+        assert same_value(lazy_parser.get(name), sav_parser.get(name)), name
+
+
+def test_chunk():
+    assert list(SavParser._chunk(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(SavParser._chunk([], 3)) == []
+
+
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory):
+    """The sample saves twice, with a missing file and a file without [game] in between."""
+    root = tmp_path_factory.mktemp("many")
+    broken = str(root / "broken.sav")
+    with open(broken, "w", encoding="utf-8") as filep:
+        filep.write("[savefile]\noptions=\" 3.0\"\n")
+    return SAV_FILES[:5] + [str(root / "missing.sav")] + SAV_FILES[5:] + [broken] + SAV_FILES[::-1]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parse_many(paths, workers):
+    results = list(SavParser.parse_many(paths, workers=workers, chunksize=3))
+    assert [result["filename"] for result in results] == paths
+    for filename, result in zip(paths, results):
+        if not os.path.isfile(filename) or filename.endswith("broken.sav"):
+            assert result["error"] is not None and "sections" not in result
+            continue
+        sav_parser = SavParser(filename)
+        assert result["error"] is None
+        assert result["size"] == os.path.getsize(filename)
+        assert result["turn"] == int(sav_parser.get("game")["turn"][0][1])
+        assert result["players"] == sav_parser.players
+        assert result["sections"] == list(sav_parser.tags)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parse_many_select(paths, workers):
+    select = ["game", "player0", "absent"]
+    results = list(SavParser.parse_many(paths, workers=workers, select=select, chunksize=4))
+    assert [result["filename"] for result in results] == paths
+    for filename, result in zip(paths, results):
+        if result["error"] is not None:
+            assert not os.path.isfile(filename)
+            continue
+        if filename.endswith("broken.sav"):
+            assert result["sections"] == {}
+            continue
+        sav_parser = SavParser(filename)
+        assert list(result["sections"]) == ["game", "player0"]
+        for name in result["sections"]:
+            assert same_value(result["sections"][name], sav_parser.get(name)), (filename, name)
@@ -0,0 +1,84 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import math
+import shutil
+import pytest
+from freeciv_sav.utils.io import IOManager
+from freeciv_sav.parser.sav import SavParser, RAW_REPRE
+from freeciv_sav.parser.scanner import SavScanner, FILENAME_COLUMN
+
+SAV_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "minitasks", "**", "*.sav"), recursive=True))
+SCORE_KEYS = ["score0."+key for key in SavParser(SAV_FILES[0]).get("score0") if key != RAW_REPRE]
+KEYS = ["game.turn", "player0.nunits", "player1.nunits", "player0.u", "player9.nunits"] + SCORE_KEYS
+
+
+def get_expected(filename):
+    """Values of KEYS read from the parsed file, NaN for the missing ones."""
+    sav_parser = SavParser(filename)
+    values = dict()
+    for key in KEYS:
+        section, name = key.split(".", 1)
+        if section not in sav_parser.tags or name not in sav_parser.get(section):
+            values[key] = math.nan
+        elif name == "u":
+            values[key] = len(sav_parser.get(section)[name])
+        else:
+            values[key] = int(sav_parser.get(section)[name][0][1])
+    return values
+
+
+def same_value(value, expected):
+    if isinstance(expected, float) and math.isnan(expected):
+        return isinstance(value, float) and math.isnan(value)
+    return value == expected and type(value) is type(expected)
+
+
+@pytest.fixture(scope="module")
+def sav_tree(tmp_path_factory):
+    """The sample saves, half of them compressed, under nested directories."""
+    root = tmp_path_factory.mktemp("savs")
+    filenames = list()
+    for index, filename in enumerate(SAV_FILES):
+        os.makedirs(directory := str(root / f"user{index % 3}"), exist_ok=True)
+        target = os.path.join(directory, os.path.basename(filename) + (".gz" if index % 2 else ""))
+        with open(filename, "r", encoding="utf-8") as filep, IOManager.get_handler(target) as _filep:
+            shutil.copyfileobj(filep, _filep)
+        filenames.append((target, filename))
+    return str(root), sorted(filenames)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_scan(workers):
+    table = SavScanner(KEYS).scan(SAV_FILES, workers=workers, chunksize=3)
+    assert table.columns == [FILENAME_COLUMN] + KEYS
+    assert table[FILENAME_COLUMN] == SAV_FILES
+    for index, filename in enumerate(SAV_FILES):
+        expected = get_expected(filename)
+        for key in KEYS:
+            assert same_value(table[key][index], expected[key]), (filename, key)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_scan_tree(sav_tree, workers):
+    root, filenames = sav_tree
+    table = SavScanner(KEYS).scan_tree(root, workers=workers)
+    assert table[FILENAME_COLUMN] == [target for target, _ in filenames]
+    for index, (_, filename) in enumerate(filenames):
+        expected = get_expected(filename)
+        for key in KEYS:
+            assert same_value(table[key][index], expected[key]), (filename, key)
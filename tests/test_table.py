@@ -0,0 +1,74 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import math
+from io import StringIO
+import pytest
+from freeciv_sav.parser.sav import SavParser
+from freeciv_sav.parser.table import SavTable
+
+pd = pytest.importorskip("pandas")
+
+SAV_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "**", "*.sav"), recursive=True))
+
+
+def get_table_rows(filename, monkeypatch):
+    """Lines of all the tables of a sav, as given to SavParser.parse_table."""
+    tables = list()
+    parse_table = SavParser.parse_table
+    def record(rows):
+        tables.append(list(rows))
+        return parse_table(rows)
+    monkeypatch.setattr(SavParser, "parse_table", staticmethod(record))
+    SavParser(filename)
+    monkeypatch.undo()
+    return tables
+
+
+def same_value(value, expected):
+    if isinstance(expected, float) and math.isnan(expected):
+        return isinstance(value, float) and math.isnan(value)
+    return value == expected and type(value) is type(expected)
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_read_csv(filename, monkeypatch):
+    tables = get_table_rows(filename, monkeypatch)
+    assert len(tables) > 0
+    for rows in tables:
+        table = SavTable.from_rows(rows)
+        try:
+            df = pd.read_csv(StringIO("\n".join(rows) + "\n"))
+        except pd.errors.ParserError:
+            assert table is None
+            continue
+        assert table.columns == list(df.columns)
+        assert table.shape == df.shape
+        for column in table.columns:
+            expected = df[column].tolist()
+            assert all(same_value(value, _value) for value, _value in zip(table[column], expected)), column
+
+
+def test_to_dataframe():
+    table = SavTable.from_rows(['"id","x","y","name","done"', '1,2,3,"Warriors",TRUE', '2,4,,"Settlers",FALSE'])
+    df = table.to_dataframe()
+    assert df.shape == (2, 5)
+    back = SavTable.from_dataframe(df)
+    assert back.columns == table.columns
+    assert all(same_value(value, _value) for column in table.columns for value, _value in zip(back[column], table[column]))
+    assert table.to_dict(orient="records")[1]["name"] == "Settlers"
+    assert math.isnan(table.at[1, "y"])
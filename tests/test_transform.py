@@ -0,0 +1,114 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import copy
+import itertools
+import numpy as np
+import pytest
+from freeciv_sav.parser.sav import SavParser
+from freeciv_sav.parser.table import SavTable
+from freeciv_sav.components.transform import MapTransform, MIRROR_AXES
+from freeciv_sav.components.unit import UnitTool, UNIT_TILE_COLUMNS
+from freeciv_sav.components.city import CityTool
+
+# a 16x16 WRAPX map with cities
+CITY_SAV = os.path.join(os.path.dirname(__file__), "minitasks", "base", "myagent_T1_task_development_citytile_wonder.sav")
+TRANSFORMS = list(itertools.product(range(4), MIRROR_AXES, [(0, 0), (5, 0)]))
+
+
+@pytest.mark.parametrize("rotation, mirror, shift", TRANSFORMS)
+def test_apply_move(rotation, mirror, shift):
+    xsize = ysize = 8
+    map_transform = MapTransform(xsize, ysize, rotation, mirror, shift, topology="WRAPX")
+    layer = np.arange(ysize * xsize).reshape(ysize, xsize)
+    moved = map_transform.apply(layer)
+    assert sorted(moved.reshape(-1)) == list(range(ysize * xsize))
+    ys, xs = np.indices((ysize, xsize))
+    _xs, _ys = map_transform.move(xs, ys)
+    assert np.array_equal(moved[_ys, _xs], layer)
+    # extra dimensions, like the layers of extras, follow the tiles
+    assert np.array_equal(map_transform.apply(np.stack([layer, -layer], axis=-1))[_ys, _xs, 1], -layer)
+    # the rows of `worked` keep their trailing field
+    rows = [[str(value) for value in row] + [""] for row in layer.tolist()]
+    assert map_transform.apply_rows(rows) == [[str(value) for value in row] + [""] for row in moved.tolist()]
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        MapTransform(8, 6, rotation=1)
+    with pytest.raises(ValueError):
+        MapTransform(8, 8, shift=(0, 1), topology="WRAPX")
+    with pytest.raises(ValueError):
+        MapTransform(8, 8, shift=(1, 0), topology="")
+    with pytest.raises(ValueError):
+        MapTransform.get_quarter_turns(1.0)
+    assert MapTransform.get_quarter_turns(-np.pi / 2) == 3
+
+
+@pytest.mark.parametrize("rotation, mirror, shift", TRANSFORMS)
+def test_unit_transform_location(rotation, mirror, shift):
+    columns = ["id", "type_by_name"] + [column for columns in UNIT_TILE_COLUMNS for column in columns]
+    units = SavTable(columns, {"id": [101, 102, 103], "type_by_name": ["Settlers", "Warriors", "Trireme"],
+                               "x": [0, 3, 7], "y": [1, 5, 7],
+                               "goto_x": [-1, 6, 0], "goto_y": [-1, 2, 0],
+                               "action_decision_tile_x": [2, -1, -1], "action_decision_tile_y": [4, -1, -1]})
+    unit_tool = UnitTool({"player0": {"u": units}, "player1": {}}, unit_obsolete_conf=None)
+    map_transform = MapTransform(8, 8, rotation, mirror, shift, topology="WRAPX")
+    unit_tool.transform_location(map_transform)
+    moved = unit_tool._raw_data["player0"]["u"]
+    for x_col, y_col in UNIT_TILE_COLUMNS:
+        for x, y, _x, _y in zip(units[x_col], units[y_col], moved[x_col], moved[y_col]):
+            if x < 0:
+                assert (_x, _y) == (-1, -1)
+            else:
+                assert (_x, _y) == tuple(map_transform.move(x, y))
+    assert moved["id"] == [101, 102, 103]
+
+
+@pytest.mark.parametrize("rotation, mirror, shift", TRANSFORMS)
+def test_city_transform_location(rotation, mirror, shift):
+    sav_parser = SavParser(CITY_SAV)
+    city_tool = CityTool(sav_parser.get_city_info(),
+                         global_owner_data=sav_parser.get_tiles_own_info(),
+                         global_eowner_data=sav_parser.get_tiles_eown_info(),
+                         global_source_data=sav_parser.get_tiles_source_info(),
+                         global_worked_data=sav_parser.get_tiles_worked_info(),
+                         topology=sav_parser.get_topology())
+    cities = copy.deepcopy(city_tool.get_player_city_data())
+    layers = copy.deepcopy(city_tool.get_city_map_data())
+    assert any("c" in tables for tables in cities.values())
+    map_transform = MapTransform(city_tool.xsize, city_tool.ysize, rotation, mirror, shift, topology=city_tool.topology)
+    city_tool.transform_location(map_transform)
+
+    for player_id, tables in city_tool.get_player_city_data().items():
+        if "c" not in tables:
+            continue
+        xs, ys = map_transform.move(cities[player_id]["c"]["x"], cities[player_id]["c"]["y"])
+        assert tables["c"]["x"] == xs.tolist() and tables["c"]["y"] == ys.tolist()
+    moved = city_tool.get_city_map_data()
+    for key in layers:
+        assert len(moved[key]) == len(layers[key])
+    for name in ["owner", "eowner", "source", "worked"]:
+        rows = [layers[key] for key in sorted(layers) if key[:-4] == name]
+        _rows = [moved[key] for key in sorted(moved) if key[:-4] == name]
+        for y, row in enumerate(rows):
+            for x, value in enumerate(row[:city_tool.xsize]):
+                _x, _y = map_transform.move(x, y)
+                assert _rows[_y][_x] == value, (name, x, y)
+            # the empty field of the trailing comma
+            assert _rows[y][city_tool.xsize:] == row[city_tool.xsize:]
+    assert layers["worked0000"][city_tool.xsize:] == [""]
@@ -0,0 +1,89 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import pytest
+from freeciv_sav.parser.sav import SavParser
+from freeciv_sav.components.unit import UnitTool, get_classic_unit_types
+
+SAV_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "minitasks", "**", "*.sav"), recursive=True))
+
+# the hard-coded tables of unit.py before UnitTypeTable, by lowercase unit name
+# [attack, defense, hitpoints] of the combat units
+UNIT_COMBAT_STATIS = {
+    "warriors": [1, 1, 10], "phalanx": [1, 2, 10], "archers": [3, 2, 10], "legion": [4, 2, 10],
+    "pikemen": [1, 2, 10], "musketeers": [3, 3, 20], "partisan": [4, 4, 20], "alpine troops": [5, 5, 20],
+    "riflemen": [5, 4, 20], "marines": [8, 5, 20], "paratroopers": [6, 4, 20], "mech. inf.": [6, 6, 30],
+    "horsemen": [2, 1, 10], "chariot": [3, 1, 10], "knights": [4, 2, 10], "dragoons": [5, 2, 20],
+    "cavalry": [8, 3, 20], "armor": [10, 5, 30], "catapult": [6, 1, 10], "cannon": [8, 1, 20],
+    "artillery": [10, 1, 20], "howitzer": [12, 2, 30], "fighter": [4, 3, 20], "bomber": [12, 1, 20],
+    "helicopter": [10, 3, 20], "stealth fighter": [8, 4, 20], "stealth bomber": [18, 5, 20],
+    "trireme": [1, 1, 10], "caravel": [2, 1, 10], "galleon": [0, 2, 20], "frigate": [4, 2, 20],
+    "ironclad": [4, 4, 30], "destroyer": [4, 4, 30], "cruiser": [6, 6, 30], "aegis cruiser": [8, 8, 30],
+    "battleship": [12, 12, 40], "submarine": [12, 2, 30], "carrier": [1, 9, 40], "transport": [0, 3, 30],
+    "cruise missile": [18, 0, 10], "nuclear": [99, 0, 10], "diplomat": [0, 0, 10], "spy": [0, 0, 10],
+    "caravan": [0, 1, 10], "freight": [0, 1, 10], "explorer": [0, 1, 10], "leader": [0, 2, 20],
+    "barbarian leader": [0, 0, 10], "awacs": [0, 1, 20]
+}
+# vision_radius_sq
+VISUAL_RANGE = {
+    "settlers": 2, "workers": 2, "engineers": 2, "warriors": 2, "phalanx": 2, "archers": 2, "legion": 2,
+    "pikemen": 2, "musketeers": 2, "partisan": 2, "alpine troops": 2, "riflemen": 2, "marines": 2,
+    "paratroopers": 2, "mech. inf.": 2, "horsemen": 2, "chariot": 2, "knights": 2, "dragoons": 2, "cavalry": 2,
+    "armor": 2, "catapult": 2, "cannon": 2, "artillery": 2, "howitzer": 2, "fighter": 8, "bomber": 8,
+    "helicopter": 8, "stealth fighter": 8, "stealth bomber": 8, "trireme": 2, "caravel": 2, "galleon": 2,
+    "frigate": 2, "ironclad": 2, "destroyer": 8, "cruiser": 8, "aegis cruiser": 8, "battleship": 8,
+    "submarine": 8, "carrier": 8, "transport": 8, "cruise missile": 2, "nuclear": 2, "diplomat": 2, "spy": 8,
+    "caravan": 2, "freight": 2, "explorer": 2, "leader": 8, "barbarian leader": 2, "awacs": 26
+}
+OCEAN_UNITS = ["aegis cruiser", "trireme", "caravel", "galleon", "frigate", "ironclad", "transport",
+               "destroyer", "cruiser", "battleship", "submarine", "carrier"]
+
+
+def test_unit_types():
+    unit_types = get_classic_unit_types()
+    assert set(unit_types.names) == set(VISUAL_RANGE)
+    for name, code in unit_types.index.items():
+        assert unit_types.vision_radius_sq[code] == VISUAL_RANGE[name], name
+        assert UnitTool.get_vision_radius_sq(name.title()) == VISUAL_RANGE[name], name
+        assert unit_types.combat[code] == (name in UNIT_COMBAT_STATIS), name
+        assert unit_types.ocean[code] == (name in OCEAN_UNITS), name
+        if name in UNIT_COMBAT_STATIS:
+            attack, defense, hitpoints = UNIT_COMBAT_STATIS[name]
+            assert [unit_types.attack[code], unit_types.defense[code], unit_types.hitpoints[code]] == \
+                [attack, defense, hitpoints], name
+            assert unit_types.get_strength([code]) == attack * hitpoints * unit_types.firepower[code]
+            assert unit_types.get_strength([code], defense=True) == defense * hitpoints * unit_types.firepower[code]
+
+
+@pytest.mark.parametrize("filename", SAV_FILES, ids=os.path.basename)
+def test_unit_tool(filename):
+    unit_tool = UnitTool(SavParser(filename).get_player_unit_info(), unit_obsolete_conf=None)
+    arrays = unit_tool.get_unit_arrays()
+    index = 0
+    for player_id, tables in unit_tool._raw_data.items():
+        if "u" not in tables:
+            continue
+        names = [name.lower() for name in tables["u"]["type_by_name"]]
+        assert unit_tool.get_combat_unit_cnt()[player_id] == sum(name in UNIT_COMBAT_STATIS for name in names)
+        assert unit_tool.get_unit_cluster_cnt()[player_id] == {"land": sum(name not in OCEAN_UNITS for name in names),
+                                                                "ocean": sum(name in OCEAN_UNITS for name in names)}
+        for name in names:
+            assert arrays["player"][index] == player_id
+            assert arrays["vision_radius_sq"][index] == VISUAL_RANGE[name]
+            assert arrays["ocean"][index] == (name in OCEAN_UNITS)
+            index += 1
+    assert index == len(arrays["id"])
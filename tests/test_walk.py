@@ -0,0 +1,71 @@
+# Copyright (C) 2023  The Freeciv-sav project
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import multiprocessing
+import numpy as np
+import pytest
+from freeciv_sav.parser.ruleset import RulesetParser
+from freeciv_sav.tasks.benchmark import Benchmark
+import freeciv_sav
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "minitasks", "base")
+RULESET_DIR = os.path.join(os.path.dirname(freeciv_sav.__file__), "config", "classic")
+WEIGHT = {"food": 0.4, "shield": 0.4, "trade": 0.2}
+# MapTool of the sample sav, built once and shared with the forked workers
+MAP_TOOLS = dict()
+
+
+def get_map_tool(name:str="development_build_city"):
+    if name not in MAP_TOOLS:
+        MAP_TOOLS[name] = Benchmark._map_tool(os.path.join(BASE_DIR, f"myagent_T1_task_{name}.sav"), RulesetParser(RULESET_DIR))
+    return MAP_TOOLS[name]
+
+
+def walk_lines(_):
+    outputs = get_map_tool().gen_random_walk_maps("line", batch=2, max_steps=3, max_walks=10, weight=WEIGHT, score_bound=[2.5, 7])
+    return [terrain_output["global"] for terrain_output, _, _ in outputs]
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="no fork start method")
+def test_forked_workers_walk_different_maps():
+    get_map_tool()
+    np.random.seed(0)
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        first, second = pool.map(walk_lines, range(2), chunksize=1)
+    assert first != second
+
+
+def test_seed():
+    map_tool = get_map_tool()
+    kwargs = dict(batch=2, max_steps=3, max_walks=10, weight=WEIGHT, score_bound=[2.5, 7])
+    first = map_tool.gen_random_walk_maps("line", seed=5, **kwargs)
+    second = map_tool.gen_random_walk_maps("line", seed=5, **kwargs)
+    assert [output[0]["global"] for output in first] == [output[0]["global"] for output in second]
+
+
+@pytest.mark.parametrize("name", ["development_build_city", "battle_ancient_era", "development_transport"])
+@pytest.mark.parametrize("score_bound", [[4.0, 4.2], [6.0, 6.4], [7.0, 7.2]])
+@pytest.mark.parametrize("max_actions", [100, None])
+def test_tight_score_bound(name, score_bound, max_actions):
+    map_tool = get_map_tool(name)
+    outputs = map_tool.gen_random_walk_maps("line", batch=8, max_steps=4, max_walks=10, weight=WEIGHT, score_bound=score_bound,
+                                            seed=1, max_actions=max_actions)
+    assert len(outputs) == 8
+    assert all(len(report["covergence"]) == 4 for _, _, report in outputs)
+
+
+def test_bound_out_of_reach():
+    with pytest.raises(ValueError):
+        get_map_tool().gen_random_walk_maps("line", batch=2, max_steps=2, max_walks=5, weight=WEIGHT, score_bound=[100, 200], seed=1)